@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Assistant NUTRIKAL
+Interroge le modèle local (Ollama) avec les prompts système de
+system_prompts.json et le contexte nutritionnel du RAG, derrière un cache
+sémantique des réponses
+
+Usage:
+  python assistant.py "Quels aliments pour la mémoire ?"
+  python assistant.py --prompt meal_analysis_prompt "Saumon, riz complet, brocolis"
+  python assistant.py --warm-up "..."   # précharge le préfixe de chaque prompt système
+
+Les prompts système sont longs et fixes : ils sont toujours envoyés en tête,
+avant tout contenu variable, pour qu'Ollama réutilise leur préfixe déjà
+évalué (cache KV) au lieu de les retraiter à chaque requête.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import urllib.request
+
+import rag_setup
+from semantic_cache import SemanticCache
+from conversation_memory import ConversationMemory, RECENT_TURNS, estimate_tokens
+from llm_scheduler import LLMScheduler
+
+JAN_CONFIG_PATH = 'jan_config.json'
+SYSTEM_PROMPTS_PATH = 'system_prompts.json'
+ASSISTANT_NAME = 'nutrikal-assistant'
+OLLAMA_URL = os.environ.get('NUTRIKAL_OLLAMA_URL', 'http://localhost:11434')
+# Nom du modèle côté Ollama pour le llama2-7b-chat de jan_config.json
+OLLAMA_MODEL = os.environ.get('NUTRIKAL_OLLAMA_MODEL', 'llama2:7b-chat')
+OLLAMA_TIMEOUT_S = 300
+# Durée pendant laquelle Ollama garde le modèle et ses caches KV en mémoire
+OLLAMA_KEEP_ALIVE = os.environ.get('NUTRIKAL_OLLAMA_KEEP_ALIVE', '30m')
+# Générations simultanées acceptées par le serveur Ollama
+LLM_MAX_IN_FLIGHT = int(os.environ.get('NUTRIKAL_LLM_MAX_IN_FLIGHT', 2))
+DEFAULT_PROMPT = 'main_prompt'
+CONTEXT_K = 3
+# Fenêtre de contexte de llama2 et part maximale réservée à l'historique
+CONTEXT_WINDOW = 4096
+HISTORY_TOKEN_BUDGET = 1024
+
+SUMMARY_PROMPT = ("Résume en quelques puces factuelles (profil, objectifs, repas, conseils "
+                  "donnés) cette conversation de suivi nutritionnel, en complétant le résumé existant.")
+
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_SIZE = 512
+SEMANTIC_CACHE_TTL = 24 * 3600
+
+def load_jan_config(path=JAN_CONFIG_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def load_model_config(name=ASSISTANT_NAME, path=JAN_CONFIG_PATH):
+    """Paramètres du modèle `name` dans jan_config.json"""
+
+    config = load_jan_config(path)
+    for model in config.get('models', []):
+        if model.get('name') == name:
+            return model
+    raise ValueError(f"Modèle {name} absent de {path}")
+
+def load_system_prompts(path=SYSTEM_PROMPTS_PATH):
+    """Prompts système, par nom ("main_prompt", "daily_tracking_prompt"...)"""
+
+    with open(path, encoding='utf-8') as f:
+        return {name: prompt['content'] for name, prompt in json.load(f).items()}
+
+def resolve_prompt_name(name, prompts):
+    """Accepte aussi les noms courts de jan_config.json ("nutrikal_main")"""
+
+    short = name[len('nutrikal_'):] if name.startswith('nutrikal_') else name
+    for candidate in (name, short, f"{short}_prompt"):
+        if candidate in prompts:
+            return candidate
+    raise ValueError(f"Prompt système inconnu: {name} (disponibles: {', '.join(prompts)})")
+
+def format_context(docs):
+    return '\n'.join(f"- {doc.page_content}" for doc in docs)
+
+def prefill_ms(response):
+    """Temps avant le premier token : chargement du modèle et évaluation du prompt"""
+
+    return (response.get('load_duration', 0) + response.get('prompt_eval_duration', 0)) / 1e6
+
+class PrefixStats:
+    """Préfill économisé grâce à la réutilisation du préfixe d'un prompt système
+
+    Le préchauffage mesure le coût à froid du prompt système seul (tokens et
+    durée) ; une requête dont le préfixe est réutilisé n'évalue que la partie
+    variable. Les tokens économisés sont estimés en rapportant la taille du
+    prompt complet au ratio tokens/caractère du préfixe.
+    """
+
+    def __init__(self):
+        self.prefix_tokens = None
+        self.prefix_chars = None
+        self.prefix_ms = None
+        self.requests = 0
+        self.evaluated = 0
+        self.saved = 0
+        self.ttft_ms = 0.0
+        self.saved_ms = 0.0
+
+    def warmed(self, chars, response):
+        self.prefix_chars = chars
+        self.prefix_tokens = response.get('prompt_eval_count') or 0
+        self.prefix_ms = prefill_ms(response)
+
+    def record(self, chars, response):
+        evaluated = response.get('prompt_eval_count') or 0
+        self.requests += 1
+        self.evaluated += evaluated
+        self.ttft_ms += prefill_ms(response)
+        if self.prefix_tokens:
+            expected = chars * self.prefix_tokens / max(self.prefix_chars, 1)
+            saved = min(self.prefix_tokens, max(0, round(expected - evaluated)))
+            self.saved += saved
+            self.saved_ms += saved * self.prefix_ms / self.prefix_tokens
+
+    def summary(self):
+        requests = max(self.requests, 1)
+        return {
+            'requests': self.requests,
+            'prefix_tokens': self.prefix_tokens,
+            'prefill_tokens_evaluated': self.evaluated,
+            'prefill_tokens_saved': self.saved,
+            'ttft_ms': self.ttft_ms / requests,
+            'ttft_ms_without_reuse': (self.ttft_ms + self.saved_ms) / requests
+        }
+
+class OllamaClient:
+    """Client minimal de l'API HTTP d'Ollama"""
+
+    def __init__(self, url=OLLAMA_URL, timeout=OLLAMA_TIMEOUT_S):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, model, messages, options, keep_alive, stream, extra):
+        payload = dict(model=model, messages=messages, stream=stream, options=options or {},
+                       keep_alive=keep_alive, **extra)
+        return urllib.request.Request(
+            f"{self.url}/api/chat", data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+
+    def chat(self, model, messages, options=None, keep_alive=OLLAMA_KEEP_ALIVE, **extra):
+        request = self._request(model, messages, options, keep_alive, False, extra)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def chat_stream(self, model, messages, options=None, keep_alive=OLLAMA_KEEP_ALIVE, **extra):
+        """Génère les fragments JSON de la réponse au fil de leur production"""
+
+        request = self._request(model, messages, options, keep_alive, True, extra)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line.decode('utf-8'))
+
+class NutrikalAssistant:
+    """Assistant nutritionnel : RAG + modèle local + cache sémantique
+
+    La question est encodée avec le modèle d'embeddings du RAG ; si une
+    question assez proche a déjà reçu une réponse avec le même prompt
+    système et la même version d'index, cette réponse est réutilisée sans
+    appeler le modèle. Une question posée au fil d'une conversation dépend
+    de son historique et n'est jamais servie par ce cache.
+
+    Si `conversation_memory` est activé dans jan_config.json, l'historique
+    est géré par une ConversationMemory bornée (voir conversation_memory).
+
+    Tous les appels au modèle passent par un LLMScheduler partagé.
+    """
+
+    def __init__(self, retriever=None, client=None, cache=None, model=OLLAMA_MODEL,
+                 model_config=None, prompts=None, memory=None, summarize_with_model=False,
+                 scheduler=None):
+        self.retriever = retriever or rag_setup.load_retriever()
+        self.client = client or OllamaClient()
+        self.cache = cache if cache is not None else SemanticCache(
+            SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TTL
+        )
+        self.model = model
+        self.scheduler = scheduler or LLMScheduler(LLM_MAX_IN_FLIGHT)
+        self.model_config = model_config or load_model_config()
+        self.prompts = prompts or load_system_prompts()
+        self.prefixes = {name: PrefixStats() for name in self.prompts}
+
+        jan_config = load_jan_config()
+        if memory is None and jan_config.get('conversation_memory'):
+            memory = ConversationMemory(
+                recent_turns=min(RECENT_TURNS, jan_config.get('max_conversation_length', RECENT_TURNS)),
+                **({'summarizer': self.summarize} if summarize_with_model else {})
+            )
+        self.memory = memory
+
+    def options(self):
+        """Options de génération communes à tous les appels
+
+        `num_ctx` est explicite : Ollama recharge le modèle, et perd les
+        préfixes en cache, dès qu'une requête demande une autre fenêtre.
+        """
+
+        return {
+            'temperature': self.model_config.get('temperature', 0.7),
+            'num_predict': self.model_config.get('max_tokens', 512),
+            'num_ctx': CONTEXT_WINDOW
+        }
+
+    def warm_up(self, prompts=None):
+        """Évalue chaque prompt système seul pour que son préfixe reste en cache
+
+        Avec OLLAMA_NUM_PARALLEL au moins égal au nombre de prompts, chacun
+        garde son emplacement et son cache KV sur le serveur.
+        """
+
+        for name in prompts or self.prompts:
+            name = resolve_prompt_name(name, self.prompts)
+            system = self.prompts[name]
+            # Mêmes options que les requêtes : seul num_predict, sans effet sur le cache, diffère
+            response = self.client.chat(self.model, [{'role': 'system', 'content': system}],
+                                        dict(self.options(), num_predict=1))
+            self.prefixes[name].warmed(len(system), response)
+            print(f"🔥 Préfixe {name}: {self.prefixes[name].prefix_tokens} tokens "
+                  f"évalués en {self.prefixes[name].prefix_ms:.0f} ms")
+
+    def prefix_stats(self, warmed=False):
+        """Statistiques des préfixes utilisés (et préchauffés avec `warmed`)"""
+
+        return {name: stats.summary() for name, stats in self.prefixes.items()
+                if stats.requests or (warmed and stats.prefix_tokens is not None)}
+
+    def generate(self, messages, options, user_id=None, priority='interactive', deadline=None):
+        """Appel bloquant au modèle, ordonnancé et fusionné avec les prompts identiques"""
+
+        return self.scheduler.run(
+            self.prompt_key(messages, options),
+            lambda: self.client.chat(self.model, messages, options),
+            user_id, priority, deadline, tokens=lambda response: response.get('eval_count') or 0
+        )
+
+    def generate_stream(self, messages, options, user_id=None, priority='interactive', deadline=None):
+        return self.scheduler.stream(
+            self.prompt_key(messages, options),
+            lambda: self.client.chat_stream(self.model, messages, options),
+            user_id, priority, deadline
+        )
+
+    def prompt_key(self, messages, options):
+        payload = json.dumps([self.model, messages, options], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def summarize(self, summary, turns):
+        """Résumé glissant produit par le modèle (plus fidèle, mais coûte un appel)"""
+
+        transcript = '\n'.join(f"{role}: {content}" for role, content in turns)
+        response = self.generate([
+            {'role': 'system', 'content': SUMMARY_PROMPT},
+            {'role': 'user', 'content': f"Résumé existant:\n{summary or '(aucun)'}\n\n"
+                                        f"Nouveaux échanges:\n{transcript}"}
+        ], dict(self.options(), temperature=0.2, num_predict=200), priority='batch')
+        return response['message']['content'].strip()
+
+    def history_budget(self, messages):
+        """Tokens disponibles pour l'historique, une fois la réponse et le prompt réservés"""
+
+        used = sum(estimate_tokens(m['content']) for m in messages)
+        available = CONTEXT_WINDOW - self.options()['num_predict'] - used
+        return max(0, min(HISTORY_TOKEN_BUDGET, available))
+
+    def messages(self, system, context, question, conversation_id=None):
+        """Assemble le prompt du plus statique au plus variable
+
+        Prompt système, puis mémoire de la conversation, puis contexte RAG et
+        question : la taille du prompt reste bornée quelle que soit la
+        longueur de la conversation.
+        """
+
+        head = [{'role': 'system', 'content': system}]
+        tail = [{'role': 'user', 'content': f"Contexte nutritionnel:\n{context}\n\nQuestion: {question}"}]
+        history = []
+        if conversation_id is not None and self.memory is not None:
+            history = self.memory.messages(conversation_id, self.history_budget(head + tail))
+        return head + history + tail
+
+    def remember(self, conversation_id, question, answer):
+        if conversation_id is not None and self.memory is not None:
+            self.memory.append(conversation_id, 'user', question)
+            self.memory.append(conversation_id, 'assistant', answer)
+
+    def prepare(self, question, prompt=None, k=CONTEXT_K, conversation_id=None):
+        """Résout le cache sémantique, sinon récupère le contexte et assemble les messages"""
+
+        prompt = resolve_prompt_name(prompt or self.model_config.get('system_prompt', DEFAULT_PROMPT),
+                                     self.prompts)
+        system = self.prompts[prompt]
+        request = {'prompt': prompt, 'conversation_id': conversation_id, 'namespace': None}
+
+        # Une question posée au fil d'une conversation dépend de son historique
+        if conversation_id is None or self.memory is None or self.memory.is_empty(conversation_id):
+            request['namespace'] = self.cache.namespace(self.model, system, self.retriever.version)
+            request['vector'] = self.retriever.embed_query(question)
+            hit = self.cache.get(request['namespace'], request['vector'])
+            if hit is not None:
+                request['hit'] = hit
+                return request
+
+        request['docs'] = self.retriever.search(question, k=k)
+        request['messages'] = self.messages(system, format_context(request['docs']), question,
+                                            conversation_id)
+        return request
+
+    def finish(self, request, question, answer, response):
+        """Mémorise la réponse générée (cache, statistiques de préfixe, conversation)"""
+
+        if request['namespace'] is not None:
+            self.cache.put(request['namespace'], request['vector'], answer)
+        self.prefixes[request['prompt']].record(
+            sum(len(m['content']) for m in request['messages']), response
+        )
+        self.remember(request['conversation_id'], question, answer)
+
+    def metrics(self, request, response):
+        return {
+            'prompt': request['prompt'],
+            'cached': False,
+            'context_ids': [doc.metadata.get('id') for doc in request['docs']],
+            'prompt_tokens': response.get('prompt_eval_count'),
+            'completion_tokens': response.get('eval_count'),
+            'prompt_tokens_estimate': sum(estimate_tokens(m['content']) for m in request['messages']),
+            'prefill_ms': prefill_ms(response)
+        }
+
+    def ask(self, question, prompt=None, k=CONTEXT_K, conversation_id=None, user_id=None,
+            priority='interactive', deadline=None):
+        """Répond à une question ; retourne la réponse et ses métriques
+
+        `deadline` est une échéance absolue sur l'horloge de l'ordonnanceur
+        (voir LLMScheduler.deadline_in) ; `priority` vaut 'interactive' ou 'batch'.
+        """
+
+        started = time.perf_counter()
+        request = self.prepare(question, prompt, k, conversation_id)
+        if 'hit' in request:
+            answer, similarity = request['hit']
+            self.remember(conversation_id, question, answer)
+            return {'answer': answer, 'prompt': request['prompt'], 'cached': True,
+                    'similarity': similarity, 'took_ms': (time.perf_counter() - started) * 1000}
+
+        response = self.generate(request['messages'], self.options(), user_id or conversation_id,
+                                 priority, deadline)
+        answer = response['message']['content']
+        self.finish(request, question, answer, response)
+
+        result = self.metrics(request, response)
+        result.update(answer=answer, ttft_ms=result['prefill_ms'],
+                      took_ms=(time.perf_counter() - started) * 1000)
+        return result
+
+    def ask_stream(self, question, prompt=None, k=CONTEXT_K, conversation_id=None, user_id=None,
+                   priority='interactive', deadline=None):
+        """Répond au fil de la génération
+
+        Produit des événements ('token', texte) puis un ('done', métriques) ;
+        le temps jusqu'au premier token (ttft_ms) est mesuré séparément de la
+        durée totale (took_ms).
+        """
+
+        started = time.perf_counter()
+        request = self.prepare(question, prompt, k, conversation_id)
+        if 'hit' in request:
+            answer, similarity = request['hit']
+            self.remember(conversation_id, question, answer)
+            elapsed = (time.perf_counter() - started) * 1000
+            yield 'token', answer
+            yield 'done', {'prompt': request['prompt'], 'cached': True, 'similarity': similarity,
+                           'ttft_ms': elapsed, 'took_ms': elapsed}
+            return
+
+        tokens, ttft_ms, final = [], None, {}
+        for chunk in self.generate_stream(request['messages'], self.options(),
+                                          user_id or conversation_id, priority, deadline):
+            token = chunk.get('message', {}).get('content', '')
+            if token:
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                tokens.append(token)
+                yield 'token', token
+            if chunk.get('done'):
+                final = chunk
+
+        self.finish(request, question, ''.join(tokens), final)
+        result = self.metrics(request, final)
+        result.update(ttft_ms=ttft_ms, took_ms=(time.perf_counter() - started) * 1000)
+        yield 'done', result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Assistant NUTRIKAL")
+    parser.add_argument('questions', nargs='+')
+    parser.add_argument('--prompt', help="prompt système (main_prompt, daily_tracking_prompt...)")
+    parser.add_argument('-k', type=int, default=CONTEXT_K, help="aliments de contexte RAG")
+    parser.add_argument('--warm-up', action='store_true',
+                        help="précharger le préfixe de chaque prompt système")
+    parser.add_argument('--conversation', help="enchaîner les questions dans une même conversation")
+    parser.add_argument('--llm-summary', action='store_true',
+                        help="résumer l'historique ancien avec le modèle")
+    args = parser.parse_args(argv)
+
+    assistant = NutrikalAssistant(summarize_with_model=args.llm_summary)
+    if args.warm_up:
+        assistant.warm_up()
+    for question in args.questions:
+        result = assistant.ask(question, args.prompt, args.k, args.conversation)
+        source = f"cache, similarité {result['similarity']:.3f}" if result['cached'] else assistant.model
+        print(f"\n❓ {question}\n🤖 {result['answer']}\n⏱️ {result['took_ms']:.0f} ms ({source})")
+
+    stats = assistant.cache.stats()
+    print(f"\n🧠 Cache sémantique: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_rate']:.0%}), {stats['size']}/{stats['max_size']} réponses")
+    for name, stats in assistant.prefix_stats().items():
+        print(f"♻️ {name}: {stats['prefill_tokens_saved']} tokens de préfill économisés, "
+              f"TTFT moyen {stats['ttft_ms']:.0f} ms (≈{stats['ttft_ms_without_reuse']:.0f} ms sans réutilisation)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
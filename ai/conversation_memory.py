@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mémoire de conversation bornée pour l'assistant NUTRIKAL
+Garde les derniers échanges tels quels, résume les plus anciens et en
+extrait les faits utiles (allergies, aversions, objectifs, repas), sous un
+budget de tokens fixe quelle que soit la longueur de la conversation
+"""
+
+import re
+import math
+import threading
+from collections import OrderedDict
+
+# Estimation sans tokenizer : ~3,5 caractères par token pour du français
+CHARS_PER_TOKEN = 3.5
+RECENT_TURNS = 6
+SUMMARY_MAX_TOKENS = 256
+MAX_CONVERSATIONS = 1000
+
+FACT_PATTERNS = {
+    'allergies': re.compile(r"allergi(?:que|e)s?\s+(?:à|a|aux|au)\s+(?:l'|la |le |les )?([^.,;!?\n]+)", re.I),
+    'aversions': re.compile(r"(?:je n'aime pas|je déteste|pas de)\s+(?:l'|la |le |les |du |des )?([^.,;!?\n]+)", re.I),
+    'goals': re.compile(r"(?:mon objectif|je veux|j'aimerais|je voudrais)\s+(?:est\s+(?:de\s+)?|d')?([^.;!?\n]+)", re.I),
+    'meals': re.compile(r"(?:j'ai mangé|j'ai pris|au (?:petit-déj(?:euner)?|déjeuner|dîner))\s*:?\s*([^.;!?\n]+)", re.I)
+}
+FACT_LABELS = {'allergies': 'Allergies', 'aversions': 'Aversions', 'goals': 'Objectifs',
+               'meals': 'Repas notés'}
+# Nombre maximal de valeurs gardées par type de fait (les plus récentes)
+MAX_FACTS = {'allergies': 20, 'aversions': 20, 'goals': 5, 'meals': 15}
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def extract_facts(text):
+    """Faits structurés mentionnés dans un message de l'utilisateur"""
+
+    facts = {}
+    for kind, pattern in FACT_PATTERNS.items():
+        values = [value.strip() for value in pattern.findall(text) if value.strip()]
+        if values:
+            facts[kind] = values
+    return facts
+
+def summarize_turns(summary, turns):
+    """Résumé extractif : une ligne courte par message de l'utilisateur replié"""
+
+    lines = [summary] if summary else []
+    for role, content in turns:
+        if role == 'user':
+            line = ' '.join(content.split())
+            lines.append(f"- {line[:160]}{'…' if len(line) > 160 else ''}")
+    return '\n'.join(lines)
+
+def trim_summary(summary, max_tokens=SUMMARY_MAX_TOKENS):
+    """Retire les lignes les plus anciennes du résumé au-delà du budget"""
+
+    lines = summary.split('\n')
+    while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+class Conversation:
+    def __init__(self):
+        self.turns = []
+        self.summary = ''
+        self.facts = {kind: [] for kind in FACT_PATTERNS}
+        self.total_turns = 0
+
+    def remember(self, facts):
+        for kind, values in facts.items():
+            known = self.facts[kind]
+            for value in values:
+                if value.lower() not in (v.lower() for v in known):
+                    known.append(value)
+            del known[:-MAX_FACTS[kind]]
+
+    def facts_text(self):
+        return '\n'.join(f"{FACT_LABELS[kind]}: {', '.join(values)}"
+                         for kind, values in self.facts.items() if values)
+
+class ConversationMemory:
+    """Mémoire des conversations, bornée en tours et en tokens
+
+    Au-delà de `recent_turns` messages, les plus anciens sont repliés dans
+    un résumé glissant par `summarizer(résumé, tours)` (extractif par
+    défaut, ou un appel au modèle) ; les faits extraits des messages de
+    l'utilisateur sont conservés à part et toujours renvoyés.
+    """
+
+    def __init__(self, recent_turns=RECENT_TURNS, summarizer=summarize_turns,
+                 summary_max_tokens=SUMMARY_MAX_TOKENS, max_conversations=MAX_CONVERSATIONS):
+        self.recent_turns = recent_turns
+        self.summarizer = summarizer
+        self.summary_max_tokens = summary_max_tokens
+        self.max_conversations = max_conversations
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id):
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                conversation = self._conversations[conversation_id] = Conversation()
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+            self._conversations.move_to_end(conversation_id)
+            return conversation
+
+    def is_empty(self, conversation_id):
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+        return conversation is None or not conversation.total_turns
+
+    def append(self, conversation_id, role, content):
+        """Ajoute un message et replie les plus anciens dans le résumé"""
+
+        conversation = self.get(conversation_id)
+        with self._lock:
+            conversation.turns.append((role, content))
+            conversation.total_turns += 1
+            if role == 'user':
+                conversation.remember(extract_facts(content))
+            folded = conversation.turns[:-self.recent_turns] if self.recent_turns else conversation.turns[:]
+            del conversation.turns[:len(folded)]
+        if folded:
+            summary = self.summarizer(conversation.summary, folded)
+            with self._lock:
+                conversation.summary = trim_summary(summary, self.summary_max_tokens)
+
+    def messages(self, conversation_id, budget):
+        """Messages de mémoire à insérer dans le prompt, sous `budget` tokens
+
+        La mémoire (faits et résumé) passe en premier ; les tours récents
+        les plus anciens sont abandonnés jusqu'à tenir dans le budget.
+        """
+
+        conversation = self.get(conversation_id)
+        with self._lock:
+            facts = conversation.facts_text()
+            summary = conversation.summary
+            turns = list(conversation.turns)
+
+        # Les faits sont toujours gardés, le résumé se partage le reste de la moitié du budget
+        parts = [facts] if facts else []
+        if summary:
+            summary = trim_summary(summary, budget // 2 - estimate_tokens(facts))
+            if estimate_tokens(summary) <= budget // 2 - estimate_tokens(facts):
+                parts.append(f"Résumé des échanges précédents:\n{summary}")
+
+        messages = []
+        if parts:
+            messages.append({'role': 'system',
+                             'content': "Mémoire de la conversation:\n" + '\n'.join(parts)})
+        used = sum(estimate_tokens(m['content']) for m in messages)
+
+        recent = []
+        for role, content in reversed(turns):
+            cost = estimate_tokens(content)
+            if used + cost > budget:
+                break
+            recent.insert(0, {'role': role, 'content': content})
+            used += cost
+        return messages + recent
+
+    def stats(self, conversation_id):
+        conversation = self.get(conversation_id)
+        return {
+            'total_turns': conversation.total_turns,
+            'verbatim_turns': len(conversation.turns),
+            'summary_tokens': estimate_tokens(conversation.summary),
+            'facts': {kind: len(values) for kind, values in conversation.facts.items()}
+        }
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache persistant des embeddings pour le RAG NUTRIKAL
+Évite de recalculer les vecteurs d'un texte déjà encodé par le modèle
+"""
+
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+
+from langchain.embeddings.base import Embeddings
+
+def normalize_text(text):
+    """Normalise un texte avant calcul de sa clé de cache"""
+
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+class CachedEmbeddings(Embeddings):
+    """Enveloppe un modèle d'embeddings avec un cache SQLite sur disque
+
+    Les vecteurs sont indexés par (nom du modèle, empreinte du texte normalisé)
+    et stockés en float32. Au-delà de `max_entries`, les entrées les moins
+    récemment utilisées sont évincées.
+
+    `variant` distingue les vecteurs d'un même modèle calculés par un autre
+    backend (ONNX int8...), proches mais pas identiques.
+    """
+
+    def __init__(self, embeddings, model_name, path='embedding_cache.sqlite', max_entries=100_000,
+                 variant=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.namespace = f"{model_name}#{variant}" if variant else model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL,"
+            " vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)"
+        )
+        self._conn.commit()
+
+    def _key(self, text, kind):
+        payload = f"{self.namespace}\0{kind}\0{normalize_text(text)}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            )
+            for key, blob in rows:
+                found[key] = array('f', blob).tolist()
+        return found
+
+    def _store(self, items):
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+            [(key, self.namespace, array('f', vector).tobytes(), now) for key, vector in items]
+        )
+        self._evict()
+
+    def _touch(self, keys):
+        now = time.time()
+        self._conn.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in keys]
+        )
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def _embed(self, texts, kind, compute):
+        keys = [self._key(text, kind) for text in texts]
+        with self._lock:
+            found = self._lookup(list(set(keys)))
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found:
+                    missing.setdefault(key, text)
+            miss_count = sum(1 for key in keys if key in missing)
+            self.hits += len(keys) - miss_count
+            self.misses += miss_count
+
+        if missing:
+            vectors = compute(list(missing.values()))
+            found.update(zip(missing.keys(), vectors))
+
+        with self._lock:
+            self._touch([key for key in found if key not in missing])
+            if missing:
+                self._store([(key, found[key]) for key in missing])
+            self._conn.commit()
+
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed(texts, 'doc', self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed([text], 'query', lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def embed_queries(self, texts):
+        """Encode plusieurs requêtes en un seul lot
+
+        Le modèle MiniLM encode requêtes et documents de la même façon : les
+        requêtes manquantes passent par `embed_documents` en une seule passe.
+        """
+
+        compute = getattr(self.embeddings, 'embed_queries', self.embeddings.embed_documents)
+        return self._embed(texts, 'query', compute)
+
+    def stats(self):
+        """Compteurs de hits/misses et taille actuelle du cache"""
+
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': count,
+            'max_entries': self.max_entries
+        }
+
+    def clear(self):
+        """Vide entièrement le cache"""
+
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Types d'index FAISS pour le RAG NUTRIKAL
+Index exact (flat) ou approchés (IVF-Flat, HNSW, IVF-PQ) choisis à la
+construction (voir rag_setup.index_config), avec rapport de rappel par
+rapport à l'index exact
+"""
+
+import os
+import time
+import pickle
+import random
+
+import faiss
+import numpy as np
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.docstore.document import Document
+from langchain.vectorstores import FAISS
+
+# Projection en mémoire des codes de l'index : les processus qui chargent le
+# même fichier partagent ses pages au lieu d'en garder chacun une copie
+MMAP_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+# Au-delà, une recherche restreinte passe par FAISS plutôt que par un
+# reclassement exact des vecteurs reconstruits
+EXACT_AMONG_MAX = 4096
+
+def create_index(config, vectors):
+    """Crée et entraîne un index FAISS vide adapté à `vectors`
+
+    Retourne (index, paramètres effectifs) : nlist et pq_bits sont réduits
+    si `vectors` ne suffit pas à les entraîner, avec un avertissement.
+    """
+
+    n, dim = vectors.shape
+    kind = config['type']
+    used = dict(config)
+
+    if kind == 'flat':
+        return faiss.IndexFlatL2(dim), used
+
+    if kind == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, config['M'])
+        index.hnsw.efConstruction = config['efConstruction']
+        return index, used
+
+    # FAISS recommande au moins ~39 points d'entraînement par liste
+    used['nlist'] = max(1, min(config['nlist'], n // 39))
+    quantizer = faiss.IndexFlatL2(dim)
+    if kind == 'ivf_flat':
+        index = faiss.IndexIVFFlat(quantizer, dim, used['nlist'])
+    else:
+        if dim % config['pq_m']:
+            raise ValueError(f"pq_m={config['pq_m']} doit diviser la dimension {dim}")
+        # 2^bits centroïdes par sous-quantifieur, à entraîner sur assez de points
+        used['pq_bits'] = max(1, min(config['pq_bits'], int(np.log2(max(n // 39, 2)))))
+        index = faiss.IndexIVFPQ(quantizer, dim, used['nlist'], config['pq_m'], used['pq_bits'])
+    for name in ('nlist', 'pq_bits'):
+        if used.get(name) != config.get(name):
+            print(f"⚠️ {name} ramené de {config[name]} à {used[name]} : "
+                  f"{n} vecteurs ne suffisent pas à l'entraîner (~39 par centroïde)")
+    index.train(vectors)
+    return index, used
+
+def apply_search_params(index, config):
+    """Applique les paramètres de recherche (nprobe, efSearch) à un index"""
+
+    if config['type'] in ('ivf_flat', 'ivf_pq'):
+        faiss.extract_index_ivf(index).nprobe = config['nprobe']
+    elif config['type'] == 'hnsw':
+        index.hnsw.efSearch = config['efSearch']
+
+def enable_reconstruct(index):
+    """Table position -> liste d'un index IVF, nécessaire à `reconstruct`
+
+    Construite au chargement : la créer pendant une recherche concurrente
+    modifierait l'index sous les autres lecteurs.
+    """
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+
+def search_among(index, vector, k, positions):
+    """Les k plus proches de `vector` parmi `positions` : (distances, positions)
+
+    Un IDSelector ne filtre que les listes sondées (IVF) ou les nœuds
+    visités (HNSW) et perdrait des candidats : un petit ensemble est
+    reclassé exactement sur ses vecteurs reconstruits ; un grand est
+    cherché en sondant toutes les listes ou avec un efSearch élargi, et
+    reclassé exactement s'il manque des résultats.
+    """
+
+    positions = np.asarray(positions, dtype='int64')
+    vector = np.asarray(vector, dtype='float32').reshape(1, -1)
+    k = min(k, len(positions))
+    exhaustive = isinstance(index, faiss.IndexFlat)
+    if k == 0 or (not exhaustive and len(positions) <= EXACT_AMONG_MAX):
+        return _exact_among(index, vector, k, positions)
+
+    selector = faiss.IDSelectorBatch(positions)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nlist)
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(index.hnsw.efSearch, 8 * k))
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    distances, found = index.search(vector, k, params=params)
+    if (found[0] != -1).sum() < k:
+        return _exact_among(index, vector, k, positions)
+    return distances[0], found[0]
+
+def _exact_among(index, vector, k, positions):
+    vectors = index.reconstruct_batch(positions)
+    distances = ((vectors - vector) ** 2).sum(axis=1)
+    order = np.argsort(distances, kind='stable')[:k]
+    return distances[order], positions[order]
+
+def build_vectorstore(text_embeddings, embeddings, metadatas, ids, config):
+    """Construit un vectorstore LangChain FAISS sur l'index configuré
+
+    Retourne (vectorstore, paramètres effectifs de l'index), ces derniers
+    à enregistrer dans le manifeste.
+    """
+
+    vectors = np.array([vector for _, vector in text_embeddings], dtype='float32')
+    index, config = create_index(config, vectors)
+    apply_search_params(index, config)
+    enable_reconstruct(index)
+    index.add(vectors)
+
+    documents = {
+        doc_id: Document(page_content=text, metadata=metadata)
+        for doc_id, (text, _), metadata in zip(ids, text_embeddings, metadatas)
+    }
+    return FAISS(embeddings, index, InMemoryDocstore(documents), dict(enumerate(ids))), config
+
+def load_vectorstore(folder, embeddings, config, mmap=True, index_name='index'):
+    """Charge un vectorstore sauvegardé par `save_local`
+
+    Avec `mmap`, l'index est projeté en mémoire en lecture seule au lieu
+    d'être copié ; il ne peut alors plus être modifié.
+    """
+
+    index = faiss.read_index(
+        os.path.join(folder, f"{index_name}.faiss"), MMAP_FLAGS if mmap else 0
+    )
+    with open(os.path.join(folder, f"{index_name}.pkl"), 'rb') as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    apply_search_params(index, config)
+    enable_reconstruct(index)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+def recall_report(vectors, config, k=10, n_queries=200, seed=0):
+    """Compare le rappel@k et la latence d'un index à l'index exact
+
+    Les requêtes sont un échantillon des vecteurs indexés eux-mêmes.
+    """
+
+    vectors = np.asarray(vectors, dtype='float32')
+    k = min(k, len(vectors))
+    sample = random.Random(seed).sample(range(len(vectors)), min(n_queries, len(vectors)))
+    queries = vectors[sample]
+
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    started = time.perf_counter()
+    _, exact = flat.search(queries, k)
+    flat_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    index, config = create_index(config, vectors)
+    apply_search_params(index, config)
+    index.add(vectors)
+    started = time.perf_counter()
+    _, approx = index.search(queries, k)
+    index_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    recall = np.mean([
+        len(set(a[a >= 0]) & set(e)) / k for a, e in zip(approx, exact)
+    ])
+    return {
+        'type': config['type'],
+        'index': config,
+        'k': k,
+        'queries': len(queries),
+        'recall_at_k': float(recall),
+        'flat_ms_per_query': flat_ms,
+        'index_ms_per_query': index_ms
+    }
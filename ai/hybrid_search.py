@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Recherche hybride pour le RAG NUTRIKAL
+Combine un index lexical BM25 (aliment, catégorie, bénéfices) et l'index
+vectoriel FAISS par fusion des rangs réciproques (RRF)
+"""
+
+import os
+import re
+import json
+import math
+import unicodedata
+
+import numpy as np
+
+from nutrient_filter import parse_constraints
+from faiss_index import search_among
+
+BM25_FILE = 'bm25.json'
+BM25_FIELDS = ['aliment', 'categorie', 'benefices_cerveau']
+
+# Termes qui, seuls autour d'une contrainte numérique, n'apportent rien à classer
+GENERIC_TERMS = {'aliment', 'source', 'produit', 'nourriture', 'quel', 'quoi', 'manger'}
+
+STOPWORDS = {
+    'a', 'au', 'aux', 'avec', 'ce', 'ces', 'd', 'dans', 'de', 'des', 'du', 'en',
+    'et', 'l', 'la', 'le', 'les', 'leur', 'mon', 'ou', 'par', 'pour', 'qui',
+    'que', 'sa', 'se', 'son', 'sur', 'un', 'une'
+}
+
+def tokenize(text):
+    """Découpe un texte en termes normalisés (minuscules, sans accents)"""
+
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    # "oméga-3" et "omega3" doivent produire le même terme
+    text = re.sub(r'(?<=\w)-(?=\w)', '', text)
+    terms = []
+    for term in re.findall(r'\w+', text):
+        if term in STOPWORDS:
+            continue
+        if len(term) > 3 and term[-1] in 'sx':
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+def row_terms(row, fields=BM25_FIELDS):
+    """Termes indexés par BM25 pour une ligne de la base"""
+
+    return tokenize(' '.join(row.get(field, '') for field in fields))
+
+class BM25Index:
+    """Index inversé BM25 en mémoire sur les colonnes textuelles du CSV"""
+
+    def __init__(self, ids, doc_len, postings, k1=1.5, b=0.75):
+        self.ids = ids
+        self.doc_len = doc_len
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.avg_len = sum(doc_len) / len(doc_len) if doc_len else 0.0
+
+    @classmethod
+    def from_rows(cls, rows, fields=BM25_FIELDS):
+        """Construit l'index à partir des tuples (clé, empreinte, ligne)"""
+
+        index = cls([], [], {})
+        index.add([key for key, _, _ in rows], [row_terms(row, fields) for _, _, row in rows])
+        return index
+
+    def add(self, ids, terms):
+        """Ajoute des documents déjà découpés en termes (`terms[i]` pour `ids[i]`)"""
+
+        total = self.avg_len * len(self.ids)
+        for key, doc_terms in zip(ids, terms):
+            idx = len(self.ids)
+            self.ids.append(key)
+            self.doc_len.append(len(doc_terms))
+            total += len(doc_terms)
+            counts = {}
+            for term in doc_terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((idx, tf))
+        self.avg_len = total / len(self.ids) if self.ids else 0.0
+
+    def save(self, folder):
+        with open(os.path.join(folder, BM25_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'ids': self.ids, 'doc_len': self.doc_len, 'postings': self.postings}, f)
+
+    @classmethod
+    def load(cls, folder):
+        with open(os.path.join(folder, BM25_FILE), encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['ids'], data['doc_len'], data['postings'])
+
+    def search(self, query, k=4):
+        """Retourne les k meilleurs (id, score, termes couverts)"""
+
+        terms = set(tokenize(query))
+        n_docs = len(self.ids)
+        scores, matched = {}, {}
+        for term in terms:
+            postings = self.postings.get(term, [])
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for idx, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[idx] / self.avg_len)
+                scores[idx] = scores.get(idx, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[idx] = matched.get(idx, 0) + 1
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [(self.ids[idx], scores[idx], matched[idx] / len(terms)) for idx in ranked]
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fusionne plusieurs listes d'IDs ordonnées par rangs réciproques"""
+
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+class HybridRetriever:
+    """Recherche BM25 + FAISS fusionnée par RRF
+
+    Si les k meilleurs résultats BM25 contiennent tous les termes de la
+    requête, ils sont jugés fiables et renvoyés sans calculer d'embedding.
+
+    Les contraintes nutritionnelles de la requête ("riche en oméga-3") sont
+    d'abord résolues par `nutrients` ; la recherche vectorielle ne classe
+    alors que les aliments candidats.
+
+    Avec un `cache` (QueryCache), les embeddings de requêtes et les IDs des
+    résultats sont mémorisés pour la `version` de l'index.
+
+    `vectorstore` peut être un ShardRouter (index par catégorie) : la
+    recherche vectorielle est alors routée vers les catégories citées par
+    la requête, ou répartie sur tous les index.
+    """
+
+    def __init__(self, vectorstore, bm25, nutrients=None, fetch_k=20, cache=None, version=None):
+        self.vectorstore = vectorstore
+        self.bm25 = bm25
+        self.nutrients = nutrients
+        self.fetch_k = fetch_k
+        self.cache = cache
+        self.version = version
+        self.keyword_only = 0
+        self.fused = 0
+        self.filtered = 0
+        self._positions = None
+        self.sharded = hasattr(vectorstore, 'search_vectors')
+        if cache is not None:
+            cache.bind(version)
+
+    def _documents(self, ids):
+        return [self.vectorstore.docstore.search(doc_id) for doc_id in ids]
+
+    def _embed_queries(self, queries):
+        """Encode les requêtes absentes du cache en une seule passe du modèle"""
+
+        vectors = [None] * len(queries)
+        missing = []
+        for i, query in enumerate(queries):
+            if self.cache is not None:
+                vectors[i] = self.cache.get(self.cache.key('embedding', query))
+            if vectors[i] is None:
+                missing.append(i)
+
+        if missing:
+            embedding = self.vectorstore.embedding_function
+            texts = [queries[i] for i in missing]
+            if len(texts) == 1:
+                computed = [embedding.embed_query(texts[0])]
+            else:
+                embed_many = getattr(embedding, 'embed_queries', embedding.embed_documents)
+                computed = embed_many(texts)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+                if self.cache is not None:
+                    self.cache.put(self.cache.key('embedding', queries[i]), vector)
+        return vectors
+
+    def embed_query(self, query):
+        """Embedding d'une requête, partagé avec le cache des recherches"""
+
+        return self._embed_queries([query])[0]
+
+    def _ids_at(self, positions):
+        return [self.vectorstore.index_to_docstore_id[pos] for pos in positions if pos != -1]
+
+    def _vector_search(self, vectors, k, queries=None):
+        """Recherche FAISS groupée : une liste d'IDs par vecteur de requête"""
+
+        if self.sharded:
+            routes = [self.vectorstore.route(query) for query in queries] if queries else None
+            return self.vectorstore.search_vectors(vectors, k, routes)
+        _, found = self.vectorstore.index.search(np.array(vectors, dtype='float32'), k)
+        return [self._ids_at(row) for row in found]
+
+    def _vector_search_among(self, vector, k, doc_ids):
+        """Recherche FAISS restreinte à un sous-ensemble de documents"""
+
+        if self.sharded:
+            return self.vectorstore.search_among(vector, k, doc_ids)
+        if self._positions is None:
+            self._positions = {doc_id: pos for pos, doc_id in self.vectorstore.index_to_docstore_id.items()}
+        _, found = search_among(self.vectorstore.index, vector, k,
+                                [self._positions[doc_id] for doc_id in doc_ids])
+        return self._ids_at(found)
+
+    def search(self, query, k=4):
+        return self.search_many([query], k)[0]
+
+    def search_many(self, queries, k=4):
+        """Recherche plusieurs requêtes, résultats dans l'ordre des requêtes
+
+        Les requêtes qui ont besoin d'un embedding sont encodées en un seul
+        lot, et celles sans contrainte nutritionnelle partagent une seule
+        recherche FAISS.
+        """
+
+        results = [None] * len(queries)
+        computed = []
+        pending = []
+        for i, query in enumerate(queries):
+            if self.cache is not None:
+                results[i] = self.cache.get(self.cache.key('results', query, k))
+            if results[i] is None:
+                computed.append(i)
+                ids, plan = self._plan(query, k)
+                if ids is not None:
+                    results[i] = ids
+                else:
+                    pending.append((i, plan))
+
+        if pending:
+            vectors = self._embed_queries([queries[i] for i, _ in pending])
+            fused = [(i, plan, vector) for (i, plan), vector in zip(pending, vectors) if plan[0] == 'fused']
+            if fused:
+                hits = self._vector_search([vector for _, _, vector in fused], max(k, self.fetch_k),
+                                           [queries[i] for i, _, _ in fused])
+                for (i, (_, keyword_hits), _), vector_ids in zip(fused, hits):
+                    results[i] = reciprocal_rank_fusion([
+                        vector_ids, [doc_id for doc_id, _, _ in keyword_hits]
+                    ])[:k]
+            for (i, plan), vector in zip(pending, vectors):
+                if plan[0] == 'among':
+                    results[i] = self._vector_search_among(vector, k, plan[1])
+
+        # Seuls les nouveaux résultats sont stockés : un hit ne prolonge pas sa durée de vie
+        if self.cache is not None:
+            for i in computed:
+                self.cache.put(self.cache.key('results', queries[i], k), results[i])
+        return [self._documents(ids) for ids in results]
+
+    def _plan(self, query, k):
+        """Résout ce qui peut l'être sans embedding
+
+        Retourne (ids, None) si la requête est résolue, sinon (None, plan)
+        avec plan = ('among', candidats) ou ('fused', résultats BM25).
+        """
+
+        if self.nutrients is not None:
+            constraints, remainder = parse_constraints(query)
+            if constraints:
+                self.filtered += 1
+                candidates = self.nutrients.candidates(constraints)
+                if not candidates:
+                    return [], None
+                # Sans autre critère que la contrainte, l'ordre des valeurs suffit
+                if not [term for term in tokenize(remainder) if term not in GENERIC_TERMS]:
+                    return candidates[:k], None
+                return None, ('among', candidates)
+
+        keyword_hits = self.bm25.search(query, max(k, self.fetch_k))
+
+        if len(keyword_hits) >= k and all(coverage == 1.0 for _, _, coverage in keyword_hits[:k]):
+            self.keyword_only += 1
+            return [doc_id for doc_id, _, _ in keyword_hits[:k]], None
+
+        self.fused += 1
+        return None, ('fused', keyword_hits)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Versions de l'index vectoriel NUTRIKAL
+Chaque construction écrit un nouveau dossier versions/<date UTC>-<version>,
+publié en remplaçant atomiquement le pointeur CURRENT : un lecteur voit
+toujours un index complet, jamais un index en cours d'écriture
+
+Sans dépendance lourde : utilisé aussi par `rag_setup.py check`.
+"""
+
+import os
+import time
+import shutil
+
+CURRENT_FILE = 'CURRENT'
+VERSIONS_DIR = 'versions'
+STAGING_PREFIX = '.staging-'
+INGEST_PREFIX = '.ingest-'
+DEFAULT_RETENTION = 3
+
+# Fichiers de l'ancien format, écrits directement dans le dossier de l'index
+LEGACY_FILES = ['index.faiss', 'index.pkl', 'bm25.json', 'nutrients.json', 'manifest.json']
+
+def current_version(root):
+    """Nom de la version publiée, ou None"""
+
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def current_dir(root):
+    """Dossier de la version publiée ; `root` lui-même pour un index à l'ancien format"""
+
+    name = current_version(root)
+    return os.path.join(root, VERSIONS_DIR, name) if name else root
+
+def list_versions(root):
+    """Versions publiées, de la plus ancienne à la plus récente"""
+
+    folder = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name for name in os.listdir(folder) if not name.startswith('.'))
+
+def new_staging_dir(root, prefix=STAGING_PREFIX):
+    """Dossier de travail d'une construction, invisible des lecteurs"""
+
+    folder = os.path.join(root, VERSIONS_DIR, f"{prefix}{os.getpid()}-{time.time_ns()}")
+    os.makedirs(folder)
+    return folder
+
+def discard_staging(root, prefix):
+    """Supprime les dossiers de travail d'un type donné"""
+
+    folder = os.path.join(root, VERSIONS_DIR)
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            if name.startswith(prefix):
+                shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass
+    return True
+
+def publish(root, staging, version, retention=DEFAULT_RETENTION):
+    """Publie un dossier de travail complet comme version courante
+
+    Le dossier est renommé puis CURRENT est remplacé par os.replace, atomique
+    sur un même système de fichiers. Retourne le nom de la version publiée.
+    """
+
+    # Horodatage UTC à la microseconde : l'ordre des noms est celui des
+    # publications, y compris au passage à l'heure d'hiver
+    now = time.time_ns() // 1000
+    name = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now // 10**6))}.{now % 10**6:06d}-{version}"
+    os.rename(staging, os.path.join(root, VERSIONS_DIR, name))
+
+    # Fichier temporaire propre à ce processus : deux publications simultanées
+    # ne s'écrasent pas, la dernière à remplacer CURRENT l'emporte
+    tmp = os.path.join(root, f"{CURRENT_FILE}.{os.getpid()}-{time.time_ns()}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+    prune(root, retention)
+    return name
+
+def prune(root, retention=DEFAULT_RETENTION):
+    """Supprime les versions au-delà des `retention` plus récentes
+
+    La version courante est toujours conservée, ainsi que les dossiers de
+    travail des constructions encore en cours. Un lecteur qui utilise une
+    version supprimée garde ses fichiers ouverts ou projetés en mémoire.
+    """
+
+    current = current_version(root)
+    removed = []
+    for name in list_versions(root)[:-retention or None]:
+        if name != current:
+            shutil.rmtree(os.path.join(root, VERSIONS_DIR, name), ignore_errors=True)
+            removed.append(name)
+
+    # Constructions interrompues (l'ingestion, reprenable, garde son dossier)
+    folder = os.path.join(root, VERSIONS_DIR)
+    for name in os.listdir(folder):
+        if name.startswith(STAGING_PREFIX) and not _pid_alive(int(name[len(STAGING_PREFIX):].split('-')[0])):
+            shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+    for name in os.listdir(root):
+        if (name.startswith(f"{CURRENT_FILE}.") and name.endswith('.tmp')
+                and not _pid_alive(int(name[len(CURRENT_FILE) + 1:].split('-')[0]))):
+            os.remove(os.path.join(root, name))
+
+    # L'ancien format à plat n'est plus lu une fois une version publiée
+    if current is not None:
+        for name in LEGACY_FILES:
+            if os.path.exists(os.path.join(root, name)):
+                os.remove(os.path.join(root, name))
+        if os.path.isdir(os.path.join(root, 'shards')):
+            shutil.rmtree(os.path.join(root, 'shards'), ignore_errors=True)
+    return removed
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Détection des aliments quasi dupliqués avant indexation
+MinHash/LSH sur les noms pour trouver les paires candidates, confirmées
+par la proximité des valeurs nutritionnelles ; chaque groupe est fusionné
+en une entrée canonique ("Saumon", "Saumon atlantique cru", "saumon frais")
+"""
+
+import zlib
+import hashlib
+
+import numpy as np
+
+from hybrid_search import tokenize
+
+NUMERIC_COLUMNS = ['calories_100g', 'proteines_100g', 'omega3_100g', 'magnesium_100g']
+TEXT_COLUMNS = ['categorie', 'benefices_cerveau', 'conseils_consommation']
+
+NUM_PERM = 64
+# 32 bandes de 2 valeurs : une paire devient candidate dès ~20 % de Jaccard
+BANDS = 32
+# Seaux trop peuplés (trigrammes très courants) ignorés pour rester quasi linéaire
+MAX_BUCKET = 200
+_PRIME = (1 << 61) - 1
+
+# Part des termes du nom le plus court présents dans l'autre
+NAME_CONTAINMENT = 0.5
+# Écart toléré par nutriment : relatif, avec un plancher absolu pour les petites valeurs
+NUTRIENT_TOLERANCE = 0.25
+NUTRIENT_FLOORS = {'calories_100g': 40, 'proteines_100g': 3, 'omega3_100g': 0.3, 'magnesium_100g': 15}
+MIN_SHARED_NUTRIENTS = 2
+
+def _number(value):
+    try:
+        return float(str(value).replace(',', '.'))
+    except (TypeError, ValueError):
+        return None
+
+def shingles(terms):
+    """Trigrammes de caractères du nom normalisé"""
+
+    text = f" {' '.join(terms)} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class MinHasher:
+    """Signatures MinHash par permutations universelles (a * x + b) mod p"""
+
+    def __init__(self, num_perm=NUM_PERM, seed=0):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+
+    def signature(self, items):
+        hashes = np.array([zlib.crc32(item.encode('utf-8')) for item in items], dtype=np.uint64)
+        # Produits sur 64 bits : le débordement reste une permutation convenable
+        return ((np.outer(hashes, self.a) + self.b) % _PRIME).min(axis=0)
+
+def lsh_buckets(signatures, bands=BANDS, max_bucket=MAX_BUCKET):
+    """Groupes d'indices partageant une bande de signature (candidats entre eux)"""
+
+    rows = len(signatures[0]) // bands if signatures else 0
+    for band in range(bands):
+        buckets = {}
+        for i, signature in enumerate(signatures):
+            key = signature[band * rows:(band + 1) * rows].tobytes()
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            if 1 < len(members) <= max_bucket:
+                yield members
+
+def name_containment(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / min(len(a), len(b)) if a and b else 0.0
+
+def nutrients_close(a, b):
+    """Vrai si les nutriments connus des deux lignes sont proches ; None si trop peu sont communs"""
+
+    shared = 0
+    for column in NUMERIC_COLUMNS:
+        x, y = _number(a.get(column)), _number(b.get(column))
+        if x is None or y is None:
+            continue
+        shared += 1
+        if abs(x - y) > max(NUTRIENT_TOLERANCE * max(abs(x), abs(y)), NUTRIENT_FLOORS[column]):
+            return False
+    return True if shared >= MIN_SHARED_NUTRIENTS else None
+
+def _completeness(row, terms):
+    filled = sum(1 for column in NUMERIC_COLUMNS if _number(row.get(column)) is not None)
+    filled += sum(1 for column in TEXT_COLUMNS if str(row.get(column) or '').strip())
+    # À complétude égale, le nom le plus générique ("Saumon") représente le groupe
+    return filled, -len(terms), -len(row.get('aliment', ''))
+
+def merge_cluster(members):
+    """Entrée canonique : la ligne la plus complète, ses champs vides complétés par les autres"""
+
+    canonical = dict(members[0])
+    for row in members[1:]:
+        for column, value in row.items():
+            if str(canonical.get(column) or '').strip() == '' and str(value or '').strip():
+                canonical[column] = value
+    return canonical
+
+def dedup_rows(rows):
+    """Fusionne les aliments quasi dupliqués
+
+    `rows` : tuples (clé, empreinte, ligne) de read_kb_rows. Retourne
+    (lignes conservées, rapport). L'empreinte d'une entrée fusionnée couvre
+    tous les membres du groupe : modifier l'un d'eux la fait réindexer.
+    """
+
+    terms = [tokenize(row.get('aliment', '')) for _, _, row in rows]
+    hasher = MinHasher()
+    signatures = [hasher.signature(shingles(t) or {' '}) for t in terms]
+
+    parent = list(range(len(rows)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def similar(i, j):
+        if name_containment(terms[i], terms[j]) < NAME_CONTAINMENT:
+            return False
+        close = nutrients_close(rows[i][2], rows[j][2])
+        # Sans valeurs comparables, seul un nom identique suffit
+        return close or (close is None and set(terms[i]) == set(terms[j]))
+
+    # Dans un seau, chaque ligne est comparée au premier membre de chaque
+    # groupe déjà formé ; une paire rejetée n'est pas revérifiée dans une autre bande
+    candidates, rejected = 0, set()
+    for members in lsh_buckets(signatures):
+        leaders = {}
+        for i in members:
+            root = find(i)
+            if root in leaders:
+                continue
+            for leader in leaders.values():
+                if (leader, i) in rejected:
+                    continue
+                candidates += 1
+                if similar(leader, i):
+                    parent[root] = find(leader)
+                    break
+                rejected.add((leader, i))
+            else:
+                leaders[root] = i
+
+    clusters = {}
+    for i in range(len(rows)):
+        clusters.setdefault(find(i), []).append(i)
+
+    kept, merged = [], []
+    for members in clusters.values():
+        if len(members) == 1:
+            kept.append((members[0], rows[members[0]]))
+            continue
+        members.sort(key=lambda i: _completeness(rows[i][2], terms[i]), reverse=True)
+        head = members[0]
+        digest = hashlib.sha256(''.join(sorted(rows[i][1] for i in members)).encode('utf-8')).hexdigest()
+        kept.append((head, (rows[head][0], digest, merge_cluster([rows[i][2] for i in members]))))
+        merged.append((rows[head][2].get('aliment', ''),
+                       [rows[i][2].get('aliment', '') for i in members[1:]]))
+
+    kept.sort(key=lambda item: item[0])
+    return [row for _, row in kept], {
+        'rows': len(rows),
+        'kept': len(kept),
+        'removed': len(rows) - len(kept),
+        'candidates': candidates,
+        'clusters': merged
+    }
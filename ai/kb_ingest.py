@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ingestion par blocs des tables de composition nutritionnelle
+Lit un export volumineux (Ciqual, Open Food Facts...) par blocs de lignes,
+ramène chaque ligne au schéma de nutrition_kb.csv et la valide, et garde
+l'état de progression pour reprendre une ingestion interrompue
+"""
+
+import os
+import re
+import csv
+import json
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+KB_COLUMNS = ['aliment', 'categorie', 'calories_100g', 'proteines_100g', 'omega3_100g',
+              'magnesium_100g', 'benefices_cerveau', 'conseils_consommation']
+NUMERIC_COLUMNS = ['calories_100g', 'proteines_100g', 'omega3_100g', 'magnesium_100g']
+
+# En-têtes reconnus (normalisés : minuscules, sans accents ni espaces multiples)
+COLUMN_ALIASES = {
+    'aliment': ['aliment', 'alim_nom_fr', 'nom', 'food_name', 'product_name', 'name'],
+    'categorie': ['categorie', 'alim_grp_nom_fr', 'food_category', 'category', 'categories'],
+    'calories_100g': ['calories_100g', 'calories_per_100g', 'energy-kcal_100g',
+                      'energie, reglement ue n° 1169/2011 (kcal/100 g)'],
+    'proteines_100g': ['proteines_100g', 'protein_per_100g', 'proteins_100g',
+                       'proteines, n x facteur de jones (g/100 g)', 'proteines, n x 6.25 (g/100 g)'],
+    'omega3_100g': ['omega3_100g', 'omega3_per_100g', 'omega-3-fat_100g'],
+    'magnesium_100g': ['magnesium_100g', 'magnesium_per_100g', 'magnesium (mg/100 g)'],
+    'benefices_cerveau': ['benefices_cerveau'],
+    'conseils_consommation': ['conseils_consommation'],
+}
+
+# Bornes plausibles pour 100 g : au-delà, la ligne est rejetée
+NUMERIC_BOUNDS = {
+    'calories_100g': (0, 900),
+    'proteines_100g': (0, 100),
+    'omega3_100g': (0, 100),
+    'magnesium_100g': (0, 5000),
+}
+
+MISSING_VALUES = {'', '-', 'nan', 'n.c.', 'nc', 'na', 'n/a'}
+TRACE_VALUES = {'traces', 'trace', 'tr'}
+
+def normalize_header(name):
+    name = unicodedata.normalize('NFKD', str(name).strip().lower())
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.split())
+
+_ALIASES = {alias: column for column, aliases in COLUMN_ALIASES.items() for alias in aliases}
+
+def map_columns(headers):
+    """Associe les en-têtes de la source aux colonnes du CSV, la première trouvée l'emporte"""
+
+    mapping = {}
+    for header in headers:
+        column = _ALIASES.get(normalize_header(header))
+        if column is not None and column not in mapping.values():
+            mapping[header] = column
+    if 'aliment' not in mapping.values():
+        raise ValueError("Aucune colonne de nom d'aliment reconnue dans la source")
+    return mapping
+
+def normalize_number(value):
+    """Nombre de la source au format du CSV ("12,5" -> "12.5", "traces" -> "0")
+
+    Retourne (texte, valeur) ; valeur est None pour une donnée absente.
+    Lève ValueError si la cellule n'est pas un nombre.
+    """
+
+    text = str(value).strip().lower()
+    if text in MISSING_VALUES:
+        return '', None
+    if text in TRACE_VALUES:
+        return '0', 0.0
+    # "< 0,5" : seuil de détection, conservé comme borne supérieure
+    number = float(re.sub(r'^[<>]\s*', '', text).replace(',', '.').replace(' ', ''))
+    # 15 chiffres significatifs : le texte relu redonne exactement la valeur
+    return f"{number:.15g}", number
+
+def normalize_row(raw, mapping):
+    """Ligne au schéma de nutrition_kb.csv, ou (None, motif du rejet)"""
+
+    row = dict.fromkeys(KB_COLUMNS, '')
+    for header, column in mapping.items():
+        value = raw.get(header)
+        row[column] = ' '.join(str(value).split()) if value is not None else ''
+
+    if not row['aliment']:
+        return None, 'nom manquant'
+
+    present = 0
+    for column in NUMERIC_COLUMNS:
+        try:
+            row[column], value = normalize_number(row[column])
+        except ValueError:
+            return None, f'{column} invalide'
+        if value is None:
+            continue
+        low, high = NUMERIC_BOUNDS[column]
+        if not low <= value <= high:
+            return None, f'{column} hors bornes'
+        present += 1
+
+    if not present:
+        return None, 'aucune valeur nutritionnelle'
+    return row, None
+
+def read_chunks(path, chunk_size, skip=0, sep=',', encoding='utf-8'):
+    """Blocs de lignes brutes (listes de dicts), sans jamais charger tout le fichier
+
+    Seules les colonnes reconnues sont lues ; `skip` lignes de données sont
+    sautées sans être analysées (reprise). Retourne (mapping, générateur).
+    """
+
+    headers = pd.read_csv(path, sep=sep, encoding=encoding, nrows=0).columns
+    mapping = map_columns(headers)
+    reader = pd.read_csv(
+        path, sep=sep, encoding=encoding, dtype=str, keep_default_na=False,
+        usecols=list(mapping), skiprows=range(1, skip + 1), chunksize=chunk_size
+    )
+
+    def chunks():
+        with reader:
+            for frame in reader:
+                yield frame.to_dict('records')
+
+    return mapping, chunks()
+
+class IngestState:
+    """Progression d'une ingestion, écrite atomiquement à chaque point de reprise"""
+
+    def __init__(self, path, source, output, data=None):
+        self.path = path
+        stat = os.stat(source)
+        self.data = data or {
+            'source': os.path.abspath(source),
+            'source_size': stat.st_size,
+            'source_mtime': stat.st_mtime,
+            'output': os.path.abspath(output),
+            'rows_read': 0,
+            'output_bytes': 0,
+            'accepted': 0,
+            'rejected': {},
+        }
+
+    @classmethod
+    def resume(cls, path, source, output):
+        """État d'une ingestion interrompue de la même source, sinon None"""
+
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        stat = os.stat(source)
+        if (data['source'] != os.path.abspath(source) or data['output'] != os.path.abspath(output)
+                or data['source_size'] != stat.st_size or data['source_mtime'] != stat.st_mtime):
+            return None
+        return cls(path, source, output, data)
+
+    @staticmethod
+    def interrupted(path, output):
+        """Progression d'une ingestion interrompue vers `output`, quelle que soit sa source"""
+
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return data if data.get('output') == os.path.abspath(output) else None
+
+    def reject(self, reason):
+        self.data['rejected'][reason] = self.data['rejected'].get(reason, 0) + 1
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class IngestLog:
+    """Journal des documents indexés, en ajout seul dans le dossier de travail
+
+    Une ligne JSON par document (id, empreinte, texte, métadonnées, termes
+    BM25) et son vecteur float32 dans un fichier binaire : un point de
+    reprise n'écrit que le bloc nouveau, et une reprise reconstruit l'index
+    sans réencoder.
+    """
+
+    DOCS_FILE = 'ingest_docs.jsonl'
+    VECTORS_FILE = 'ingest_vectors.f32'
+
+    def __init__(self, folder):
+        self.docs_path = os.path.join(folder, self.DOCS_FILE)
+        self.vectors_path = os.path.join(folder, self.VECTORS_FILE)
+        self._docs = None
+        self._vectors = None
+
+    def truncate(self, docs_bytes, count, dim):
+        """Ramène le journal au point de reprise ; faux s'il ne lui correspond pas"""
+
+        if count and not dim:
+            return False
+        vectors_bytes = count * (dim or 0) * 4
+        for path, size in ((self.docs_path, docs_bytes), (self.vectors_path, vectors_bytes)):
+            if size and (not os.path.exists(path) or os.path.getsize(path) < size):
+                return False
+        if count and self._count_lines(docs_bytes) != count:
+            return False
+        for path, size in ((self.docs_path, docs_bytes), (self.vectors_path, vectors_bytes)):
+            with open(path, 'ab') as f:
+                f.truncate(size)
+        return True
+
+    def _count_lines(self, size, block=1 << 20):
+        lines = 0
+        with open(self.docs_path, 'rb') as f:
+            while size > 0:
+                data = f.read(min(block, size))
+                if not data:
+                    break
+                lines += data.count(b'\n')
+                size -= len(data)
+        return lines
+
+    def replay(self, dim, first, size):
+        """Blocs (entrées, vecteurs) du journal : `first` documents, puis par `size`
+
+        Le premier bloc est celui qui a entraîné l'index (IVF) à l'origine.
+        """
+
+        batch = first
+        with open(self.docs_path, encoding='utf-8') as docs, open(self.vectors_path, 'rb') as vectors:
+            while True:
+                entries = [json.loads(line) for _, line in zip(range(batch), docs)]
+                if not entries:
+                    return
+                yield entries, np.fromfile(vectors, dtype='float32', count=len(entries) * dim).reshape(-1, dim)
+                batch = size
+
+    def append(self, entries, vectors):
+        if self._docs is None:
+            self._docs = open(self.docs_path, 'a', encoding='utf-8')
+            self._vectors = open(self.vectors_path, 'ab')
+        for entry in entries:
+            self._docs.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._vectors.write(np.asarray(vectors, dtype='float32').tobytes())
+
+    def sync(self):
+        """Écrit le journal sur disque, retourne la taille du fichier des documents"""
+
+        if self._docs is None:
+            return os.path.getsize(self.docs_path) if os.path.exists(self.docs_path) else 0
+        for f in (self._docs, self._vectors):
+            f.flush()
+            os.fsync(f.fileno())
+        return self._docs.tell()
+
+    def remove(self):
+        """Ferme et supprime le journal, inutile une fois l'index publié"""
+
+        for f in (self._docs, self._vectors):
+            if f is not None:
+                f.close()
+        self._docs = self._vectors = None
+        for path in (self.docs_path, self.vectors_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+def open_output(path, offset):
+    """Ouvre le CSV normalisé, tronqué au dernier point de reprise"""
+
+    if offset:
+        f = open(path, 'r+', encoding='utf-8', newline='')
+        f.truncate(offset)
+        f.seek(offset)
+        return f, csv.DictWriter(f, fieldnames=KB_COLUMNS)
+    f = open(path, 'w', encoding='utf-8', newline='')
+    writer = csv.DictWriter(f, fieldnames=KB_COLUMNS)
+    writer.writeheader()
+    return f, writer
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stockage colonnaire de la base nutritionnelle
+nutrition_kb peut être un CSV, un fichier Parquet ou un fichier Arrow IPC
+(.arrow) ; les deux derniers sont projetés en mémoire et lus colonne par
+colonne, sans réanalyser de texte à chaque construction
+"""
+
+import os
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+TEXT_COLUMNS = ['aliment', 'categorie', 'benefices_cerveau', 'conseils_consommation']
+NUMERIC_COLUMNS = ['calories_100g', 'proteines_100g', 'omega3_100g', 'magnesium_100g']
+# Lignes par lot lu : la conversion en objets Python se fait lot par lot
+BATCH_ROWS = 8192
+
+SCHEMA = pa.schema(
+    [(name, pa.string()) for name in TEXT_COLUMNS[:2]]
+    + [(name, pa.float64()) for name in NUMERIC_COLUMNS]
+    + [(name, pa.string()) for name in TEXT_COLUMNS[2:]]
+)
+
+def read_table(path, columns=None):
+    """Table Arrow de la base, réduite à `columns` si précisé
+
+    Un fichier .arrow est projeté en mémoire sans copie ; un fichier Parquet
+    ne décode que les colonnes demandées.
+    """
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.arrow':
+        table = ipc.open_file(pa.memory_map(path)).read_all()
+        return table.select(columns) if columns else table
+    if ext == '.parquet':
+        return pq.read_table(path, columns=columns, memory_map=True)
+
+    # Séparateur décimal "," toléré comme dans parse_number
+    options = pacsv.ConvertOptions(
+        column_types={name: pa.string() for name in SCHEMA.names},
+        include_columns=columns,
+        strings_can_be_null=False
+    )
+    table = pacsv.read_csv(path, convert_options=options)
+    for name in NUMERIC_COLUMNS:
+        if name in table.column_names:
+            values = pa.array([_to_float(v) for v in table.column(name).to_pylist()], pa.float64())
+            table = table.set_column(table.column_names.index(name), name, values)
+    return table
+
+def _to_float(value):
+    try:
+        return float(value.replace(',', '.'))
+    except (AttributeError, ValueError):
+        return None
+
+def write_table(table, path):
+    """Écrit la table au format de l'extension de `path` (.parquet ou .arrow)"""
+
+    table = table.select(SCHEMA.names).cast(SCHEMA)
+    tmp = f"{path}.tmp"
+    if path.lower().endswith('.arrow'):
+        # Non compressé : la lecture se fait par projection mémoire, sans décodage
+        with pa.OSFile(tmp, 'wb') as sink, ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, tmp, compression='zstd')
+    os.replace(tmp, path)
+
+def convert(source, target):
+    """Convertit la base vers un autre format, retourne le nombre d'aliments"""
+
+    table = read_table(source)
+    missing = [name for name in SCHEMA.names if name not in table.column_names]
+    for name in missing:
+        table = table.append_column(name, pa.nulls(len(table), SCHEMA.field(name).type))
+    write_table(table, target)
+    return len(table)
+
+def iter_batches(path, columns=None, batch_rows=BATCH_ROWS):
+    """Lots d'enregistrements de la base, en listes Python colonne par colonne
+
+    Parquet est décodé lot par lot et les lots Arrow sont lus dans la
+    projection mémoire : la table n'est jamais convertie d'un bloc.
+    """
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_rows, columns=columns)
+    elif ext == '.arrow':
+        reader = ipc.open_file(pa.memory_map(path))
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        if columns:
+            batches = (batch.select(columns) for batch in batches)
+    else:
+        batches = read_table(path, columns).to_batches(batch_rows)
+    for batch in batches:
+        yield {name: batch.column(i).to_pylist() for i, name in enumerate(batch.schema.names)}
+
+def read_rows(path):
+    """Lignes de la base en dicts, lues lot par lot (textes absents -> "", nombres en float ou None)"""
+
+    for columns in iter_batches(path):
+        size = len(next(iter(columns.values()), []))
+        for name in TEXT_COLUMNS:
+            columns[name] = ['' if v is None else v for v in columns.get(name) or [None] * size]
+        names = list(columns)
+        for values in zip(*columns.values()):
+            yield dict(zip(names, values))
+
+def read_numeric(path, columns=NUMERIC_COLUMNS):
+    """Colonnes numériques en tableaux numpy, lues directement dans les tampons Arrow
+
+    Seules `columns` sont lues ; les valeurs absentes deviennent NaN.
+    """
+
+    table = read_table(path, list(columns))
+    return {name: table.column(name).to_numpy() for name in columns}
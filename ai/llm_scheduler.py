@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ordonnanceur des générations de l'assistant NUTRIKAL
+Limite le nombre de générations simultanées sur le serveur Ollama, sert
+les utilisateurs à tour de rôle (le chat interactif avant les analyses en
+lot), fusionne les prompts identiques en cours et abandonne les requêtes
+dont l'échéance est dépassée
+"""
+
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+PRIORITIES = {'interactive': 0, 'batch': 1}
+MAX_WAIT_SAMPLES = 1000
+
+class DeadlineExceeded(Exception):
+    """L'échéance de la requête est passée avant ou pendant la génération"""
+
+class _Ticket:
+    def __init__(self, user_id, enqueued):
+        self.user_id = user_id
+        self.enqueued = enqueued
+        self.granted = False
+
+class _Shared:
+    """Génération partagée entre les requêtes fusionnées sur un même prompt
+
+    Son échéance est la plus tardive de ses demandeurs (None si l'un n'en a
+    pas) : elle attend son emplacement tant que l'un d'eux l'attend encore.
+    """
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def extend(self, deadline):
+        if self.deadline is not None:
+            self.deadline = None if deadline is None else max(self.deadline, deadline)
+
+class _Call(_Shared):
+    def __init__(self, deadline):
+        super().__init__(deadline)
+        self.future = Future()
+
+class _Broadcast(_Shared):
+    """Flux partagé entre les requêtes fusionnées sur un même prompt"""
+
+    def __init__(self, deadline):
+        super().__init__(deadline)
+        self.items = []
+        self.done = False
+        self.error = None
+        self.readers = 0
+
+class LLMScheduler:
+    """File d'attente équitable devant le modèle local
+
+    - au plus `max_in_flight` générations à la fois ;
+    - par priorité (interactive puis batch), un tour de rôle entre
+      utilisateurs : un utilisateur qui envoie dix requêtes ne bloque pas
+      les autres ;
+    - les appels de même clé (prompt identique) en cours ou en attente
+      partagent une seule génération ;
+    - une requête dont l'échéance passe en file d'attente, ou pendant la
+      génération en flux, lève DeadlineExceeded ; chaque requête fusionnée
+      n'applique que sa propre échéance.
+    """
+
+    def __init__(self, max_in_flight=1, clock=time.monotonic):
+        self.max_in_flight = max_in_flight
+        self.clock = clock
+        self.in_flight = 0
+        self.completed = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.tokens = 0
+        self.generation_s = 0.0
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES.values()}
+        self._waits = deque(maxlen=MAX_WAIT_SAMPLES)
+        self._calls = {}
+        self._streams = {}
+        self._cond = threading.Condition()
+
+    def deadline_in(self, seconds):
+        """Échéance absolue dans `seconds` secondes (None : pas d'échéance)"""
+
+        return None if seconds is None else self.clock() + seconds
+
+    def _dispatch(self):
+        """Accorde les emplacements libres (appelé avec le verrou)"""
+
+        while self.in_flight < self.max_in_flight:
+            queue = next((q for _, q in sorted(self._queues.items()) if q), None)
+            if queue is None:
+                return
+            user_id, tickets = next(iter(queue.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                queue.move_to_end(user_id)
+            else:
+                del queue[user_id]
+            ticket.granted = True
+            self.in_flight += 1
+            self._waits.append(self.clock() - ticket.enqueued)
+        self._cond.notify_all()
+
+    def _acquire(self, user_id, priority, shared):
+        """Attend un emplacement pour `shared`, dont l'échéance peut reculer pendant l'attente
+
+        L'abandon n'est pas compté ici : chaque demandeur compte le sien.
+        """
+
+        ticket = _Ticket(user_id, self.clock())
+        with self._cond:
+            self._queues[PRIORITIES.get(priority, priority)].setdefault(user_id, deque()).append(ticket)
+            self._dispatch()
+            while not ticket.granted:
+                remaining = None if shared.deadline is None else shared.deadline - self.clock()
+                if remaining is not None and remaining <= 0:
+                    queue = self._queues[PRIORITIES.get(priority, priority)]
+                    queue[user_id].remove(ticket)
+                    if not queue[user_id]:
+                        del queue[user_id]
+                    raise DeadlineExceeded("Échéance dépassée en file d'attente")
+                self._cond.wait(remaining)
+
+    def _release(self, tokens, elapsed):
+        with self._cond:
+            self.in_flight -= 1
+            self.completed += 1
+            self.tokens += tokens
+            self.generation_s += elapsed
+            self._dispatch()
+
+    def run(self, key, fn, user_id=None, priority='interactive', deadline=None, tokens=None):
+        """Résultat de `fn()` exécuté dans un emplacement, partagé entre appels identiques
+
+        `fn()` est exécuté par un thread dédié ; `tokens(résultat)` donne le
+        nombre de tokens générés, pour le débit. L'échéance s'applique à
+        l'attente : un appel bloquant déjà lancé n'est pas interrompu.
+        """
+
+        with self._cond:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call(deadline)
+                threading.Thread(target=self._call, args=(key, call, fn, user_id, priority, tokens),
+                                 daemon=True).start()
+            else:
+                self.coalesced += 1
+                call.extend(deadline)
+
+        try:
+            return call.future.result(None if deadline is None else max(0, deadline - self.clock()))
+        except FutureTimeout:
+            with self._cond:
+                self.cancelled += 1
+            raise DeadlineExceeded("Échéance dépassée en attente de la génération")
+
+    def _call(self, key, call, fn, user_id, priority, tokens):
+        try:
+            self._acquire(user_id, priority, call)
+            started, result, count = self.clock(), None, 0
+            try:
+                result = fn()
+                count = tokens(result) if tokens else 0
+            finally:
+                self._release(count, self.clock() - started)
+            call.future.set_result(result)
+        except BaseException as e:
+            call.future.set_exception(e)
+        finally:
+            with self._cond:
+                del self._calls[key]
+
+    def stream(self, key, fn, user_id=None, priority='interactive', deadline=None):
+        """Génère les éléments de `fn()` (un générateur), partagés entre appels identiques
+
+        La génération est menée par un thread dédié ; elle s'arrête dès que
+        plus aucun lecteur ne l'attend ou que l'échéance est dépassée.
+        """
+
+        with self._cond:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = self._streams[key] = _Broadcast(deadline)
+                threading.Thread(target=self._produce, args=(key, shared, fn, user_id, priority),
+                                 daemon=True).start()
+            else:
+                self.coalesced += 1
+                shared.extend(deadline)
+            shared.readers += 1
+
+        position = 0
+        try:
+            while True:
+                with self._cond:
+                    while position == len(shared.items) and not shared.done:
+                        remaining = None if deadline is None else deadline - self.clock()
+                        if remaining is not None and remaining <= 0:
+                            self.cancelled += 1
+                            raise DeadlineExceeded("Échéance dépassée pendant la génération")
+                        self._cond.wait(remaining)
+                    items = shared.items[position:]
+                    finished, error = shared.done, shared.error
+                position += len(items)
+                yield from items
+                if finished and position == len(shared.items):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self._cond:
+                shared.readers -= 1
+
+    def _produce(self, key, shared, fn, user_id, priority):
+        started, count = None, 0
+        try:
+            self._acquire(user_id, priority, shared)
+            started = self.clock()
+            items = fn()
+            try:
+                for item in items:
+                    with self._cond:
+                        if shared.readers == 0:
+                            break
+                        if shared.deadline is not None and self.clock() > shared.deadline:
+                            self.cancelled += 1
+                            raise DeadlineExceeded("Échéance dépassée pendant la génération")
+                        shared.items.append(item)
+                        count += 1
+                        self._cond.notify_all()
+            finally:
+                # Fermer le générateur interrompt la requête HTTP vers le modèle
+                if hasattr(items, 'close'):
+                    items.close()
+        except Exception as e:
+            shared.error = e
+        finally:
+            if started is not None:
+                self._release(count, self.clock() - started)
+            with self._cond:
+                shared.done = True
+                del self._streams[key]
+                self._cond.notify_all()
+
+    def metrics(self):
+        """Profondeur de file, attentes, fusions, annulations et débit"""
+
+        with self._cond:
+            waits = sorted(self._waits)
+            depth = {name: sum(len(t) for t in self._queues[p].values())
+                     for name, p in PRIORITIES.items()}
+            return {
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'queue_depth': sum(depth.values()),
+                'queue_depth_by_priority': depth,
+                'wait_ms_mean': sum(waits) / len(waits) * 1000 if waits else 0.0,
+                'wait_ms_p95': waits[int(0.95 * (len(waits) - 1))] * 1000 if waits else 0.0,
+                'completed': self.completed,
+                'coalesced': self.coalesced,
+                'cancelled': self.cancelled,
+                'tokens_per_s': self.tokens / self.generation_s if self.generation_s else 0.0
+            }
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Préfiltrage numérique pour le RAG NUTRIKAL
+Extrait les contraintes nutritionnelles d'une question ("riche en oméga-3",
+"moins de 100 kcal") et y répond à partir de colonnes triées, avant toute
+recherche vectorielle
+"""
+
+import os
+import re
+import json
+import bisect
+import unicodedata
+
+NUTRIENTS_FILE = 'nutrients.json'
+
+# Synonymes (sans accents, minuscules) -> colonne du CSV
+NUTRIENT_ALIASES = {
+    'omega3_100g': ['omega-3', 'omega 3', 'omega3', 'omegas-3', 'dha', 'epa'],
+    'magnesium_100g': ['magnesium'],
+    'calories_100g': ['calories', 'calorie', 'kcal', 'calorique', 'caloriques'],
+    'proteines_100g': ['proteines', 'proteine', 'proteiques', 'proteique']
+}
+
+# Seuils pour 100 g utilisés par "riche en" / "faible en"
+RICH_THRESHOLDS = {
+    'omega3_100g': 1.0,
+    'magnesium_100g': 50,
+    'calories_100g': 300,
+    'proteines_100g': 15
+}
+LOW_THRESHOLDS = {
+    'omega3_100g': 0.2,
+    'magnesium_100g': 20,
+    'calories_100g': 100,
+    'proteines_100g': 3
+}
+
+RICH_WORDS = r"(?:riches?|sources?|beaucoup)"
+LOW_WORDS = r"(?:faibles?|pauvres?|peu|basses?)"
+LINKS = r"(?:\s+(?:en|de|d'|d’|du|des))?\s*"
+
+def _strip_accents(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+def _nutrient_pattern():
+    aliases = sorted(
+        (alias for names in NUTRIENT_ALIASES.values() for alias in names),
+        key=len, reverse=True
+    )
+    return '(' + '|'.join(re.escape(alias) for alias in aliases) + ')'
+
+def _column(alias):
+    for column, names in NUTRIENT_ALIASES.items():
+        if alias in names:
+            return column
+    return None
+
+NUTRIENT = _nutrient_pattern()
+NUMBER = r"(\d+(?:[.,]\d+)?)\s*(?:g|mg|kcal)?"
+
+PATTERNS = [
+    # "plus de 20 g de protéines", "au moins 1 g d'oméga-3"
+    (re.compile(rf"(?:plus de|au moins|minimum|>=?)\s*{NUMBER}{LINKS}{NUTRIENT}"), 'min'),
+    # "moins de 100 kcal", "au plus 200 calories"
+    (re.compile(rf"(?:moins de|au plus|maximum|<=?)\s*{NUMBER}{LINKS}{NUTRIENT}"), 'max'),
+    # "riche en oméga-3", "sources d'oméga-3"
+    (re.compile(rf"{RICH_WORDS}{LINKS}{NUTRIENT}"), 'rich'),
+    # "faible en calories", "pauvre en calories"
+    (re.compile(rf"{LOW_WORDS}{LINKS}{NUTRIENT}"), 'low'),
+    # "hypocalorique", "hyperprotéiné"
+    (re.compile(r"hypocaloriques?"), 'low:calories_100g'),
+    (re.compile(r"hyperproteine(?:e|s|es)?"), 'rich:proteines_100g')
+]
+
+def parse_constraints(query):
+    """Extrait les contraintes numériques d'une requête
+
+    Retourne (contraintes, texte restant) où chaque contrainte est un tuple
+    (colonne, minimum, maximum, sens) ; `sens` vaut 'desc' quand la requête
+    cherche les valeurs les plus élevées et 'asc' pour les plus faibles.
+    """
+
+    text = _strip_accents(query)
+    constraints = []
+    for pattern, kind in PATTERNS:
+        for match in pattern.finditer(text):
+            if ':' in kind:
+                kind_, column = kind.split(':')
+            else:
+                kind_, column = kind, _column(match.groups()[-1])
+            if column is None:
+                continue
+            if kind_ == 'min':
+                constraints.append((column, float(match.group(1).replace(',', '.')), None, 'desc'))
+            elif kind_ == 'max':
+                constraints.append((column, None, float(match.group(1).replace(',', '.')), 'asc'))
+            elif kind_ == 'rich':
+                constraints.append((column, RICH_THRESHOLDS[column], None, 'desc'))
+            else:
+                constraints.append((column, None, LOW_THRESHOLDS[column], 'asc'))
+        text = pattern.sub(' ', text)
+    return constraints, ' '.join(text.split())
+
+class NutrientIndex:
+    """Colonnes numériques triées pour répondre aux requêtes par plage"""
+
+    def __init__(self, columns):
+        # colonne -> (valeurs triées, IDs dans le même ordre)
+        self.columns = columns
+
+    @classmethod
+    def from_documents(cls, docs):
+        """Construit l'index à partir des métadonnées numériques des documents"""
+
+        columns = {}
+        for column in NUTRIENT_ALIASES:
+            pairs = sorted(
+                (doc.metadata[column], doc.metadata['id'])
+                for doc in docs if doc.metadata.get(column) is not None
+            )
+            columns[column] = ([value for value, _ in pairs], [doc_id for _, doc_id in pairs])
+        return cls(columns)
+
+    @classmethod
+    def from_columns(cls, ids, columns):
+        """Construit l'index à partir de colonnes numpy alignées sur `ids` (NaN : absent)"""
+
+        import numpy as np
+
+        ids = np.array(ids)
+        built = {}
+        for column in NUTRIENT_ALIASES:
+            values = columns[column]
+            present = ~np.isnan(values)
+            order = np.lexsort((ids[present], values[present]))
+            built[column] = (values[present][order].tolist(), ids[present][order].tolist())
+        return cls(built)
+
+    def save(self, folder):
+        with open(os.path.join(folder, NUTRIENTS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.columns, f)
+
+    @classmethod
+    def load(cls, folder):
+        with open(os.path.join(folder, NUTRIENTS_FILE), encoding='utf-8') as f:
+            return cls({column: tuple(pair) for column, pair in json.load(f).items()})
+
+    def range(self, column, minimum=None, maximum=None):
+        """IDs dont la valeur est dans [minimum, maximum], triés par valeur"""
+
+        values, ids = self.columns.get(column, ([], []))
+        lo = bisect.bisect_left(values, minimum) if minimum is not None else 0
+        hi = bisect.bisect_right(values, maximum) if maximum is not None else len(values)
+        return ids[lo:hi]
+
+    def candidates(self, constraints):
+        """Intersection des plages, ordonnée selon la première contrainte"""
+
+        if not constraints:
+            return None
+        column, minimum, maximum, order = constraints[0]
+        ranked = self.range(column, minimum, maximum)
+        if order == 'desc':
+            ranked = ranked[::-1]
+        for column, minimum, maximum, _ in constraints[1:]:
+            allowed = set(self.range(column, minimum, maximum))
+            ranked = [doc_id for doc_id in ranked if doc_id in allowed]
+        return ranked
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Backend ONNX Runtime pour le modèle d'embeddings du RAG NUTRIKAL
+Exporte MiniLM en ONNX, le quantifie dynamiquement en int8 et l'exécute
+sur CPU sans PyTorch, avec le même pooling que sentence-transformers
+"""
+
+import os
+import time
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+ONNX_MODEL_DIR = 'onnx_models'
+MAX_SEQ_LENGTH = 256
+INPUT_NAMES = ['input_ids', 'attention_mask', 'token_type_ids']
+
+def export_onnx(model_name, folder=ONNX_MODEL_DIR, quantize=True):
+    """Exporte le modèle en ONNX (une seule fois) et retourne le chemin à charger
+
+    Avec `quantize`, les poids des couches linéaires sont convertis en int8
+    (quantification dynamique : les activations restent en float32).
+    """
+
+    folder = os.path.join(folder, model_name.replace('/', '__'))
+    fp32_path = os.path.join(folder, 'model.onnx')
+    int8_path = os.path.join(folder, 'model.int8.onnx')
+
+    if not os.path.exists(fp32_path):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        os.makedirs(folder, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        sample = tokenizer(["exemple d'aliment"], return_tensors='pt')
+        names = [name for name in INPUT_NAMES if name in sample]
+        axes = {name: {0: 'batch', 1: 'sequence'} for name in names + ['last_hidden_state']}
+        with torch.no_grad():
+            torch.onnx.export(
+                model, tuple(sample[name] for name in names), fp32_path,
+                input_names=names, output_names=['last_hidden_state'],
+                dynamic_axes=axes, opset_version=14
+            )
+        print(f"📦 Modèle {model_name} exporté en ONNX")
+
+    if not quantize:
+        return fp32_path
+
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"📦 Modèle quantifié en int8 ({os.path.getsize(fp32_path) / 1e6:.0f} Mo -> "
+              f"{os.path.getsize(int8_path) / 1e6:.0f} Mo)")
+    return int8_path
+
+class OnnxEmbeddings(Embeddings):
+    """Embeddings MiniLM calculés par ONNX Runtime
+
+    Reproduit la chaîne sentence-transformers : moyenne des états cachés
+    pondérée par le masque d'attention, puis normalisation L2.
+    """
+
+    def __init__(self, model_name, folder=ONNX_MODEL_DIR, quantize=True, threads=None,
+                 max_length=MAX_SEQ_LENGTH):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            export_onnx(model_name, folder, quantize), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    def _encode(self, texts):
+        batch = self.tokenizer(texts, padding=True, truncation=True,
+                               max_length=self.max_length, return_tensors='np')
+        feeds = {name: batch[name].astype('int64') for name in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+
+        mask = batch['attention_mask'][..., None].astype('float32')
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+    def embed_documents(self, texts):
+        return self._encode(list(texts)) if texts else []
+
+    def embed_query(self, text):
+        return self._encode([text])[0]
+
+def parity_report(reference, candidate, queries, documents):
+    """Compare deux modèles d'embeddings sur les mêmes textes
+
+    Retourne la similarité cosinus entre les vecteurs des deux modèles, la
+    part des requêtes dont le meilleur document est identique, et les
+    débits respectifs.
+    """
+
+    def timed(embeddings):
+        started = time.perf_counter()
+        vectors = np.array(embeddings.embed_documents(queries + documents), dtype='float32')
+        return vectors, time.perf_counter() - started
+
+    ref, ref_s = timed(reference)
+    cand, cand_s = timed(candidate)
+
+    def unit(vectors):
+        return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+    ref, cand = unit(ref), unit(cand)
+    cosines = (ref * cand).sum(axis=1)
+
+    n = len(queries)
+    agreement = None
+    if n and documents:
+        top_ref = (ref[:n] @ ref[n:].T).argmax(axis=1)
+        top_cand = (cand[:n] @ cand[n:].T).argmax(axis=1)
+        agreement = float((top_ref == top_cand).mean())
+
+    texts = len(queries) + len(documents)
+    return {
+        'texts': texts,
+        'cosine_min': float(cosines.min()),
+        'cosine_mean': float(cosines.mean()),
+        'top1_agreement': agreement,
+        'reference_texts_per_s': texts / max(ref_s, 1e-9),
+        'candidate_texts_per_s': texts / max(cand_s, 1e-9),
+        'speedup': ref_s / max(cand_s, 1e-9)
+    }
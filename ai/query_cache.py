@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache LRU des requêtes pour le RAG NUTRIKAL
+Conserve en mémoire les embeddings de requêtes et les meilleurs résultats,
+avec durée de vie et invalidation à chaque nouvelle version de l'index
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from embedding_cache import normalize_text
+
+class QueryCache:
+    """Cache LRU borné avec expiration (TTL)
+
+    Les clés incluent la version de l'index : `bind` vide le cache dès que
+    le retriever est rattaché à un index reconstruit. Les hits et misses
+    sont aussi comptés par type d'entrée (premier élément de la clé).
+    """
+
+    def __init__(self, max_size=1024, ttl=3600, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.kinds = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bind(self, version):
+        """Associe le cache à une version d'index, en l'invalidant si elle change"""
+
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def key(self, kind, query, *extra):
+        return (kind, self.version, normalize_text(query).casefold()) + extra
+
+    def get(self, key):
+        with self._lock:
+            counts = self.kinds.setdefault(key[0], {'hits': 0, 'misses': 0})
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                counts['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            counts['hits'] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Compteurs de hits/misses (au total et par type), expirations et évictions"""
+
+        return {
+            **_rate(self.hits, self.misses),
+            'kinds': {kind: _rate(**counts) for kind, counts in self.kinds.items()},
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'version': self.version
+        }
+
+def _rate(hits, misses):
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Banc d'essai du RAG NUTRIKAL
+Construit l'index sur des versions agrandies de nutrition_kb.csv et mesure
+temps de construction, taille sur disque, pic de mémoire, rappel@k et
+latences p50/p95/p99, en JSON comparable d'une exécution à l'autre
+
+Usage:
+  python rag_bench.py --scales 1000 10000 100000 --output bench.json
+  python rag_bench.py --baseline bench.json   # échoue en cas de régression
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import tempfile
+import resource
+import subprocess
+import contextlib
+
+import rag_setup
+
+# Requêtes de test et aliments de base attendus dans les résultats
+LABELLED_QUERIES = {
+    "aliments pour améliorer la mémoire": ['saumon', 'myrtilles'],
+    "sources d'oméga-3": ['saumon', 'noix'],
+    "réduire le stress avec l'alimentation": ['epinards'],
+    "antioxydants pour le cerveau": ['myrtilles', 'epinards'],
+    "petit-déjeuner pour la concentration": ['saumon', 'myrtilles']
+}
+
+DEFAULT_SCALES = [1000, 10000, 100000]
+
+# Régressions tolérées par rapport à une exécution de référence
+THRESHOLDS = {
+    'build_s': 0.25,           # +25 % de temps de construction
+    'index_bytes': 0.10,       # +10 % de taille sur disque
+    'peak_rss_mb': 0.25,       # +25 % de pic mémoire
+    'latency_p95_ms': 0.25,    # +25 % de latence p95
+    'recall_at_k': -0.05       # -5 points de rappel
+}
+
+def base_key(key):
+    """Clé de l'aliment d'origine d'une ligne synthétique ("saumon--17" -> "saumon")"""
+
+    return key.split('--')[0]
+
+def synthesize_kb(source, target, n_rows, seed=0):
+    """Écrit une base de `n_rows` lignes dérivées des aliments de `source`
+
+    Les lignes d'origine sont conservées ; les suivantes sont des variantes
+    aux valeurs nutritionnelles perturbées de ±20 %. Une cible Parquet ou
+    Arrow est écrite en CSV puis convertie.
+    """
+
+    base_rows = [row for _, _, row in rag_setup.read_kb_rows(source)]
+    columnar = rag_setup.kb_is_columnar(target)
+    csv_target = f"{target}.csv" if columnar else target
+
+    rng = random.Random(seed)
+    with open(csv_target, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(base_rows[0]))
+        writer.writeheader()
+        for i in range(n_rows):
+            row = dict(base_rows[i % len(base_rows)])
+            if i >= len(base_rows):
+                row['aliment'] = f"{row['aliment']} -{i}"
+                for column in rag_setup.NUMERIC_COLUMNS:
+                    value = rag_setup.parse_number(row.get(column))
+                    if value is not None:
+                        row[column] = round(value * rng.uniform(0.8, 1.2), 2)
+            writer.writerow(row)
+
+    if columnar:
+        from kb_store import convert
+        convert(csv_target, target)
+        os.remove(csv_target)
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+def recall_at_k(results, queries, k):
+    """Part des aliments attendus retrouvés (sous une forme ou une autre) dans le top-k"""
+
+    scores = []
+    for query, docs in zip(queries, results):
+        expected = set(LABELLED_QUERIES.get(query, []))
+        if expected:
+            found = {base_key(doc.metadata['id']) for doc in docs[:k]}
+            scores.append(len(found & expected) / len(expected))
+    return sum(scores) / len(scores) if scores else 0.0
+
+def run_scale(n_rows, k=4, repeat=20, index_type='flat', batch_size=rag_setup.EMBEDDING_BATCH_SIZE):
+    """Construit et mesure un index de `n_rows` aliments dans un dossier temporaire"""
+
+    source = os.path.abspath(rag_setup.KB_PATH)
+    queries = list(LABELLED_QUERIES)
+
+    with tempfile.TemporaryDirectory(prefix='nutrikal-bench-') as workdir:
+        os.chdir(workdir)
+        synthesize_kb(source, rag_setup.KB_PATH, n_rows)
+
+        # Les messages de construction vont sur stderr, stdout reste du JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            started = time.perf_counter()
+            rag_setup.setup_nutrition_rag(
+                incremental=False, batch_size=batch_size,
+                config=rag_setup.index_config(type=index_type)
+            )
+            build_s = time.perf_counter() - started
+
+            started = time.perf_counter()
+            retriever = rag_setup.load_retriever()
+            load_s = time.perf_counter() - started
+
+        # Premier passage : embeddings de requêtes non encore en cache
+        cold = []
+        results = []
+        for query in queries:
+            started = time.perf_counter()
+            results.append(retriever.search(query, k=k))
+            cold.append((time.perf_counter() - started) * 1000)
+
+        # Régime établi, sans le cache de résultats
+        retriever.cache = None
+        latencies = []
+        for _ in range(repeat):
+            for query in queries:
+                started = time.perf_counter()
+                retriever.search(query, k=k)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        return {
+            'rows': n_rows,
+            'index_type': index_type,
+            # Paramètres effectifs : nlist et pq_bits sont réduits sur une petite base
+            'index': rag_setup.load_manifest()['index'],
+            'k': k,
+            'build_s': build_s,
+            'build_docs_per_s': n_rows / build_s if build_s else None,
+            'load_s': load_s,
+            'index_bytes': folder_size(rag_setup.current_index_dir()),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'recall_at_k': recall_at_k(results, queries, k),
+            'cold_latency_p50_ms': percentile(cold, 50),
+            'latency_p50_ms': percentile(latencies, 50),
+            'latency_p95_ms': percentile(latencies, 95),
+            'latency_p99_ms': percentile(latencies, 99),
+            'queries': len(latencies)
+        }
+
+def compare(report, baseline):
+    """Liste les métriques en régression par rapport à la référence"""
+
+    reference = {(r['rows'], r['index_type']): r for r in baseline['scales']}
+    regressions = []
+    for result in report['scales']:
+        previous = reference.get((result['rows'], result['index_type']))
+        if previous is None:
+            continue
+        for metric, tolerance in THRESHOLDS.items():
+            old, new = previous.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            if metric == 'recall_at_k':
+                failed = new < old + tolerance
+            else:
+                failed = new > old * (1 + tolerance)
+            if failed:
+                regressions.append({'rows': result['rows'], 'metric': metric,
+                                    'baseline': old, 'current': new})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai du RAG NUTRIKAL")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help="nombres de lignes des bases synthétiques")
+    parser.add_argument('-k', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=20,
+                        help="passages des requêtes pour les latences")
+    parser.add_argument('--index', choices=rag_setup.INDEX_TYPES, default='flat')
+    parser.add_argument('--batch-size', type=int, default=rag_setup.EMBEDDING_BATCH_SIZE)
+    parser.add_argument('--output', help="fichier JSON du rapport")
+    parser.add_argument('--baseline', help="rapport de référence pour détecter les régressions")
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        result = run_scale(args.single, args.k, args.repeat, args.index, args.batch_size)
+        print(json.dumps(result))
+        return 0
+
+    # Un processus par taille pour que le pic mémoire mesuré soit le sien
+    report = {'model': rag_setup.EMBEDDING_MODEL, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'scales': []}
+    for n_rows in args.scales:
+        print(f"📏 {n_rows} aliments...", file=sys.stderr)
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--single', str(n_rows),
+             '-k', str(args.k), '--repeat', str(args.repeat), '--index', args.index,
+             '--batch-size', str(args.batch_size)],
+            stdout=subprocess.PIPE, text=True, check=True
+        )
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        report['scales'].append(result)
+        print(f"  build {result['build_s']:.1f}s, {result['index_bytes'] / 1e6:.1f} Mo, "
+              f"RSS {result['peak_rss_mb']:.0f} Mo, rappel@{args.k} {result['recall_at_k']:.0%}, "
+              f"p50/p95/p99 {result['latency_p50_ms']:.2f}/{result['latency_p95_ms']:.2f}/"
+              f"{result['latency_p99_ms']:.2f} ms", file=sys.stderr)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['regressions'] = compare(report, json.load(f))
+        for regression in report['regressions']:
+            print(f"❌ Régression {regression['metric']} à {regression['rows']} lignes: "
+                  f"{regression['baseline']:.4g} -> {regression['current']:.4g}", file=sys.stderr)
+        status = 1 if report['regressions'] else 0
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
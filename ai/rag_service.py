@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Service de recherche RAG NUTRIKAL
+Garde le modèle d'embeddings et l'index chargés en mémoire et répond aux
+recherches en HTTP (TCP ou socket Unix) pour le backend et l'assistant
+
+Endpoints:
+  GET  /health  -> le processus répond
+  GET  /ready   -> 200 une fois le modèle et l'index chargés, 503 sinon
+                   (version publiée servie et nombre de rechargements)
+  POST /search  -> {"query": "...", "k": 4}
+  POST /search_many -> {"queries": ["...", "..."], "k": 4}
+                   k entre 1 et min(MAX_K, taille de l'index), au plus MAX_QUERIES requêtes
+  POST /chat    -> {"message": "...", "prompt": "...", "conversation_id": "...",
+                    "user_id": "...", "priority": "interactive" | "batch", "deadline_s": 30}
+                   réponse de l'assistant en flux NDJSON : {"token": "..."} puis {"done": {...}}
+  GET  /metrics -> file d'attente des générations, caches, préfixes des prompts
+
+Une nouvelle version publiée par `rag_setup.py build` est chargée en
+arrière-plan puis substituée à l'ancienne sans interrompre les requêtes.
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import rag_setup
+import index_store
+from llm_scheduler import PRIORITIES
+
+MAX_BODY_SIZE = 4 * 1024 * 1024
+# Conversations suivies à la fois (en file de l'ordonnanceur ou en génération) ;
+# le nombre de générations simultanées est NUTRIKAL_LLM_MAX_IN_FLIGHT
+CHAT_WORKERS = 64
+# Bornes des recherches : au-delà, la requête est refusée (400)
+MAX_K = 100
+MAX_QUERIES = 64
+RELOAD_INTERVAL_S = 2.0
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+class RetrievalService:
+    """Serveur HTTP asyncio ; les recherches tournent dans un pool de threads"""
+
+    def __init__(self, workers=4, chat_workers=CHAT_WORKERS, reload_interval=RELOAD_INTERVAL_S):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rag-search')
+        # Les générations, longues, ne doivent pas bloquer les recherches
+        # Un thread par conversation, qui attend surtout dans la file de
+        # l'ordonnanceur : le pool doit dépasser largement max_in_flight pour
+        # que l'équité et les priorités s'appliquent dans la file, pas ici
+        self.chat_executor = ThreadPoolExecutor(max_workers=chat_workers, thread_name_prefix='rag-chat')
+        self.chat_workers = chat_workers
+        self.chats = 0
+        self.reload_interval = reload_interval
+        self.retriever = None
+        self.assistant = None
+        self.error = None
+        self.index_name = None
+        self.reloads = 0
+        self.reload_error = None
+        self.retired = None
+        self.requests = 0
+        self.started = time.time()
+
+    def open_index(self, embeddings=None):
+        """Charge la version publiée et la préchauffe ; retourne (nom, retriever)"""
+
+        name = index_store.current_version(rag_setup.VECTORSTORE_DIR)
+        folder = (os.path.join(rag_setup.VECTORSTORE_DIR, index_store.VERSIONS_DIR, name)
+                  if name else rag_setup.VECTORSTORE_DIR)
+        retriever = rag_setup.load_retriever(embeddings, folder=folder)
+        # Un premier encodage charge réellement les poids du modèle
+        retriever.search("préchauffage", k=1)
+        return name, retriever
+
+    def load(self):
+        """Charge le modèle et l'index (bloquant, exécuté hors de la boucle)"""
+
+        try:
+            self.index_name, self.retriever = self.open_index()
+            print(f"✅ Index {self.retriever.version} prêt")
+        except Exception as e:
+            self.error = str(e)
+            print(f"❌ Chargement de l'index impossible: {e}")
+            return
+
+        try:
+            from assistant import NutrikalAssistant
+            self.assistant = NutrikalAssistant(retriever=self.retriever)
+        except Exception as e:
+            print(f"⚠️ Assistant indisponible, /chat désactivé: {e}")
+        else:
+            # Préfixes des prompts système en cache côté Ollama avant la première question
+            try:
+                self.assistant.warm_up()
+            except Exception as e:
+                print(f"⚠️ Préchauffage des prompts impossible: {e}")
+
+        if self.reload_interval:
+            threading.Thread(target=self.watch, name='rag-reload', daemon=True).start()
+
+    def watch(self):
+        """Recharge l'index dès qu'une nouvelle version est publiée"""
+
+        while True:
+            time.sleep(self.reload_interval)
+            name = index_store.current_version(rag_setup.VECTORSTORE_DIR)
+            if name is not None and name != self.index_name and name != self.reload_error:
+                self.reload(name)
+
+    def reload(self, name):
+        """Substitue la nouvelle version à l'ancienne une fois chargée
+
+        Les requêtes en cours terminent sur l'ancien retriever, qu'elles ont
+        déjà en main ; en cas d'échec, l'ancienne version reste servie.
+        """
+
+        old = self.retriever
+        try:
+            name, retriever = self.open_index(old.vectorstore.embedding_function)
+        except Exception as e:
+            self.reload_error = name
+            print(f"❌ Rechargement de la version {name} impossible, {self.index_name} conservée: {e}")
+            return
+
+        # Une simple affectation : les lecteurs voient l'ancien ou le nouveau retriever
+        self.retriever = retriever
+        if self.assistant is not None:
+            self.assistant.retriever = retriever
+        self.index_name = name
+        self.reload_error = None
+        self.reloads += 1
+        print(f"♻️ Index rechargé: version {name}")
+
+        # Les threads d'un index par catégorie sont libérés au rechargement
+        # suivant, une fois ses dernières requêtes terminées depuis longtemps
+        if self.retired is not None and hasattr(self.retired.vectorstore, 'executor'):
+            self.retired.vectorstore.executor.shutdown(wait=False)
+        self.retired = old
+
+    @staticmethod
+    def serialize(results):
+        return [
+            {'id': doc.metadata.get('id'), 'content': doc.page_content, 'metadata': doc.metadata}
+            for doc in results
+        ]
+
+    def check_k(self, k):
+        """Message d'erreur si k est hors de 1..min(MAX_K, taille de l'index), sinon None"""
+
+        limit = max(1, min(MAX_K, len(self.retriever.bm25.ids)))
+        if not 1 <= k <= limit:
+            return f"k doit être compris entre 1 et {limit}"
+        return None
+
+    def search(self, query, k):
+        started = time.perf_counter()
+        retriever = self.retriever
+        results = retriever.search(query, k=k)
+        return {
+            'query': query,
+            'version': retriever.version,
+            'took_ms': (time.perf_counter() - started) * 1000,
+            'results': self.serialize(results)
+        }
+
+    def search_many(self, queries, k):
+        started = time.perf_counter()
+        retriever = self.retriever
+        results = retriever.search_many(queries, k=k)
+        return {
+            'version': retriever.version,
+            'took_ms': (time.perf_counter() - started) * 1000,
+            'results': [self.serialize(docs) for docs in results]
+        }
+
+    async def handle(self, method, path, body):
+        loop = asyncio.get_running_loop()
+
+        if path == '/health':
+            return 200, {'status': 'healthy', 'service': 'NUTRIKAL RAG',
+                         'uptime_s': time.time() - self.started}
+
+        if path == '/ready':
+            if self.retriever is None:
+                return 503, {'status': 'error' if self.error else 'loading', 'error': self.error}
+            retriever = self.retriever
+            stats = retriever.cache.stats() if retriever.cache else None
+            return 200, {'status': 'ready', 'version': retriever.version,
+                         'index': self.index_name, 'reloads': self.reloads,
+                         'reload_error': self.reload_error,
+                         'requests': self.requests, 'query_cache': stats}
+
+        if path == '/metrics':
+            if self.assistant is None:
+                return 503, {'error': "Assistant en cours de chargement"}
+            return 200, {'scheduler': self.assistant.scheduler.metrics(),
+                         'chats': {'active': self.chats, 'max': self.chat_workers},
+                         'semantic_cache': self.assistant.cache.stats(),
+                         'prefixes': self.assistant.prefix_stats(warmed=True),
+                         'query_cache': self.retriever.cache.stats() if self.retriever.cache else None}
+
+        if path == '/search':
+            if method != 'POST':
+                return 405, {'error': 'POST attendu'}
+            if self.retriever is None:
+                return 503, {'error': "Index en cours de chargement"}
+            try:
+                payload = json.loads(body or b'{}')
+                query = str(payload['query'])
+                k = int(payload.get('k', 4))
+            except (ValueError, KeyError, TypeError):
+                return 400, {'error': 'Corps attendu: {"query": "...", "k": 4}'}
+            error = self.check_k(k)
+            if error:
+                return 400, {'error': error}
+            self.requests += 1
+            return 200, await loop.run_in_executor(self.executor, self.search, query, k)
+
+        if path == '/search_many':
+            if method != 'POST':
+                return 405, {'error': 'POST attendu'}
+            if self.retriever is None:
+                return 503, {'error': "Index en cours de chargement"}
+            try:
+                payload = json.loads(body or b'{}')
+                queries = [str(query) for query in payload['queries']]
+                k = int(payload.get('k', 4))
+            except (ValueError, KeyError, TypeError):
+                return 400, {'error': 'Corps attendu: {"queries": ["..."], "k": 4}'}
+            if not 1 <= len(queries) <= MAX_QUERIES:
+                return 400, {'error': f"Entre 1 et {MAX_QUERIES} requêtes par lot"}
+            error = self.check_k(k)
+            if error:
+                return 400, {'error': error}
+            self.requests += 1
+            return 200, await loop.run_in_executor(self.executor, self.search_many, queries, k)
+
+        return 404, {'error': f"Route inconnue: {path}"}
+
+    def chat_events(self, payload, loop, queue, cancelled):
+        """Exécute la génération dans un thread et transmet ses événements à la boucle"""
+
+        try:
+            events = self.assistant.ask_stream(
+                payload['message'], payload.get('prompt'), payload['k'],
+                payload.get('conversation_id'), payload.get('user_id'), payload['priority'],
+                payload['deadline']
+            )
+            for kind, data in events:
+                if cancelled.is_set():
+                    events.close()
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, {kind: data})
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, {'error': str(e)})
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    async def stream_chat(self, writer, method, body, keep_alive):
+        """Répond à /chat en flux NDJSON (transfert par morceaux)"""
+
+        if method != 'POST':
+            return await self.respond(writer, 405, {'error': 'POST attendu'}, keep_alive)
+        if self.assistant is None:
+            return await self.respond(writer, 503, {'error': "Assistant en cours de chargement"},
+                                      keep_alive)
+        try:
+            payload = json.loads(body or b'{}')
+            payload['message'] = str(payload['message'])
+            payload['k'] = int(payload.get('k', 3))
+            payload['priority'] = payload.get('priority', 'interactive')
+            if payload['priority'] not in PRIORITIES:
+                raise ValueError(payload['priority'])
+            if payload.get('deadline_s') is not None:
+                payload['deadline_s'] = float(payload['deadline_s'])
+        except (ValueError, KeyError, TypeError):
+            return await self.respond(writer, 400, {'error': 'Corps attendu: {"message": "..."}'},
+                                      keep_alive)
+        # L'échéance court depuis l'arrivée de la requête
+        payload['deadline'] = self.assistant.scheduler.deadline_in(payload.get('deadline_s'))
+        # Au-delà, la requête attendrait un thread hors de la file équitable
+        if self.chats >= self.chat_workers:
+            return await self.respond(writer, 503, {'error': "Trop de conversations en cours"},
+                                      keep_alive)
+
+        self.requests += 1
+        writer.write(
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: application/x-ndjson; charset=utf-8\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Transfer-Encoding: chunked\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1')
+        )
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+        self.chats += 1
+        future = loop.run_in_executor(self.chat_executor, self.chat_events, payload, loop, queue,
+                                      cancelled)
+        future.add_done_callback(self._chat_done)
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                line = json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n'
+                writer.write(f"{len(line):x}\r\n".encode('latin-1') + line + b"\r\n")
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except ConnectionError:
+            # Client parti : la génération s'arrête au prochain token
+            cancelled.set()
+            raise
+
+    def _chat_done(self, future):
+        self.chats -= 1
+
+    async def serve_connection(self, reader, writer):
+        """Traite les requêtes HTTP/1.1 d'une connexion (keep-alive)"""
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                except ValueError:
+                    await self.respond(writer, 400, {'error': 'Requête invalide'}, False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY_SIZE:
+                    await self.respond(writer, 413, {'error': 'Corps trop volumineux'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if path.split('?')[0] == '/chat':
+                    await self.stream_chat(writer, method, body, keep_alive)
+                    if not keep_alive:
+                        break
+                    continue
+                try:
+                    status, payload = await self.handle(method, path.split('?')[0], body)
+                except Exception as e:
+                    status, payload = 500, {'error': str(e)}
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+    async def run(self, host='127.0.0.1', port=8765, socket_path=None):
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            server = await asyncio.start_unix_server(self.serve_connection, path=socket_path)
+            print(f"🚀 Service RAG NUTRIKAL sur unix:{socket_path}")
+        else:
+            server = await asyncio.start_server(self.serve_connection, host, port)
+            print(f"🚀 Service RAG NUTRIKAL sur http://{host}:{port}")
+
+        # Le serveur répond déjà à /health et /ready pendant le chargement
+        asyncio.get_running_loop().run_in_executor(self.executor, self.load)
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service de recherche RAG NUTRIKAL")
+    parser.add_argument('--host', default=os.environ.get('NUTRIKAL_RAG_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('NUTRIKAL_RAG_PORT', 8765)))
+    parser.add_argument('--socket', default=os.environ.get('NUTRIKAL_RAG_SOCKET'),
+                        help="chemin d'un socket Unix (remplace host/port)")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="threads dédiés aux recherches")
+    parser.add_argument('--chat-workers', type=int, default=CHAT_WORKERS,
+                        help="conversations suivies à la fois, au-delà : 503 "
+                             "(générations simultanées : NUTRIKAL_LLM_MAX_IN_FLIGHT)")
+    parser.add_argument('--reload-interval', type=float, default=RELOAD_INTERVAL_S,
+                        help="secondes entre deux vérifications d'une nouvelle version (0: jamais)")
+    args = parser.parse_args()
+
+    service = RetrievalService(workers=args.workers, chat_workers=args.chat_workers,
+                               reload_interval=args.reload_interval)
+    try:
+        asyncio.run(service.run(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        print("\n👋 Service RAG arrêté")
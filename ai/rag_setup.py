@@ -4,48 +4,560 @@
 Configuration RAG pour NUTRIKAL
 Indexe la base de données nutritionnelle pour permettre à l'IA
 de répondre avec des données factuelles sur les aliments
+
+Usage:
+  python rag_setup.py            # crée le CSV si besoin, indexe et teste
+  python rag_setup.py build      # (ré)indexe nutrition_kb.csv
+  python rag_setup.py build --sharded [--shard Poisson]
+                                 # un index par catégorie, reconstruits séparément
+  python rag_setup.py ingest export_ciqual.csv --sep ";"
+                                 # gros export ingéré par blocs, avec reprise
+  python rag_setup.py query "sources d'oméga-3"
+  python rag_setup.py check      # état du CSV et de l'index, sans charger de modèle
+  python rag_setup.py check --rows
+                                 # compare aussi chaque ligne de la base à l'index
+  python rag_setup.py dedup      # aperçu des aliments quasi dupliqués (build --dedup les fusionne)
+  python rag_setup.py bench      # latence de chargement et de recherche
+                                 # (suite complète : rag_bench.py)
+  python rag_setup.py parity     # backend ONNX int8 comparé à PyTorch
+  python rag_setup.py convert nutrition_kb.parquet
+                                 # base au format Parquet (ou .arrow), à utiliser
+                                 # avec --kb ou NUTRIKAL_KB_PATH
+
+Le backend d'embeddings se choisit avec --backend ou la variable
+NUTRIKAL_EMBEDDING_BACKEND : "torch" (sentence-transformers) ou "onnx"
+(ONNX Runtime quantifié en int8, plus rapide sur CPU).
+
+Les dépendances lourdes (pandas, LangChain, FAISS, modèle d'embeddings) ne
+sont importées que par les commandes qui en ont besoin.
 """
 
+import time
+
+# Pris avant les autres imports : le budget de `check` les inclut
+_STARTED = time.perf_counter()
+
 import os
-import pandas as pd
-from langchain.document_loaders import CSVLoader
-from langchain.text_splitter import CharacterTextSplitter  
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.llms import OpenAI
-from langchain.chains import RetrievalQA
+import sys
+import csv
+import json
+import re
+import shutil
+import hashlib
+import argparse
+import unicodedata
 
-def setup_nutrition_rag():
-    """Configure le système RAG avec les données nutritionnelles"""
+import index_store
 
-    print("🔧 Configuration du RAG NUTRIKAL...")
+KB_PATH = os.environ.get('NUTRIKAL_KB_PATH', 'nutrition_kb.csv')
+# Formats lus avec pyarrow (kb_store), projetés en mémoire
+KB_COLUMNAR_FORMATS = ('.parquet', '.arrow')
+VECTORSTORE_DIR = 'nutrikal_vectorstore'
+# Versions publiées conservées (dont la courante) pour les lecteurs encore actifs
+INDEX_RETENTION = int(os.environ.get('NUTRIKAL_INDEX_RETENTION', index_store.DEFAULT_RETENTION))
+MANIFEST_FILE = 'manifest.json'
+DOCUMENT_FORMAT = 'aliment-v1'
+NUMERIC_COLUMNS = ['calories_100g', 'proteines_100g', 'omega3_100g', 'magnesium_100g']
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_CACHE_PATH = 'embedding_cache.sqlite'
+EMBEDDING_CACHE_MAX_ENTRIES = 100_000
+EMBEDDING_BATCH_SIZE = 64
+INGEST_CHUNK_SIZE = 5000
+INGEST_CHECKPOINT_EVERY = 10
+INGEST_STATE_FILE = 'ingest_state.json'
+EMBEDDING_BACKENDS = ['torch', 'onnx']
+EMBEDDING_BACKEND = os.environ.get('NUTRIKAL_EMBEDDING_BACKEND', 'torch')
+# Vecteurs proches mais pas identiques à ceux de PyTorch : ni cache ni index partagés
+EMBEDDING_VARIANTS = {'onnx': 'onnx-int8'}
+# Similarité cosinus minimale exigée entre les vecteurs ONNX et PyTorch
+PARITY_MIN_COSINE = 0.99
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL = 3600
+CHECK_BUDGET_S = 0.5
 
-    # 1. Charger les données nutritionnelles
-    if not os.path.exists('nutrition_kb.csv'):
-        print("❌ Fichier nutrition_kb.csv manquant")
+TEST_QUERIES = [
+    "aliments pour améliorer la mémoire",
+    "sources d'oméga-3",
+    "réduire le stress avec l'alimentation",
+    "antioxydants pour le cerveau",
+    "petit-déjeuner pour la concentration"
+]
+
+# Modules que `check` ne doit jamais importer
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'faiss', 'langchain', 'torch',
+                 'sentence_transformers', 'onnxruntime', 'transformers']
+
+INDEX_TYPES = ['flat', 'ivf_flat', 'hnsw', 'ivf_pq']
+
+DEFAULT_INDEX_CONFIG = {
+    'type': 'flat',
+    'nlist': 1024,
+    'nprobe': 16,
+    'M': 32,
+    'efConstruction': 80,
+    'efSearch': 64,
+    'pq_m': 16,
+    'pq_bits': 8
+}
+
+# Types dont les vecteurs peuvent être retirés (mise à jour incrémentale).
+# Pas les IVF : remove_ids y garde les étiquettes d'origine alors que
+# LangChain renumérote index_to_docstore_id, et les ajouts suivants
+# réutilisent des étiquettes encore attribuées
+REMOVABLE_TYPES = {'flat'}
+
+# Paramètres significatifs de chaque type, affichés par `check`
+INDEX_PARAMS = {
+    'flat': [],
+    'ivf_flat': ['nlist', 'nprobe'],
+    'hnsw': ['M', 'efConstruction', 'efSearch'],
+    'ivf_pq': ['nlist', 'nprobe', 'pq_m', 'pq_bits']
+}
+
+def index_config(**overrides):
+    """Configuration d'index FAISS complète à partir des valeurs par défaut"""
+
+    config = dict(DEFAULT_INDEX_CONFIG)
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    if config['type'] not in INDEX_TYPES:
+        raise ValueError(f"Type d'index inconnu: {config['type']} (attendu: {', '.join(INDEX_TYPES)})")
+    return config
+
+def load_embedding_model(backend=None, threads=None):
+    """Modèle d'embeddings brut, sans cache, pour le backend demandé
+
+    `threads` borne les threads de calcul du modèle (processus du pool).
+    """
+
+    backend = backend or EMBEDDING_BACKEND
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Backend d'embeddings inconnu: {backend} "
+                         f"(attendu: {', '.join(EMBEDDING_BACKENDS)})")
+
+    if backend == 'onnx':
+        from onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings(EMBEDDING_MODEL, threads=threads)
+
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    from langchain.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+class LazyEmbeddingModel:
+    """Modèle d'embeddings chargé au premier encodage seulement
+
+    Quand l'encodage est confié aux processus du pool, le processus
+    principal n'a pas à garder sa propre copie du modèle en mémoire.
+    """
+
+    def __init__(self, backend=None, threads=None):
+        self.backend = backend
+        self.threads = threads
+        self._model = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._model is None:
+            self._model = load_embedding_model(self.backend, self.threads)
+        return getattr(self._model, name)
+
+def get_embeddings(backend=None, threads=None, lazy=False):
+    """Modèle d'embeddings du RAG, derrière le cache persistant
+
+    Avec `lazy`, le modèle n'est chargé qu'au premier texte absent du cache.
+    """
+
+    from embedding_cache import CachedEmbeddings
+
+    backend = backend or EMBEDDING_BACKEND
+    model = LazyEmbeddingModel(backend, threads) if lazy else load_embedding_model(backend, threads)
+    return CachedEmbeddings(
+        model,
+        model_name=EMBEDDING_MODEL,
+        path=EMBEDDING_CACHE_PATH,
+        max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+        variant=EMBEDDING_VARIANTS.get(backend)
+    )
+
+def print_cache_stats(embeddings):
+    """Affiche l'efficacité du cache d'embeddings"""
+
+    stats = embeddings.stats()
+    print(f"📦 Cache embeddings: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_rate']:.0%}), {stats['entries']} entrées")
+
+def embed_in_batches(embeddings, texts, batch_size=EMBEDDING_BATCH_SIZE):
+    """Encode des textes par lots de taille fixe"""
+
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+    return vectors
+
+_worker_embeddings = None
+
+def _init_embedding_worker(backend, threads):
+    """Charge le modèle une seule fois par processus du pool
+
+    Chaque processus se limite à sa part des cœurs : sans cela, chacun
+    lance autant de threads que de cœurs et ils se disputent le CPU.
+    """
+
+    global _worker_embeddings
+    _worker_embeddings = get_embeddings(backend, threads)
+
+def _embed_shard(texts, batch_size):
+    return embed_in_batches(_worker_embeddings, texts, batch_size)
+
+def embed_documents(docs, embeddings, batch_size=EMBEDDING_BATCH_SIZE, workers=1):
+    """Encode les documents par lots, éventuellement répartis sur plusieurs processus
+
+    Avec `workers` > 1, les documents sont découpés en fragments contigus
+    encodés en parallèle, puis les vecteurs sont réassemblés dans l'ordre.
+    Les processus sont lancés en mode spawn : un fork hériterait de l'état
+    des threads de torch et des verrous du processus principal.
+    """
+
+    texts = [doc.page_content for doc in docs]
+    started = time.perf_counter()
+
+    if workers > 1 and len(texts) > batch_size:
+        shard_size = -(-len(texts) // workers)
+        shards = [texts[i:i + shard_size] for i in range(0, len(texts), shard_size)]
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        threads = max(1, (os.cpu_count() or 1) // len(shards))
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_embedding_worker,
+                                 initargs=(EMBEDDING_BACKEND, threads)) as pool:
+            vectors = [v for shard in pool.map(_embed_shard, shards, [batch_size] * len(shards)) for v in shard]
+    else:
+        vectors = embed_in_batches(embeddings, texts, batch_size)
+
+    elapsed = time.perf_counter() - started
+    if texts:
+        print(f"⚡ {len(texts)} documents encodés en {elapsed:.2f}s "
+              f"({len(texts) / max(elapsed, 1e-9):.1f} docs/s, lots de {batch_size}, {max(workers, 1)} processus)")
+    return list(zip(texts, vectors))
+
+def row_key(row):
+    """Identifiant stable d'une ligne, dérivé du nom de l'aliment"""
+
+    name = unicodedata.normalize('NFKD', row.get('aliment', ''))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return '-'.join(name.lower().split()) or 'aliment'
+
+def row_hash(row):
+    """Empreinte SHA-256 du contenu complet d'une ligne
+
+    Les nombres sont normalisés sans perte de précision : une même ligne a
+    la même empreinte lue depuis le CSV ("1,80") ou depuis Parquet (1.8).
+    Une cellule illisible garde son texte, pour qu'une correction compte.
+    """
+
+    row = dict(row)
+    for column in NUMERIC_COLUMNS:
+        if column in row:
+            value = parse_number(row[column])
+            row[column] = repr(value) if value is not None else str(row[column] or '').strip()
+    payload = json.dumps(row, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def kb_is_columnar(path=None):
+    return os.path.splitext(path or KB_PATH)[1].lower() in KB_COLUMNAR_FORMATS
+
+def _read_raw_rows(path):
+    if kb_is_columnar(path):
+        from kb_store import read_rows
+        yield from read_rows(path)
+        return
+    with open(path, encoding='utf-8', newline='') as f:
+        yield from csv.DictReader(f)
+
+def read_kb_rows(path=None):
+    """Lit la base (CSV, Parquet ou Arrow) et associe chaque ligne à sa clé stable et son empreinte"""
+
+    rows = []
+    seen = {}
+    for row in _read_raw_rows(path or KB_PATH):
+        key = row_key(row)
+        # Deux aliments homonymes gardent des clés distinctes et stables
+        seen[key] = seen.get(key, 0) + 1
+        if seen[key] > 1:
+            key = f"{key}~{seen[key]}"
+        rows.append((key, row_hash(row), row))
+    return rows
+
+def current_index_dir():
+    """Dossier de la version publiée de l'index"""
+
+    return index_store.current_dir(VECTORSTORE_DIR)
+
+def load_manifest(folder=None):
+    """Charge le manifeste de l'index (version publiée par défaut), ou None s'il n'existe pas"""
+
+    path = os.path.join(folder or current_index_dir(), MANIFEST_FILE)
+    if not os.path.exists(path):
         return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest, folder):
+    """Écrit le manifeste à côté de l'index"""
+
+    path = os.path.join(folder, MANIFEST_FILE)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
 
-    loader = CSVLoader('nutrition_kb.csv', encoding='utf-8')
-    documents = loader.load()
-    print(f"✅ {len(documents)} aliments chargés")
+def parse_number(value):
+    """Convertit une cellule numérique du CSV, None si vide ou invalide"""
 
-    # 2. Diviser en chunks
-    text_splitter = CharacterTextSplitter(
-        chunk_size=200,
-        chunk_overlap=20
+    # Valeur déjà typée, lue dans une colonne Arrow : aucune analyse de texte
+    if value is None or type(value) is float:
+        return value
+    try:
+        return float(str(value).replace(',', '.'))
+    except (TypeError, ValueError):
+        return None
+
+def format_number(value, unit):
+    return f"{value:g} {unit}" if value is not None else "n.c."
+
+def build_food_document(key, row):
+    """Rend une ligne du CSV en un document unique et compact
+
+    Les colonnes numériques sont conservées en métadonnées pour le filtrage.
+    """
+
+    from langchain.docstore.document import Document
+
+    metadata = {'id': key, 'aliment': row.get('aliment', ''), 'categorie': row.get('categorie', '')}
+    # Base colonnaire : les floats viennent tels quels des colonnes Arrow
+    metadata.update((column, parse_number(row.get(column))) for column in NUMERIC_COLUMNS)
+
+    page_content = (
+        f"{metadata['aliment']} ({metadata['categorie']}). "
+        f"Pour 100 g : {format_number(metadata['calories_100g'], 'kcal')}, "
+        f"protéines {format_number(metadata['proteines_100g'], 'g')}, "
+        f"oméga-3 {format_number(metadata['omega3_100g'], 'g')}, "
+        f"magnésium {format_number(metadata['magnesium_100g'], 'mg')}. "
+        f"Cerveau : {row.get('benefices_cerveau', '').strip()} "
+        f"Conseils : {row.get('conseils_consommation', '').strip()}"
     )
-    docs = text_splitter.split_documents(documents)
-    print(f"✅ {len(docs)} chunks créés")
+    return Document(page_content=page_content, metadata=metadata)
+
+def dedup_kb_rows(rows, verbose=False):
+    """Fusionne les aliments quasi dupliqués et affiche le nombre de lignes retirées"""
+
+    from kb_dedup import dedup_rows
+
+    started = time.perf_counter()
+    rows, report = dedup_rows(rows)
+    print(f"♻️ Déduplication: {report['removed']} lignes fusionnées, {report['kept']}/{report['rows']} "
+          f"aliments conservés ({len(report['clusters'])} groupes, {report['candidates']} paires candidates, "
+          f"{time.perf_counter() - started:.2f}s)")
+    for canonical, duplicates in report['clusters'][:None if verbose else 10]:
+        print(f"   - {canonical} <- {', '.join(duplicates)}")
+    if not verbose and len(report['clusters']) > 10:
+        print(f"   ... {len(report['clusters']) - 10} autres groupes")
+    return rows
+
+def load_kb_documents(rows, keys=None):
+    """Construit un document par aliment, identifié par sa clé stable"""
+
+    docs, ids, row_ids = [], [], {}
+    for key, _, row in rows:
+        if keys is not None and key not in keys:
+            continue
+        docs.append(build_food_document(key, row))
+        ids.append(key)
+        row_ids[key] = [key]
+    return docs, ids, row_ids
+
+def embedding_namespace(backend=None):
+    """Modèle et variante du backend : deux index de même espace sont mélangeables"""
+
+    variant = EMBEDDING_VARIANTS.get(backend or EMBEDDING_BACKEND)
+    return f"{EMBEDDING_MODEL}#{variant}" if variant else EMBEDDING_MODEL
+
+def manifest_is_compatible(manifest, config):
+    """Vérifie qu'un index existant peut être mis à jour incrémentalement
 
-    # 3. Créer les embeddings
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2"
+    Un index construit par un autre backend est reconstruit en entier :
+    ses vecteurs ne se mélangent pas avec ceux du backend actuel.
+    """
+
+    return (
+        manifest is not None
+        and manifest.get('model') == EMBEDDING_MODEL
+        # Les manifestes antérieurs au backend ONNX ont été construits avec PyTorch
+        and manifest.get('backend', 'torch') == EMBEDDING_BACKEND
+        and manifest.get('document_format') == DOCUMENT_FORMAT
+        and manifest.get('index') == config
+        and 'dimension' in manifest
+        and config['type'] in REMOVABLE_TYPES
+        and manifest.get('layout') != 'sharded'
     )
 
-    # 4. Créer l'index vectoriel
-    vectorstore = FAISS.from_documents(docs, embeddings)
-    vectorstore.save_local("nutrikal_vectorstore")
-    print("✅ Index vectoriel sauvegardé")
+def load_nutrition_vectorstore(embeddings=None, folder=None, mmap=True):
+    """Charge l'index en vérifiant qu'il a été construit avec le même modèle
+
+    Lève ValueError si le manifeste manque ou ne correspond pas au modèle
+    d'embeddings. Retourne (vectorstore, manifeste).
+    """
+
+    folder = folder or current_index_dir()
+    manifest = load_manifest(folder)
+    if manifest is None or 'dimension' not in manifest:
+        raise ValueError(f"Manifeste absent ou incomplet dans {folder}, reconstruisez l'index")
+    if manifest['model'] != EMBEDDING_MODEL:
+        raise ValueError(f"Index construit avec {manifest['model']}, "
+                         f"mais le modèle configuré est {EMBEDDING_MODEL}")
+
+    embeddings = embeddings or get_embeddings()
+    model_name = getattr(embeddings, 'model_name', None)
+    if model_name != manifest['model']:
+        raise ValueError(f"Index construit avec {manifest['model']}, "
+                         f"incompatible avec les embeddings {model_name}")
+
+    if manifest.get('layout') == 'sharded':
+        from sharded_index import ShardRouter
+
+        vectorstore = ShardRouter.load(os.path.join(folder, 'shards'), embeddings, mmap=mmap)
+        missing = set(manifest['shards']) - set(vectorstore.shards)
+        if missing:
+            raise ValueError(f"Index de catégorie manquants: {', '.join(sorted(missing))}")
+        dimension = vectorstore.dimension
+    else:
+        from faiss_index import load_vectorstore
+
+        vectorstore = load_vectorstore(folder, embeddings, manifest['index'], mmap=mmap)
+        dimension = vectorstore.index.d
+    if dimension != manifest['dimension']:
+        raise ValueError(f"Dimension de l'index ({dimension}) différente "
+                         f"du manifeste ({manifest['dimension']})")
+    return vectorstore, manifest
+
+def index_version(manifest):
+    """Version de l'index, dérivée de son contenu et de sa configuration"""
+
+    payload = json.dumps(
+        {key: manifest.get(key) for key in ('model', 'document_format', 'index', 'layout', 'rows')},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def load_retriever(embeddings=None, cache=None, folder=None):
+    """Charge l'index et ses index annexes derrière un HybridRetriever
+
+    Le dossier de la version publiée est résolu une seule fois : tous les
+    fichiers viennent de la même version même si une autre est publiée
+    pendant le chargement.
+    """
+
+    from hybrid_search import BM25Index, HybridRetriever
+    from nutrient_filter import NutrientIndex
+    from query_cache import QueryCache
+
+    folder = folder or current_index_dir()
+    vectorstore, manifest = load_nutrition_vectorstore(embeddings, folder)
+    return HybridRetriever(
+        vectorstore,
+        BM25Index.load(folder),
+        NutrientIndex.load(folder),
+        cache=cache or QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL),
+        version=manifest.get('version')
+    )
+
+def save_index(vectorstore, rows, manifest, path=None, sources=None, staging=None,
+               bm25=None, nutrients=None):
+    """Sauvegarde l'index FAISS, l'index lexical BM25 et le manifeste
+
+    Tout est écrit dans un dossier de travail (`staging`, créé si absent)
+    puis publié comme nouvelle version : les lecteurs ne voient jamais un
+    index à moitié écrit. Retourne le dossier de la version publiée.
+
+    Les index par catégorie sont déjà dans `staging` (`vectorstore` à None).
+    `path` est la base dont viennent `rows` (KB_PATH par défaut) ; en format
+    colonnaire, l'index des nutriments est construit depuis ses seules
+    colonnes numériques. `sources` ({clé: empreinte} de toutes les lignes
+    de la base) est donné quand `rows` a été dédupliqué. `bm25` et
+    `nutrients`, construits au fil de l'eau, dispensent de `rows`.
+    """
+
+    from hybrid_search import BM25Index
+    from nutrient_filter import NutrientIndex
+
+    if sources is not None:
+        manifest['sources'] = sources
+    else:
+        manifest.pop('sources', None)
+    manifest['version'] = index_version(manifest)
+    staging = staging or index_store.new_staging_dir(VECTORSTORE_DIR)
+    if vectorstore is not None:
+        vectorstore.save_local(staging)
+    (bm25 or BM25Index.from_rows(rows)).save(staging)
+    if nutrients is None and kb_is_columnar(path) and sources is None:
+        from kb_store import read_numeric
+        nutrients = NutrientIndex.from_columns([key for key, _, _ in rows],
+                                               read_numeric(path or KB_PATH, NUMERIC_COLUMNS))
+    elif nutrients is None:
+        nutrients = NutrientIndex.from_documents(load_kb_documents(rows)[0])
+    nutrients.save(staging)
+    save_manifest(manifest, staging)
+
+    name = index_store.publish(VECTORSTORE_DIR, staging, manifest['version'], INDEX_RETENTION)
+    print(f"📌 Version {name} publiée")
+    return os.path.join(VECTORSTORE_DIR, index_store.VERSIONS_DIR, name)
+
+def setup_nutrition_rag(incremental=False, batch_size=EMBEDDING_BATCH_SIZE, workers=1,
+                        config=None, report=False, sharded=False, shards=None, dedup=False):
+    """Configure le système RAG avec les données nutritionnelles
+
+    En mode incrémental, seules les lignes nouvelles ou modifiées sont
+    ré-encodées et les vecteurs des lignes supprimées sont retirés de l'index.
+    `config` choisit le type d'index FAISS (voir index_config).
+
+    Avec `sharded`, un index est construit par catégorie ; seuls ceux dont
+    les lignes ont changé (ou ceux listés dans `shards`) sont reconstruits.
+
+    Avec `dedup`, les aliments quasi dupliqués sont fusionnés avant
+    l'indexation (voir kb_dedup).
+    """
+
+    config = config or index_config()
+
+    print("🔧 Configuration du RAG NUTRIKAL...")
+
+    # 1. Charger les données nutritionnelles
+    if not os.path.exists(KB_PATH):
+        print(f"❌ Fichier {KB_PATH} manquant")
+        return None
+
+    rows = read_kb_rows()
+    print(f"✅ {len(rows)} aliments chargés")
+
+    sources = None
+    if dedup:
+        sources = {key: h for key, h, _ in rows}
+        rows = dedup_kb_rows(rows)
+
+    # 2. Créer les embeddings
+    # Avec plusieurs processus, ce sont eux qui chargent le modèle
+    embeddings = get_embeddings(lazy=workers > 1)
+
+    manifest = load_manifest() if incremental else None
+    if sharded or shards:
+        vectorstore = build_sharded_rag(rows, embeddings, batch_size, workers, config,
+                                        only=shards, full=not incremental, sources=sources)
+    elif manifest_is_compatible(manifest, config):
+        vectorstore = update_nutrition_rag(rows, manifest, embeddings, batch_size, workers, sources)
+    else:
+        if incremental:
+            print("ℹ️ Aucun manifeste compatible, reconstruction complète")
+        vectorstore = build_nutrition_rag(rows, embeddings, batch_size, workers, config, report, sources)
 
     # 5. Tester la recherche
     query = "aliments riches en oméga-3"
@@ -54,8 +566,411 @@ def setup_nutrition_rag():
     for i, result in enumerate(results):
         print(f"  {i+1}. {result.page_content[:100]}...")
 
+    print_cache_stats(embeddings)
+    return vectorstore
+
+def build_nutrition_rag(rows, embeddings, batch_size=EMBEDDING_BATCH_SIZE, workers=1,
+                        config=None, report=False, sources=None):
+    """Reconstruit entièrement l'index vectoriel"""
+
+    from faiss_index import build_vectorstore, recall_report
+
+    config = config or index_config()
+
+    # 3. Un document par aliment
+    docs, ids, row_ids = load_kb_documents(rows)
+    print(f"✅ {len(docs)} documents créés")
+
+    # 4. Créer l'index vectoriel
+    text_embeddings = embed_documents(docs, embeddings, batch_size, workers)
+    vectorstore, used = build_vectorstore(
+        text_embeddings, embeddings,
+        [doc.metadata for doc in docs], ids, config
+    )
+    save_index(vectorstore, rows, {
+        'model': EMBEDDING_MODEL,
+        'document_format': DOCUMENT_FORMAT,
+        'index': used,
+        'dimension': vectorstore.index.d,
+        'backend': EMBEDDING_BACKEND,
+        'rows': {key: {'hash': h, 'ids': row_ids[key]} for key, h, _ in rows}
+    }, sources=sources)
+    print(f"✅ Index vectoriel {config['type']} sauvegardé")
+
+    if report and text_embeddings:
+        stats = recall_report([vector for _, vector in text_embeddings], used)
+        print(f"📊 Rappel@{stats['k']} vs index exact: {stats['recall_at_k']:.1%} "
+              f"({stats['index_ms_per_query']:.3f} ms/requête contre "
+              f"{stats['flat_ms_per_query']:.3f} ms en flat, {stats['queries']} requêtes)")
+
     return vectorstore
 
+def build_sharded_rag(rows, embeddings, batch_size=EMBEDDING_BATCH_SIZE, workers=1,
+                      config=None, only=None, full=False, sources=None):
+    """Construit un index FAISS par catégorie
+
+    Un index n'est reconstruit que si ses lignes ont changé depuis son
+    manifeste, si `full` est demandé, ou s'il figure dans `only` (noms de
+    catégories ou de dossiers) : les autres sont repris de la version
+    publiée par liens physiques, sans copie.
+
+    BM25, l'index des nutriments et le manifeste portent sur toutes les
+    lignes : avec `only`, la construction est refusée si une autre
+    catégorie est obsolète, plutôt que de publier des lignes absentes des
+    index de catégorie.
+    """
+
+    from sharded_index import ShardRouter, group_by_category, shard_slug
+
+    config = config or index_config()
+    only = {shard_slug(name) for name in only} if only else None
+    groups = group_by_category(rows)
+    slugs = {shard_slug(category): category for category in groups}
+    if only and only - set(slugs):
+        raise ValueError(f"Catégories inconnues: {', '.join(sorted(only - set(slugs)))}")
+
+    published = os.path.join(current_index_dir(), 'shards')
+    states = {slug: _shard_state(slug, groups[category], published, config)
+              for slug, category in slugs.items()}
+    if only is not None:
+        stale = sorted(slugs[slug] for slug, (_, _, current) in states.items()
+                       if not current and slug not in only)
+        if stale:
+            raise ValueError(f"Index obsolètes ou absents: {', '.join(stale)} ; ajoutez-les "
+                             f"(--shard) ou reconstruisez tout (build --sharded)")
+
+    staging = index_store.new_staging_dir(VECTORSTORE_DIR)
+    shards, rebuilt = {}, 0
+    try:
+        for slug, category in slugs.items():
+            shards[slug], built = _build_shard(
+                slug, category, groups[category], states[slug], published,
+                os.path.join(staging, 'shards', slug), embeddings, batch_size, workers, config,
+                full or (only is not None and slug in only)
+            )
+            rebuilt += built
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    print(f"✅ {rebuilt} index reconstruits, {len(slugs) - rebuilt} inchangés")
+
+    folder = save_index(None, rows, {
+        'model': EMBEDDING_MODEL,
+        'document_format': DOCUMENT_FORMAT,
+        'index': config,
+        'layout': 'sharded',
+        'dimension': next(iter(shards.values()))['dimension'],
+        'backend': EMBEDDING_BACKEND,
+        'shards': {slug: {'category': shard['category'], 'version': shard['version'],
+                          'rows': shard['rows']} for slug, shard in shards.items()},
+        'rows': {key: {'hash': h, 'ids': [key]} for key, h, _ in rows}
+    }, sources=sources, staging=staging)
+    print(f"✅ {len(shards)} index de catégorie {config['type']} sauvegardés")
+
+    return ShardRouter.load(os.path.join(folder, 'shards'), embeddings, mmap=False)
+
+def _shard_state(slug, shard_rows, published, config):
+    """(version attendue, manifeste publié ou None, vrai si l'index publié est à jour)"""
+
+    from sharded_index import load_shard_manifest, shard_version
+
+    version = shard_version(shard_rows, config, embedding_namespace())
+    existing = load_shard_manifest(os.path.join(published, slug))
+    return version, existing, existing is not None and existing['version'] == version
+
+def _build_shard(slug, category, shard_rows, state, published, target, embeddings, batch_size,
+                 workers, config, force):
+    """Construit l'index d'une catégorie dans `target`, ou y reprend celui de la version publiée
+
+    Retourne (manifeste de l'index, 1 s'il a été reconstruit sinon 0).
+    """
+
+    from faiss_index import build_vectorstore
+    from sharded_index import link_shard, save_shard
+
+    version, existing, current = state
+    if force or not current:
+        docs, ids, _ = load_kb_documents(shard_rows)
+        text_embeddings = embed_documents(docs, embeddings, batch_size, workers)
+        vectorstore, used = build_vectorstore(
+            text_embeddings, embeddings, [doc.metadata for doc in docs], ids, config
+        )
+        manifest = {'category': category, 'version': version, 'index': used,
+                    'dimension': vectorstore.index.d, 'rows': len(shard_rows)}
+        save_shard(vectorstore, target, manifest)
+        print(f"✅ Index '{category}': {len(docs)} documents")
+        return manifest, 1
+
+    link_shard(os.path.join(published, slug), target)
+    return existing, 0
+
+def update_nutrition_rag(rows, manifest, embeddings, batch_size=EMBEDDING_BATCH_SIZE, workers=1,
+                         sources=None):
+    """Met à jour l'index à partir des empreintes du manifeste"""
+
+    indexed = manifest['rows']
+    current = {key: h for key, h, _ in rows}
+
+    changed = {key for key, h in current.items() if indexed.get(key, {}).get('hash') != h}
+    removed = set(indexed) - set(current)
+    print(f"✅ {len(changed)} lignes nouvelles ou modifiées, {len(removed)} supprimées")
+
+    vectorstore, _ = load_nutrition_vectorstore(embeddings, mmap=False)
+    if not changed and not removed:
+        print("✅ Index vectoriel déjà à jour")
+        if (not os.path.exists(os.path.join(current_index_dir(), 'nutrients.json'))
+                or manifest.get('sources') != sources):
+            save_index(vectorstore, rows, manifest, sources=sources)
+        return vectorstore
+
+    # 3. Retirer les vecteurs obsolètes via leurs IDs stables
+    stale_ids = [i for key in changed | removed for i in indexed.get(key, {}).get('ids', [])]
+    if stale_ids:
+        vectorstore.delete(stale_ids)
+
+    # 4. Encoder uniquement les lignes nouvelles ou modifiées
+    docs, ids, row_ids = load_kb_documents(rows, keys=changed)
+    if docs:
+        text_embeddings = embed_documents(docs, embeddings, batch_size, workers)
+        vectorstore.add_embeddings(
+            text_embeddings, metadatas=[doc.metadata for doc in docs], ids=ids
+        )
+    print(f"✅ {len(docs)} documents ré-encodés")
+
+    for key in removed:
+        del indexed[key]
+    for key in changed:
+        indexed[key] = {'hash': current[key], 'ids': row_ids[key]}
+
+    save_index(vectorstore, rows, manifest, sources=sources)
+    print("✅ Index vectoriel mis à jour")
+
+    return vectorstore
+
+def ingest_nutrition_kb(source, output='nutrition_kb.csv', chunk_size=INGEST_CHUNK_SIZE,
+                        batch_size=EMBEDDING_BATCH_SIZE, workers=1, config=None, resume=True,
+                        checkpoint_every=INGEST_CHECKPOINT_EVERY, sep=',', encoding='utf-8',
+                        mode=None):
+    """Ingère un export volumineux bloc par bloc dans `output` et l'index
+
+    Chaque bloc est validé, normalisé, ajouté au CSV puis encodé et ajouté à
+    l'index, à l'index BM25 et aux colonnes de nutriments : la base n'est
+    jamais relue. Tous les `checkpoint_every` blocs, le CSV, le journal des
+    documents indexés (en ajout seul, voir IngestLog) et la progression sont
+    écrits ; une ingestion interrompue de la même source reprend au dernier
+    point en rejouant le journal, sans réencoder.
+
+    Un `output` existant n'est jamais écrasé sans `mode` : 'append' garde
+    ses lignes (indexées avant l'export), 'replace' le remplace.
+    """
+
+    from array import array
+
+    import numpy as np
+    from faiss_index import build_vectorstore
+    from hybrid_search import BM25Index, row_terms
+    from kb_ingest import IngestLog, IngestState, normalize_row, open_output, read_chunks
+    from nutrient_filter import NutrientIndex
+
+    config = config or index_config()
+    os.makedirs(os.path.join(VECTORSTORE_DIR, index_store.VERSIONS_DIR), exist_ok=True)
+    state_path = os.path.join(VECTORSTORE_DIR, INGEST_STATE_FILE)
+
+    state = IngestState.resume(state_path, source, output) if resume else None
+    if state is not None and not os.path.isdir(state.data.get('staging') or ''):
+        state = None
+    # Le journal porte les vecteurs du backend de l'ingestion interrompue
+    if state is not None and state.data.get('backend', 'torch') != EMBEDDING_BACKEND:
+        print(f"⚠️ Ingestion interrompue encodée avec le backend {state.data.get('backend', 'torch')}, "
+              f"reprise du début avec {EMBEDDING_BACKEND}")
+        state = None
+    # Journal écrit au-delà du point de reprise : ramené à celui-ci
+    if state is not None and not IngestLog(state.data['staging']).truncate(
+            state.data.get('log_bytes', 0), state.data['accepted'] + state.data.get('kept', 0),
+            state.data.get('dimension')):
+        print("⚠️ Journal et point de reprise incohérents, ingestion reprise du début")
+        state = None
+
+    # Sans reprise, `output` porte encore ce qu'a écrit l'ingestion abandonnée :
+    # ses lignes d'origine (--append) sont rétablies, le reste est refait
+    previous = IngestState.interrupted(state_path, output) if state is None else None
+    if previous is not None and os.path.exists(output):
+        if previous.get('kept_bytes'):
+            with open(output, 'rb+') as f:
+                f.truncate(previous['kept_bytes'])
+            mode = 'append'
+            print(f"♻️ {output} ramené à ses {previous['kept']} aliments d'origine")
+        else:
+            mode = 'replace'
+
+    existing = state is None and os.path.exists(output) and os.path.getsize(output) > 0
+    if existing and mode is None:
+        print(f"❌ {output} existe déjà : --append pour y ajouter l'export, "
+              f"--force pour le remplacer, ou --output vers un autre fichier")
+        return None
+    if existing and mode == 'append' and kb_is_columnar(output):
+        print(f"❌ Ajout impossible à {output} (format colonnaire), ingérez vers un CSV")
+        return None
+
+    # Avec plusieurs processus, ce sont eux qui chargent le modèle
+    embeddings = get_embeddings(lazy=workers > 1)
+    if state is None:
+        # L'index en construction reste hors des versions publiées jusqu'à la fin
+        index_store.discard_staging(VECTORSTORE_DIR, index_store.INGEST_PREFIX)
+        state = IngestState(state_path, source, output)
+        state.data['backend'] = EMBEDDING_BACKEND
+        state.data['staging'] = index_store.new_staging_dir(VECTORSTORE_DIR, index_store.INGEST_PREFIX)
+
+    log = IngestLog(state.data['staging'])
+    manifest = {
+        'model': EMBEDDING_MODEL,
+        'document_format': DOCUMENT_FORMAT,
+        'index': config,
+        'backend': EMBEDDING_BACKEND,
+        'rows': {}
+    }
+    vectorstore = None
+    bm25 = BM25Index([], [], {})
+    nutrient_ids, nutrient_values = [], {column: array('d') for column in NUMERIC_COLUMNS}
+
+    def add(entries, vectors):
+        nonlocal vectorstore
+        ids = [entry['id'] for entry in entries]
+        metadatas = [entry['metadata'] for entry in entries]
+        text_embeddings = list(zip([entry['text'] for entry in entries], vectors))
+        if vectorstore is None:
+            vectorstore, manifest['index'] = build_vectorstore(
+                text_embeddings, embeddings, metadatas, ids, config
+            )
+            manifest['dimension'] = vectorstore.index.d
+        else:
+            vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        bm25.add(ids, [entry['terms'] for entry in entries])
+        nutrient_ids.extend(ids)
+        for column, values in nutrient_values.items():
+            values.extend(float('nan') if m[column] is None else m[column] for m in metadatas)
+        for entry in entries:
+            manifest['rows'][entry['id']] = {'hash': entry['hash'], 'ids': [entry['id']]}
+
+    def index_rows(rows):
+        docs, _, _ = load_kb_documents(rows)
+        text_embeddings = embed_documents(docs, embeddings, batch_size, workers)
+        vectors = np.array([vector for _, vector in text_embeddings], dtype='float32')
+        entries = [{'id': key, 'hash': h, 'text': text, 'metadata': doc.metadata, 'terms': row_terms(row)}
+                   for (key, h, row), doc, (text, _) in zip(rows, docs, text_embeddings)]
+        add(entries, vectors)
+        log.append(entries, vectors)
+        state.data.setdefault('first_batch', len(entries))
+        state.data['dimension'] = vectors.shape[1]
+
+    if state.data['accepted'] or state.data.get('kept'):
+        for entries, vectors in log.replay(state.data['dimension'], state.data['first_batch'], chunk_size):
+            add(entries, vectors)
+        print(f"♻️ Reprise après {state.data['rows_read']} lignes lues, "
+              f"{state.data['accepted']} aliments indexés")
+
+    if existing and mode == 'append':
+        # Les lignes déjà présentes (base éditée à la main) sont indexées en premier
+        kept = read_kb_rows(output)
+        with open(output, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+        state.data['output_bytes'] = state.data['kept_bytes'] = os.path.getsize(output)
+        state.data['kept'] = len(kept)
+        # Point de reprise immédiat : une reprise ne relit pas ces lignes comme ajoutées
+        if kept:
+            index_rows(kept)
+        state.data['log_bytes'] = log.sync()
+        state.save()
+        print(f"📌 {len(kept)} aliments de {output} conservés")
+
+    # Même numérotation des homonymes que read_kb_rows
+    seen = {}
+    for key in manifest['rows']:
+        base = re.sub(r'~\d+$', '', key)
+        seen[base] = seen.get(base, 0) + 1
+
+    mapping, chunks = read_chunks(source, chunk_size, state.data['rows_read'], sep, encoding)
+    print(f"📥 Colonnes reconnues: {', '.join(f'{h} -> {c}' for h, c in mapping.items())}")
+
+    f, writer = open_output(output, state.data['output_bytes'])
+
+    def checkpoint():
+        f.flush()
+        os.fsync(f.fileno())
+        state.data['log_bytes'] = log.sync()
+        state.data['output_bytes'] = f.tell()
+        state.save()
+
+    try:
+        for n, chunk in enumerate(chunks, 1):
+            rows = []
+            for raw in chunk:
+                row, reason = normalize_row(raw, mapping)
+                if row is None:
+                    state.reject(reason)
+                    continue
+                key = row_key(row)
+                seen[key] = seen.get(key, 0) + 1
+                if seen[key] > 1:
+                    key = f"{key}~{seen[key]}"
+                rows.append((key, row_hash(row), row))
+            writer.writerows(row for _, _, row in rows)
+
+            if rows:
+                index_rows(rows)
+
+            state.data['rows_read'] += len(chunk)
+            state.data['accepted'] += len(rows)
+            print(f"📦 Bloc {n}: {state.data['rows_read']} lignes lues, {state.data['accepted']} aliments indexés")
+            if n % checkpoint_every == 0:
+                checkpoint()
+        checkpoint()
+    finally:
+        f.close()
+
+    rejected = state.data['rejected']
+    print(f"✅ {state.data['accepted']} aliments ingérés, {sum(rejected.values())} lignes rejetées")
+    for reason, count in sorted(rejected.items(), key=lambda item: -item[1]):
+        print(f"   - {reason}: {count}")
+
+    log.remove()
+    if vectorstore is None:
+        print("❌ Aucune ligne valide dans la source")
+        state.clear()
+        return None
+
+    # Index annexes tenus à jour bloc par bloc : la base n'est pas relue
+    nutrients = NutrientIndex.from_columns(
+        nutrient_ids, {column: np.frombuffer(values) for column, values in nutrient_values.items()}
+    )
+    save_index(vectorstore, None, manifest, output, staging=state.data['staging'],
+               bm25=bm25, nutrients=nutrients)
+    state.clear()
+    print(f"✅ Index vectoriel {config['type']} sauvegardé")
+    return vectorstore
+
+def convert_kb(target, source=None):
+    """Convertit la base vers Parquet ou Arrow IPC (selon l'extension de `target`)"""
+
+    from kb_store import convert
+
+    source = source or KB_PATH
+    if not kb_is_columnar(target):
+        print(f"❌ Format cible non colonnaire: {target} (attendu: {', '.join(KB_COLUMNAR_FORMATS)})")
+        return False
+    if not os.path.exists(source):
+        print(f"❌ Fichier {source} manquant")
+        return False
+
+    count = convert(source, target)
+    print(f"✅ {count} aliments écrits dans {target} "
+          f"({os.path.getsize(source) / 1e6:.2f} Mo -> {os.path.getsize(target) / 1e6:.2f} Mo)")
+    print(f"ℹ️ Utiliser avec --kb {target} ou NUTRIKAL_KB_PATH={target}")
+    return True
+
 def create_nutrition_kb_csv():
     """Crée un fichier CSV avec les données nutritionnelles de base"""
 
@@ -112,48 +1027,320 @@ def create_nutrition_kb_csv():
         }
     ]
 
+    import pandas as pd
+
     df = pd.DataFrame(nutrition_data)
-    df.to_csv('nutrition_kb.csv', index=False, encoding='utf-8')
-    print(f"✅ Fichier nutrition_kb.csv créé avec {len(nutrition_data)} aliments")
+    if kb_is_columnar():
+        import pyarrow as pa
+        from kb_store import write_table
+        write_table(pa.Table.from_pandas(df, preserve_index=False), KB_PATH)
+    else:
+        df.to_csv(KB_PATH, index=False, encoding='utf-8')
+    print(f"✅ Fichier {KB_PATH} créé avec {len(nutrition_data)} aliments")
 
     return df
 
-def test_rag_queries():
+def test_rag_queries(queries=None, k=2):
     """Teste différentes requêtes sur le système RAG"""
 
-    test_queries = [
-        "aliments pour améliorer la mémoire",
-        "sources d'oméga-3",
-        "réduire le stress avec l'alimentation", 
-        "antioxydants pour le cerveau",
-        "petit-déjeuner pour la concentration"
-    ]
+    queries = queries or TEST_QUERIES
 
-    if not os.path.exists("nutrikal_vectorstore"):
+    if not os.path.exists(VECTORSTORE_DIR):
         print("❌ Index RAG non trouvé. Exécutez setup_nutrition_rag() d'abord.")
         return
 
-    embeddings = HuggingFaceEmbeddings()
-    vectorstore = FAISS.load_local("nutrikal_vectorstore", embeddings)
+    embeddings = get_embeddings()
+    try:
+        retriever = load_retriever(embeddings)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
 
     print("🧪 Test des requêtes RAG:")
-    for query in test_queries:
-        results = vectorstore.similarity_search(query, k=2)
+    for query, results in zip(queries, retriever.search_many(queries, k=k)):
         print(f"\n❓ '{query}':")
         for i, result in enumerate(results):
             print(f"  {i+1}. {result.page_content[:150]}...")
 
-if __name__ == "__main__":
+    print(f"\n🔀 {retriever.filtered} requêtes préfiltrées par nutriments, "
+          f"{retriever.keyword_only} servies par BM25 seul, "
+          f"{retriever.fused} par fusion BM25 + FAISS")
+    stats = retriever.cache.stats()
+    print(f"🗂️ Cache requêtes: {stats['size']}/{stats['max_size']} entrées")
+    for kind, counts in stats['kinds'].items():
+        print(f"   - {kind}: {counts['hits']} hits, {counts['misses']} misses ({counts['hit_rate']:.0%})")
+    print_cache_stats(embeddings)
+
+def check_rag(budget=CHECK_BUDGET_S, compare_rows=False):
+    """Vérifie le CSV et l'index sans charger LangChain, FAISS ni le modèle
+
+    Le budget couvre le démarrage (imports compris) et les vérifications de
+    fichiers. `compare_rows` relit et hache chaque ligne de la base pour
+    compter les lignes à réindexer ; sa durée dépend de la taille de la base
+    et est mesurée à part.
+    """
+
+    ok = True
+
+    if os.path.exists(KB_PATH):
+        size = os.path.getsize(KB_PATH)
+        print(f"✅ {KB_PATH}: " + (f"{size / 1e6:.1f} Mo" if size >= 1e5 else f"{size / 1e3:.1f} Ko"))
+    else:
+        print(f"❌ Fichier {KB_PATH} manquant")
+        ok = False
+
+    folder = current_index_dir()
+    manifest = load_manifest(folder)
+    if manifest is None:
+        print(f"❌ Index {VECTORSTORE_DIR} absent ou sans manifeste")
+        ok = False
+    else:
+        if manifest.get('layout') == 'sharded':
+            files = [os.path.join('shards', slug, name) for slug in manifest.get('shards', {})
+                     for name in ('index.faiss', 'index.pkl')]
+        else:
+            files = ['index.faiss', 'index.pkl']
+        missing = [name for name in files + ['bm25.json', 'nutrients.json']
+                   if not os.path.exists(os.path.join(folder, name))]
+        size = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(folder) for name in names)
+        layout = f", {len(manifest['shards'])} catégories" if manifest.get('layout') == 'sharded' else ""
+        index = manifest.get('index', {})
+        params = ', '.join(f"{name}={index[name]}" for name in INDEX_PARAMS.get(index.get('type'), [])
+                           if name in index)
+        print(f"✅ Index {manifest.get('version', '?')}: {index.get('type', 'flat')}"
+              f"{f' ({params})' if params else ''}{layout}, "
+              f"dimension {manifest.get('dimension', '?')}, {len(manifest.get('rows', {}))} aliments, "
+              f"{size / 1e6:.1f} Mo")
+        versions = index_store.list_versions(VECTORSTORE_DIR)
+        if versions:
+            print(f"📌 Version publiée {index_store.current_version(VECTORSTORE_DIR)} "
+                  f"({len(versions)} conservées, rétention {INDEX_RETENTION})")
+        else:
+            print("⚠️ Index à l'ancien format, non versionné (python rag_setup.py build)")
+        if missing:
+            print(f"❌ Fichiers manquants: {', '.join(missing)}")
+            ok = False
+        if manifest.get('model') != EMBEDDING_MODEL:
+            print(f"❌ Index construit avec {manifest.get('model')}, modèle configuré: {EMBEDDING_MODEL}")
+            ok = False
+
+    heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+    if heavy:
+        print(f"❌ Imports lourds chargés par check: {', '.join(heavy)}")
+        ok = False
+
+    elapsed = time.perf_counter() - _STARTED
+    print(f"⏱️ check exécuté en {elapsed * 1000:.0f} ms (budget {budget * 1000:.0f} ms)")
+    if elapsed > budget:
+        ok = False
+
+    if compare_rows and manifest is not None and os.path.exists(KB_PATH):
+        started = time.perf_counter()
+        # Lire Parquet/Arrow charge pyarrow, ce qui est admis hors budget
+        rows = read_kb_rows()
+        # Après déduplication, les empreintes de toutes les lignes sources font foi
+        indexed = manifest.get('sources') or {key: entry['hash'] for key, entry in manifest.get('rows', {}).items()}
+        stale = sum(1 for key, h, _ in rows if indexed.get(key) != h)
+        stale += len(set(indexed) - {key for key, _, _ in rows})
+        if stale:
+            print(f"⚠️ {stale} lignes à réindexer sur {len(rows)} (python rag_setup.py build)")
+        else:
+            print(f"✅ {len(rows)} aliments à jour dans l'index")
+        print(f"⏱️ Lignes comparées en {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    return ok
+
+def bench_rag(queries=None, k=4, repeat=20):
+    """Mesure le chargement de l'index et la latence des recherches"""
+
+    queries = queries or TEST_QUERIES
+
+    started = time.perf_counter()
+    retriever = load_retriever()
+    load_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    retriever.search_many(queries, k=k)
+    first_ms = (time.perf_counter() - started) * 1000
+
+    # Sans cache de requêtes, chaque recherche refait le travail complet
+    retriever.cache = None
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter()
+            retriever.search(query, k=k)
+            latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+
+    print(f"⏱️ Chargement (imports, modèle, index): {load_s:.2f}s")
+    print(f"⏱️ Premières requêtes ({len(queries)}): {first_ms:.1f} ms")
+    print(f"⏱️ Recherche: moyenne {sum(latencies) / len(latencies):.2f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f} ms sur {len(latencies)} requêtes")
+
+def parity_check(min_cosine=PARITY_MIN_COSINE, limit=200):
+    """Compare les embeddings ONNX int8 à ceux de PyTorch sur la base et les requêtes de test"""
+
+    from onnx_embeddings import parity_report
+
+    rows = read_kb_rows() if os.path.exists(KB_PATH) else []
+    documents = [doc.page_content for doc in load_kb_documents(rows[:limit])[0]]
+
+    report = parity_report(load_embedding_model('torch'), load_embedding_model('onnx'),
+                           list(TEST_QUERIES), documents)
+    print(f"📐 Parité ONNX int8 / PyTorch sur {report['texts']} textes: "
+          f"cosinus min {report['cosine_min']:.4f}, moyen {report['cosine_mean']:.4f}")
+    if report['top1_agreement'] is not None:
+        print(f"🎯 Même meilleur document pour {report['top1_agreement']:.0%} des requêtes")
+    print(f"⚡ {report['candidate_texts_per_s']:.1f} textes/s contre "
+          f"{report['reference_texts_per_s']:.1f} en PyTorch (x{report['speedup']:.1f})")
+
+    if report['cosine_min'] < min_cosine:
+        print(f"❌ Cosinus minimal sous le seuil de {min_cosine}")
+        return False
+    print("✅ Backend ONNX conforme")
+    return True
+
+def main(argv=None):
+    global EMBEDDING_BACKEND, KB_PATH, INDEX_RETENTION
+
+    parser = argparse.ArgumentParser(description="Configuration du RAG NUTRIKAL")
+    parser.add_argument('--backend', choices=EMBEDDING_BACKENDS, default=EMBEDDING_BACKEND,
+                        help="moteur d'inférence du modèle d'embeddings")
+    parser.add_argument('--kb', default=KB_PATH,
+                        help="base nutritionnelle (.csv, .parquet ou .arrow)")
+    parser.add_argument('--keep', type=int, default=INDEX_RETENTION,
+                        help="nombre de versions de l'index conservées")
+    commands = parser.add_subparsers(dest='command')
+
+    build = commands.add_parser('build', help="(ré)indexer nutrition_kb.csv")
+    build.add_argument('--full', action='store_true',
+                       help="reconstruire l'index complet au lieu d'une mise à jour incrémentale")
+    build.add_argument('--batch-size', type=int, default=EMBEDDING_BATCH_SIZE,
+                       help="nombre de documents encodés par lot")
+    build.add_argument('--workers', type=int, default=1,
+                       help="nombre de processus d'encodage (0 = tous les cœurs)")
+    build.add_argument('--index', choices=INDEX_TYPES, default='flat',
+                       help="type d'index FAISS")
+    build.add_argument('--nlist', type=int, help="nombre de listes IVF")
+    build.add_argument('--nprobe', type=int, help="listes IVF visitées par requête")
+    build.add_argument('--hnsw-m', type=int, help="voisins par nœud HNSW")
+    build.add_argument('--ef-search', type=int, help="largeur de recherche HNSW")
+    build.add_argument('--pq-m', type=int, help="nombre de sous-quantifieurs PQ")
+    build.add_argument('--index-report', action='store_true',
+                       help="mesurer le rappel de l'index par rapport à l'index exact")
+    build.add_argument('--sharded', action='store_true',
+                       help="un index par catégorie, interrogés en parallèle")
+    build.add_argument('--shard', action='append', metavar='CATEGORIE',
+                       help="reconstruire uniquement cet index de catégorie (répétable)")
+    build.add_argument('--dedup', action='store_true',
+                       help="fusionner les aliments quasi dupliqués avant l'indexation")
+
+    commands.add_parser('dedup', help="lister les aliments quasi dupliqués sans rien indexer")
+
+    ingest = commands.add_parser('ingest', help="ingérer un gros export CSV par blocs, avec reprise")
+    ingest.add_argument('source', help="table de composition à ingérer")
+    ingest.add_argument('--output', default='nutrition_kb.csv', help="CSV normalisé produit")
+    ingest.add_argument('--chunk-size', type=int, default=INGEST_CHUNK_SIZE,
+                        help="lignes lues, validées et encodées par bloc")
+    ingest.add_argument('--checkpoint-every', type=int, default=INGEST_CHECKPOINT_EVERY,
+                        help="blocs entre deux points de reprise")
+    ingest.add_argument('--restart', action='store_true',
+                        help="ignorer une ingestion interrompue et repartir du début")
+    ingest.add_argument('--sep', default=',', help="séparateur de la source")
+    ingest.add_argument('--encoding', default='utf-8', help="encodage de la source")
+    ingest.add_argument('--batch-size', type=int, default=EMBEDDING_BATCH_SIZE)
+    ingest.add_argument('--workers', type=int, default=1)
+    ingest.add_argument('--index', choices=INDEX_TYPES, default='flat')
+    overwrite = ingest.add_mutually_exclusive_group()
+    overwrite.add_argument('--append', action='store_const', dest='mode', const='append',
+                           help="ajouter l'export aux aliments déjà présents dans --output")
+    overwrite.add_argument('--force', action='store_const', dest='mode', const='replace',
+                           help="remplacer un --output existant")
+
+    query = commands.add_parser('query', help="interroger l'index (requêtes de test par défaut)")
+    query.add_argument('queries', nargs='*')
+    query.add_argument('-k', type=int, default=2, help="nombre de résultats par requête")
+
+    check = commands.add_parser('check', help="vérifier le CSV et l'index sans charger le modèle")
+    check.add_argument('--budget', type=float, default=CHECK_BUDGET_S,
+                       help="durée maximale de la commande, en secondes")
+    check.add_argument('--rows', action='store_true',
+                       help="comparer chaque ligne de la base à l'index (hors budget)")
+
+    bench = commands.add_parser('bench', help="mesurer chargement et latence de recherche")
+    bench.add_argument('-k', type=int, default=4)
+    bench.add_argument('--repeat', type=int, default=20)
+
+    convert = commands.add_parser('convert', help="convertir la base en Parquet ou Arrow")
+    convert.add_argument('target', help="fichier produit (.parquet ou .arrow)")
+
+    parity = commands.add_parser('parity', help="comparer le backend ONNX int8 à PyTorch")
+    parity.add_argument('--min-cosine', type=float, default=PARITY_MIN_COSINE)
+    parity.add_argument('--limit', type=int, default=200, help="nombre d'aliments comparés")
+
+    args = parser.parse_args(argv)
+
+    # L'environnement transmet le choix aux processus d'encodage
+    EMBEDDING_BACKEND = os.environ['NUTRIKAL_EMBEDDING_BACKEND'] = args.backend
+    KB_PATH = os.environ['NUTRIKAL_KB_PATH'] = args.kb
+    INDEX_RETENTION = max(1, args.keep)
+
+    if args.command == 'check':
+        return 0 if check_rag(args.budget, args.rows) else 1
+    if args.command == 'query':
+        test_rag_queries(args.queries, args.k)
+        return 0
+    if args.command == 'bench':
+        bench_rag(k=args.k, repeat=args.repeat)
+        return 0
+    if args.command == 'ingest':
+        vectorstore = ingest_nutrition_kb(
+            args.source, args.output, args.chunk_size, args.batch_size,
+            args.workers or os.cpu_count(), index_config(type=args.index),
+            resume=not args.restart, checkpoint_every=args.checkpoint_every,
+            sep=args.sep, encoding=args.encoding, mode=args.mode
+        )
+        return 0 if vectorstore else 1
+    if args.command == 'dedup':
+        dedup_kb_rows(read_kb_rows(), verbose=True)
+        return 0
+    if args.command == 'convert':
+        return 0 if convert_kb(args.target) else 1
+    if args.command == 'parity':
+        return 0 if parity_check(args.min_cosine, args.limit) else 1
+
+    build_args = args if args.command == 'build' else parser.parse_args(['build'])
+
     # Créer les données nutritionnelles si elles n'existent pas
-    if not os.path.exists('nutrition_kb.csv'):
+    if not os.path.exists(KB_PATH):
         create_nutrition_kb_csv()
 
     # Configurer le RAG
-    vectorstore = setup_nutrition_rag()
+    vectorstore = setup_nutrition_rag(
+        incremental=not build_args.full,
+        batch_size=build_args.batch_size,
+        workers=build_args.workers or os.cpu_count(),
+        config=index_config(
+            type=build_args.index, nlist=build_args.nlist, nprobe=build_args.nprobe,
+            M=build_args.hnsw_m, efSearch=build_args.ef_search, pq_m=build_args.pq_m
+        ),
+        report=build_args.index_report,
+        sharded=build_args.sharded,
+        shards=build_args.shard,
+        dedup=build_args.dedup
+    )
+
+    if not vectorstore:
+        print("\n❌ Échec de la configuration RAG")
+        return 1
 
-    if vectorstore:
+    if args.command is None:
         # Tester les requêtes
         test_rag_queries()
         print("\n🎉 Configuration RAG terminée avec succès!")
-    else:
-        print("\n❌ Échec de la configuration RAG")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache sémantique des réponses de l'assistant NUTRIKAL
+Réutilise la réponse à une question déjà posée lorsque la nouvelle question
+en est assez proche (similarité cosinus des embeddings MiniLM)
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+class SemanticCache:
+    """Cache LRU de réponses, interrogé par similarité de questions
+
+    Chaque réponse est rangée sous un espace de noms (modèle, prompt système,
+    version du contexte RAG) : une réponse n'est jamais réutilisée avec un
+    autre prompt ni après une reconstruction de l'index.
+    """
+
+    def __init__(self, threshold=0.92, max_size=512, ttl=24 * 3600, clock=time.monotonic):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._similarities = 0.0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def namespace(*parts):
+        """Empreinte des éléments qui conditionnent la réponse"""
+
+        payload = '\0'.join(str(part) for part in parts)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype='float32')
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, namespace, vector):
+        """Retourne (réponse, similarité) de la question la plus proche, ou None"""
+
+        vector = self._unit(vector)
+        with self._lock:
+            now = self.clock()
+            for entry_id in [i for i, entry in self._entries.items() if now - entry[1] > self.ttl]:
+                del self._entries[entry_id]
+                self.expired += 1
+
+            candidates = [(i, entry) for i, entry in self._entries.items() if entry[0] == namespace]
+            if candidates:
+                similarities = np.stack([entry[2] for _, entry in candidates]) @ vector
+                best = int(similarities.argmax())
+                if similarities[best] >= self.threshold:
+                    entry_id, entry = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    self._similarities += float(similarities[best])
+                    return entry[3], float(similarities[best])
+
+            self.misses += 1
+            return None
+
+    def put(self, namespace, vector, answer):
+        with self._lock:
+            self._entries[self._next_id] = (namespace, self.clock(), self._unit(vector), answer)
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Compteurs de hits/misses, similarité moyenne des hits, évictions"""
+
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'mean_hit_similarity': self._similarities / self.hits if self.hits else None,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'threshold': self.threshold
+        }
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Index FAISS partitionné par catégorie pour le RAG NUTRIKAL
+Un index par valeur de `categorie` (Poisson, Fruits, Légumes verts...),
+reconstructible indépendamment, et un routeur qui n'interroge que les
+catégories citées par la requête ou, à défaut, tous les index en parallèle
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from faiss_index import load_vectorstore, search_among
+from hybrid_search import tokenize
+
+SHARD_MANIFEST = 'shard.json'
+
+def shard_slug(category):
+    """Nom de dossier d'une catégorie ("Fruits à coque" -> "fruits-a-coque")"""
+
+    name = unicodedata.normalize('NFKD', category)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return '-'.join(name.lower().split()) or 'sans-categorie'
+
+def group_by_category(rows):
+    """Répartit les tuples (clé, empreinte, ligne) par catégorie, dans l'ordre du CSV"""
+
+    groups = {}
+    for key, h, row in rows:
+        groups.setdefault(row.get('categorie', '').strip(), []).append((key, h, row))
+    return groups
+
+def shard_version(rows, config, model):
+    payload = json.dumps({'model': model, 'index': config, 'rows': [[key, h] for key, h, _ in rows]},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def load_shard_manifest(folder):
+    path = os.path.join(folder, SHARD_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_shard(vectorstore, folder, manifest):
+    """Sauvegarde un index de catégorie et son manifeste"""
+
+    os.makedirs(folder, exist_ok=True)
+    vectorstore.save_local(folder)
+    with open(os.path.join(folder, SHARD_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+def link_shard(source, target):
+    """Reprend un index de catégorie inchangé dans une nouvelle version
+
+    Les fichiers sont liés en dur (aucune copie) ; copiés si le système de
+    fichiers ne le permet pas. Les fichiers ne sont jamais réécrits sur
+    place, une version ne peut donc pas modifier ceux d'une autre.
+    """
+
+    def link(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    shutil.copytree(source, target, copy_function=link)
+
+class ShardRouter:
+    """Recherche vectorielle répartie sur les index de catégorie
+
+    Expose ce qu'utilise HybridRetriever d'un vectorstore (`docstore`,
+    `embedding_function`, `similarity_search`) ainsi que `search_vectors` et
+    `search_among`, qui remplacent la recherche sur l'index unique.
+    """
+
+    def __init__(self, shards, embeddings, workers=None):
+        self.shards = shards
+        self.embedding_function = embeddings
+        self.executor = ThreadPoolExecutor(max_workers=workers or max(1, len(shards)),
+                                           thread_name_prefix='rag-shard')
+        self.dimension = next(iter(shards.values()))[1].index.d if shards else None
+        self.docstore = self
+        self._owner = {}
+        self._positions = {}
+        self._terms = {}
+        for slug, (category, vectorstore) in shards.items():
+            self._terms[slug] = set(tokenize(category))
+            for pos, doc_id in vectorstore.index_to_docstore_id.items():
+                self._owner[doc_id] = slug
+                self._positions[doc_id] = pos
+
+    @classmethod
+    def load(cls, folder, embeddings, mmap=True, workers=None):
+        shards = {}
+        for slug in sorted(os.listdir(folder)):
+            manifest = load_shard_manifest(os.path.join(folder, slug))
+            if manifest is None:
+                continue
+            vectorstore = load_vectorstore(os.path.join(folder, slug), embeddings,
+                                           manifest['index'], mmap=mmap)
+            shards[slug] = (manifest['category'], vectorstore)
+        return cls(shards, embeddings, workers)
+
+    def search(self, doc_id):
+        """Document d'un ID, quel que soit son index (interface docstore)"""
+
+        return self.shards[self._owner[doc_id]][1].docstore.search(doc_id)
+
+    def route(self, query):
+        """Catégories citées par la requête ; None pour interroger tous les index"""
+
+        terms = set(tokenize(query))
+        slugs = [slug for slug, category_terms in self._terms.items()
+                 if category_terms and category_terms <= terms]
+        return slugs or None
+
+    def _search_shard(self, slug, vectors, k):
+        vectorstore = self.shards[slug][1]
+        distances, found = vectorstore.index.search(vectors, min(k, vectorstore.index.ntotal))
+        ids = vectorstore.index_to_docstore_id
+        return [[(d, ids[pos]) for d, pos in zip(row_d, row_p) if pos != -1]
+                for row_d, row_p in zip(distances, found)]
+
+    def search_vectors(self, vectors, k, routes=None):
+        """Recherche groupée : une liste d'IDs par vecteur, fusionnée par distance
+
+        `routes[i]` restreint le vecteur i à certaines catégories (None :
+        toutes). Chaque index reçoit en un seul lot les vecteurs qui le
+        concernent, et les index sont interrogés en parallèle.
+        """
+
+        vectors = np.array(vectors, dtype='float32')
+        routes = routes or [None] * len(vectors)
+        rows = {slug: [i for i, route in enumerate(routes) if route is None or slug in route]
+                for slug in self.shards}
+        futures = {
+            slug: self.executor.submit(self._search_shard, slug, vectors[selected], k)
+            for slug, selected in rows.items() if selected
+        }
+
+        hits = [[] for _ in vectors]
+        for slug, future in futures.items():
+            for i, found in zip(rows[slug], future.result()):
+                hits[i].extend(found)
+        return [[doc_id for _, doc_id in sorted(found, key=lambda hit: hit[0])[:k]] for found in hits]
+
+    def search_among(self, vector, k, doc_ids):
+        """Recherche restreinte à des documents, dans les seuls index qui les contiennent"""
+
+        by_shard = {}
+        for doc_id in doc_ids:
+            by_shard.setdefault(self._owner[doc_id], []).append(self._positions[doc_id])
+
+        futures = {slug: self.executor.submit(search_among, self.shards[slug][1].index, vector, k, positions)
+                   for slug, positions in by_shard.items()}
+        found = []
+        for slug, future in futures.items():
+            ids = self.shards[slug][1].index_to_docstore_id
+            found.extend((d, ids[pos]) for d, pos in zip(*future.result()) if pos != -1)
+        return [doc_id for _, doc_id in sorted(found, key=lambda hit: hit[0])[:k]]
+
+    def similarity_search(self, query, k=4):
+        vector = self.embedding_function.embed_query(query)
+        ids = self.search_vectors([vector], k, [self.route(query)])[0]
+        return [self.search(doc_id) for doc_id in ids]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Budget de démarrage de `rag_setup.py check`
+La commande tourne dans un processus neuf, sur une base de 50 000 lignes
+et un index publié factice : elle doit rester sous le budget sans importer
+de dépendance lourde
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import subprocess
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROWS = 50_000
+WALL_BUDGET_S = 1.0
+
+PROBE = """
+import sys, json
+import rag_setup
+code = rag_setup.main(sys.argv[1:])
+print(json.dumps({'code': code, 'heavy': [m for m in rag_setup.HEAVY_MODULES if m in sys.modules]}))
+"""
+
+def make_index(folder):
+    """Base CSV volumineuse et version publiée minimale, sans FAISS"""
+
+    with open(os.path.join(folder, 'nutrition_kb.csv'), 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['aliment', 'categorie', 'calories_100g', 'proteines_100g', 'omega3_100g',
+                         'magnesium_100g', 'benefices_cerveau', 'conseils_consommation'])
+        for i in range(ROWS):
+            writer.writerow([f'Aliment {i}', 'Divers', 100, 10, 0.5, 50, 'Mémoire', '100 g par jour'])
+
+    root = os.path.join(folder, 'nutrikal_vectorstore')
+    version = os.path.join(root, 'versions', '20260101T000000.000000-test')
+    os.makedirs(version)
+    for name in ('index.faiss', 'index.pkl', 'bm25.json', 'nutrients.json'):
+        open(os.path.join(version, name), 'w').close()
+    with open(os.path.join(version, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump({'model': 'sentence-transformers/all-MiniLM-L6-v2', 'version': 'test',
+                   'index': {'type': 'flat'}, 'dimension': 384, 'rows': {}}, f)
+    with open(os.path.join(root, 'CURRENT'), 'w', encoding='utf-8') as f:
+        f.write('20260101T000000.000000-test')
+
+def run_check(folder, *args):
+    env = dict(os.environ, PYTHONPATH=AI_DIR)
+    env.pop('NUTRIKAL_KB_PATH', None)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', PROBE, 'check', *args], cwd=folder, env=env,
+                            capture_output=True, text=True, timeout=60)
+    elapsed = time.perf_counter() - started
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stdout, elapsed
+
+def test_check_within_budget_without_heavy_imports(tmp_path):
+    make_index(tmp_path)
+    report, output, elapsed = run_check(tmp_path)
+
+    assert report['heavy'] == [], output
+    assert report['code'] == 0, output
+    assert elapsed < WALL_BUDGET_S, f"check a pris {elapsed:.2f} s\n{output}"
+
+def test_check_rows_reports_stale_rows_outside_budget(tmp_path):
+    make_index(tmp_path)
+    report, output, _ = run_check(tmp_path, '--rows')
+
+    assert report['code'] == 0, output
+    assert f"{ROWS} lignes à réindexer" in output
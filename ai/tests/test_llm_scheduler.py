@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Échéances des requêtes fusionnées dans l'ordonnanceur
+Une requête fusionnée n'applique que sa propre échéance : celle du premier
+demandeur, plus courte, ne fait pas échouer les suivants
+"""
+
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_scheduler import DeadlineExceeded, LLMScheduler
+
+def occupy(scheduler):
+    """Occupe l'unique emplacement jusqu'à ce que l'événement retourné soit levé"""
+
+    release = threading.Event()
+    thread = threading.Thread(target=scheduler.run, args=('occupant', release.wait), daemon=True)
+    thread.start()
+    while scheduler.in_flight == 0:
+        time.sleep(0.005)
+    return release, thread
+
+def in_thread(fn):
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = fn()
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread, outcome
+
+def test_run_follower_outlives_leader_deadline():
+    scheduler = LLMScheduler(max_in_flight=1)
+    release, occupant = occupy(scheduler)
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return 'réponse'
+
+    leader, leader_out = in_thread(lambda: scheduler.run('prompt', generate, 'A',
+                                                         deadline=scheduler.deadline_in(0.1)))
+    time.sleep(0.02)
+    follower, follower_out = in_thread(lambda: scheduler.run('prompt', generate, 'B',
+                                                             deadline=scheduler.deadline_in(5)))
+    leader.join()
+    assert isinstance(leader_out['error'], DeadlineExceeded)
+
+    time.sleep(0.1)
+    release.set()
+    follower.join(5)
+    occupant.join(5)
+    assert follower_out == {'result': 'réponse'}
+    assert calls == [1]
+    assert scheduler.metrics()['coalesced'] == 1
+
+def test_run_without_waiters_leaves_the_queue():
+    scheduler = LLMScheduler(max_in_flight=1)
+    release, occupant = occupy(scheduler)
+
+    with pytest.raises(DeadlineExceeded):
+        scheduler.run('prompt', lambda: 'réponse', 'A', deadline=scheduler.deadline_in(0.05))
+    time.sleep(0.05)
+    assert scheduler.metrics()['queue_depth'] == 0
+    release.set()
+    occupant.join(5)
+
+def test_stream_follower_outlives_leader_deadline():
+    scheduler = LLMScheduler(max_in_flight=1)
+    release, occupant = occupy(scheduler)
+
+    leader, leader_out = in_thread(lambda: list(scheduler.stream(
+        'prompt', lambda: iter(['a', 'b']), 'A', deadline=scheduler.deadline_in(0.1))))
+    time.sleep(0.02)
+    follower, follower_out = in_thread(lambda: list(scheduler.stream(
+        'prompt', lambda: iter(['a', 'b']), 'B', deadline=scheduler.deadline_in(5))))
+    leader.join()
+    assert isinstance(leader_out['error'], DeadlineExceeded)
+
+    time.sleep(0.1)
+    release.set()
+    follower.join(5)
+    occupant.join(5)
+    assert follower_out == {'result': ['a', 'b']}
@@ -0,0 +1,74 @@
+// backend/__tests__/substitutionIndex.test.js
+
+const { SubstitutionIndex, normalizeName, parseCsv } = require('../utils/substitutionIndex');
+
+const CATEGORIES = ['Légumes', 'Céréales', 'Poissons', 'Viandes', 'Fruits'];
+
+// Générateur pseudo-aléatoire déterministe (Park-Miller)
+function random(seed) {
+  return () => (seed = (seed * 16807) % 2147483647) / 2147483647;
+}
+
+function makeFoods(n, rnd) {
+  return Array.from({ length: n }, (_, i) => ({
+    food_name:          `Aliment ${i}`,
+    food_category:      CATEGORIES[i % CATEGORIES.length],
+    calories_per_100g:  rnd() * 600,
+    protein_per_100g:   rnd() * 40,
+    omega3_per_100g:    i % 7 ? rnd() * 3 : null,
+    magnesium_per_100g: rnd() * 300
+  }));
+}
+
+// Recherche exhaustive de référence dans l'espace normalisé de l'index
+function bruteForce(index, name, { k = 1, exclude = [], accept = null } = {}) {
+  const self = index.byName.get(normalizeName(name));
+  const excluded = new Set(exclude.map(normalizeName));
+  const dims = index.points.length / index.foods.length;
+  return index.foods
+    .map((food, i) => {
+      let distance = 0;
+      for (let d = 0; d < dims; d++) {
+        distance += (index.points[self * dims + d] - index.points[i * dims + d]) ** 2;
+      }
+      return { i, distance };
+    })
+    .filter(({ i }) => i !== self && !excluded.has(index.names[i]) &&
+      (!accept || accept(index.foods[i])))
+    .sort((a, b) => a.distance - b.distance)
+    .slice(0, k)
+    .map(({ i }) => index.foods[i].food_name);
+}
+
+describe('SubstitutionIndex', () => {
+  test('donne les mêmes voisins que la recherche exhaustive', () => {
+    const rnd = random(42);
+    const index = new SubstitutionIndex(makeFoods(3000, rnd));
+
+    for (let q = 0; q < 500; q++) {
+      const name = index.foods[Math.floor(rnd() * index.foods.length)].food_name;
+      const exclude = bruteForce(index, name, { k: 2 });
+      const accept = q % 2 ? f => f.food_category === 'Légumes' : null;
+      const found = index.nearest(name, { k: 5, exclude, accept }).map(r => r.food.food_name);
+      expect(found).toEqual(bruteForce(index, name, { k: 5, exclude, accept }));
+    }
+  });
+
+  test('écarte les noms exclus sans tenir compte des accents ni de la casse', () => {
+    const index = new SubstitutionIndex([
+      { food_name: 'Saumon', calories_per_100g: 208, protein_per_100g: 25, omega3_per_100g: 1.8, magnesium_per_100g: 29 },
+      { food_name: 'Maquereau', calories_per_100g: 205, protein_per_100g: 19, omega3_per_100g: 2.6, magnesium_per_100g: 76 },
+      { food_name: 'Épinards', calories_per_100g: 23, protein_per_100g: 2.9, omega3_per_100g: 0.1, magnesium_per_100g: 79 }
+    ]);
+
+    expect(index.substitute('saumon').food_name).toBe('Maquereau');
+    expect(index.substitute('Saumon', ['MAQUEREAU']).food_name).toBe('Épinards');
+    expect(index.substitute('Saumon', ['maquereau', 'epinards'])).toBeNull();
+    expect(index.nearest('Inconnu')).toBeNull();
+  });
+
+  test('lit les champs entre guillemets du CSV', () => {
+    const rows = parseCsv('aliment,conseils\nSaumon,"Grillé, ""vapeur""\nou cru"\n');
+    expect(rows).toEqual([{ aliment: 'Saumon', conseils: 'Grillé, "vapeur"\nou cru' }]);
+  });
+});
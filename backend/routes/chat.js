@@ -0,0 +1,108 @@
+// backend/routes/chat.js
+
+// Service Python de l'assistant (ai/rag_service.py)
+const AI_URL = process.env.NUTRIKAL_AI_URL || 'http://localhost:8765';
+// Échéance d'une réponse : au-delà, l'attente ou la génération est abandonnée
+const CHAT_DEADLINE_S = Number(process.env.NUTRIKAL_CHAT_DEADLINE_S) || 60;
+// Identifiant d'un fil de discussion, choisi par le client
+const CONVERSATION_ID = /^[A-Za-z0-9_-]{1,64}$/;
+
+/**
+ * Routes de l'assistant : réponses diffusées token par token (Server-Sent Events).
+ */
+async function chatRoutes(fastify, options) {
+  // Discuter avec l'assistant (protégé)
+  fastify.post(
+    '/stream',
+    { preHandler: fastify.authenticate },
+    async (request, reply) => {
+      const { message, prompt, conversation_id } = request.body || {};
+      if (!message) {
+        return reply.code(400).send({ error: 'Message requis' });
+      }
+      if (conversation_id !== undefined && !CONVERSATION_ID.test(String(conversation_id))) {
+        return reply.code(400).send({ error: 'conversation_id invalide' });
+      }
+
+      const started = Date.now();
+      // Interrompre la génération si le navigateur ferme la connexion
+      const controller = new AbortController();
+      reply.raw.on('close', () => {
+        if (!reply.raw.writableEnded) controller.abort();
+      });
+
+      let upstream;
+      try {
+        upstream = await fetch(`${AI_URL}/chat`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({
+            message,
+            prompt,
+            // Un fil par conversation du client, préfixé par l'utilisateur pour
+            // qu'un client ne reprenne pas l'historique d'un autre. Sans fil,
+            // la question est traitée seule et le cache sémantique s'applique
+            conversation_id: conversation_id
+              ? `${request.user.userId}:${conversation_id}`
+              : undefined,
+            user_id: String(request.user.userId),
+            priority: 'interactive',
+            deadline_s: CHAT_DEADLINE_S
+          }),
+          signal: controller.signal
+        });
+      } catch (err) {
+        return reply.code(502).send({ error: `Assistant injoignable: ${err.message}` });
+      }
+      if (!upstream.ok) {
+        const body = await upstream.json().catch(() => ({}));
+        return reply.code(upstream.status).send({ error: body.error || 'Assistant indisponible' });
+      }
+
+      // La réponse est écrite directement sur le socket, au fil des tokens
+      reply.hijack();
+      reply.raw.writeHead(200, {
+        ...reply.getHeaders(),
+        'Content-Type': 'text/event-stream; charset=utf-8',
+        'Cache-Control': 'no-cache, no-transform',
+        'Connection': 'keep-alive',
+        'X-Accel-Buffering': 'no'
+      });
+      const send = (event, data) => reply.raw.write(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`);
+
+      let ttft = null;
+      let buffer = '';
+      const decoder = new TextDecoder();
+      try {
+        for await (const chunk of upstream.body) {
+          buffer += decoder.decode(chunk, { stream: true });
+          let newline;
+          while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (!line) continue;
+
+            const event = JSON.parse(line);
+            if (event.token !== undefined) {
+              if (ttft === null) ttft = Date.now() - started;
+              send('token', { token: event.token });
+            } else if (event.done) {
+              // TTFT et durée totale vus par l'API, en plus de ceux de l'assistant
+              const total = Date.now() - started;
+              send('done', { ...event.done, api_ttft_ms: ttft, api_total_ms: total });
+              request.log.info({ ttft_ms: ttft, total_ms: total, cached: event.done.cached }, 'chat terminé');
+            } else if (event.error) {
+              send('error', { error: event.error });
+            }
+          }
+        }
+      } catch (err) {
+        if (!controller.signal.aborted) send('error', { error: err.message });
+      } finally {
+        reply.raw.end();
+      }
+    }
+  );
+}
+
+module.exports = chatRoutes;
@@ -0,0 +1,59 @@
+// backend/routes/foods.js
+
+const { supabase } = require('../config/database');
+const { FEATURES, getSubstitutionIndex } = require('../utils/substitutionIndex');
+
+const MAX_SUBSTITUTES = 20;
+
+/**
+ * Routes de la base d'aliments.
+ */
+async function foodRoutes(fastify, options) {
+  // Aliments les plus proches en nutriments d'un aliment donné (protégé)
+  // GET /substitutes?food=Saumon&exclude=Sardines,Maquereau&k=3&category=Poissons
+  fastify.get(
+    '/substitutes',
+    { preHandler: fastify.authenticate },
+    async (request, reply) => {
+      const { food, category } = request.query;
+      if (!food) {
+        return reply.code(400).send({ error: 'Paramètre food requis' });
+      }
+      const k = Math.min(Math.max(Number(request.query.k) || 3, 1), MAX_SUBSTITUTES);
+      // exclude répété ou séparé par des virgules
+      const exclude = [].concat(request.query.exclude || [])
+        .flatMap(names => String(names).split(','))
+        .filter(Boolean);
+
+      try {
+        const index = await getSubstitutionIndex(supabase);
+        const started = process.hrtime.bigint();
+        const results = index.nearest(food, {
+          k,
+          exclude,
+          accept: category ? f => f.food_category === category : null
+        });
+        const tookUs = Number(process.hrtime.bigint() - started) / 1e3;
+        if (results === null) {
+          return reply.code(404).send({ error: `Aliment inconnu: ${food}` });
+        }
+
+        reply.send({
+          food: index.get(food),
+          substitutes: results.map(({ food: substitute, distance }) => ({
+            food_name:     substitute.food_name,
+            food_category: substitute.food_category,
+            source:        substitute.source,
+            distance,
+            ...Object.fromEntries(FEATURES.map(feature => [feature, substitute[feature]]))
+          })),
+          took_us: tookUs
+        });
+      } catch (err) {
+        reply.code(500).send({ error: err.message });
+      }
+    }
+  );
+}
+
+module.exports = foodRoutes;
@@ -6,6 +6,7 @@ const {
   calculateNutritionScore,
   calculateBrainScore
 } = require('../utils/nutritionScore');
+const { getSubstitutionIndex, normalizeName } = require('../utils/substitutionIndex');
 
 /**
  * Routes pour les plans nutritionnels et repas consommés.
@@ -25,19 +26,15 @@ async function mealPlanRoutes(fastify, options) {
           .single();
         if (profileError) throw profileError;
 
-        // Récupérer les aliments et filtrer
+        // Récupérer les aliments ; les allergies et aversions sont remplacées au tirage
         const { data: foods, error: foodsError } = await supabase
           .from('food_database')
           .select('*');
         if (foodsError) throw foodsError;
-
-        const filtered = foods.filter(f =>
-          !profile.allergies?.includes(f.food_name) &&
-          !profile.food_aversions?.includes(f.food_name)
-        );
+        const index = await getSubstitutionIndex(supabase);
 
         // Générer et sauvegarder le plan hebdomadaire
-        const weekPlan = generateWeeklyPlan(profile, filtered);
+        const weekPlan = generateWeeklyPlan(profile, foods, index);
         const { data: savedPlan, error: saveError } = await supabase
           .from('meal_plans')
           .insert([{
@@ -118,17 +115,27 @@ async function mealPlanRoutes(fastify, options) {
 // Fonctions utilitaires internes
 //
 
+// Composantes d'un repas : une source de protéines, un légume, une céréale
+const MEAL_ROLES = [
+  f => f.protein_per_100g > 15,
+  f => f.food_category === 'Légumes',
+  f => f.food_category === 'Céréales'
+];
+
 /**
  * Génère un plan hebdomadaire simple.
  */
-function generateWeeklyPlan(profile, foods) {
+function generateWeeklyPlan(profile, foods, index) {
+  const excluded = new Set(
+    [...(profile.allergies || []), ...(profile.food_aversions || [])].map(normalizeName)
+  );
   const plan = [];
   for (let day = 1; day <= 7; day++) {
     plan.push({
       day,
-      breakfast: selectMeal(foods, profile),
-      lunch:     selectMeal(foods, profile),
-      dinner:    selectMeal(foods, profile)
+      breakfast: selectMeal(foods, profile, index, excluded),
+      lunch:     selectMeal(foods, profile, index, excluded),
+      dinner:    selectMeal(foods, profile, index, excluded)
     });
   }
   return plan;
@@ -136,14 +143,25 @@ function generateWeeklyPlan(profile, foods) {
 
 /**
  * Sélectionne aléatoirement un repas équilibré.
+ * Un aliment exclu (allergie, aversion) est remplacé par l'aliment de
+ * food_database le plus proche en nutriments qui tient le même rôle.
  */
-function selectMeal(foods, profile) {
-  const prot = foods.filter(f => f.protein_per_100g > 15);
-  const veg  = foods.filter(f => f.food_category === 'Légumes');
-  const grain= foods.filter(f => f.food_category === 'Céréales');
-
+function selectMeal(foods, profile, index, excluded) {
   const pick = arr => arr[Math.floor(Math.random() * arr.length)];
-  const p = pick(prot), v = pick(veg), g = pick(grain);
+  const substitutions = [];
+
+  const [p, v, g] = MEAL_ROLES.map(role => {
+    const food = pick(foods.filter(role));
+    if (!food || !excluded.has(normalizeName(food.food_name))) return food;
+    const substitute = index.substitute(food.food_name, excluded,
+      f => f.source === 'food_database' && role(f));
+    if (!substitute) {
+      // Aliment absent de l'index (ajouté depuis sa construction) : tirage parmi les autorisés
+      return pick(foods.filter(f => role(f) && !excluded.has(normalizeName(f.food_name))));
+    }
+    substitutions.push({ original: food.food_name, substitute: substitute.food_name });
+    return substitute;
+  });
 
   return {
     foods: [
@@ -151,6 +169,7 @@ function selectMeal(foods, profile) {
       v?.food_name,
       g?.food_name
     ].filter(Boolean),
+    substitutions,
     calories: (p?.calories_per_100g||0) + (v?.calories_per_100g||0) + (g?.calories_per_100g||0),
     protein:  (p?.protein_per_100g||0)  + (v?.protein_per_100g||0)  + (g?.protein_per_100g||0),
     omega3:   (p?.omega3_per_100g||0)   + (v?.omega3_per_100g||0)   + (g?.omega3_per_100g||0),
@@ -17,6 +17,8 @@ fastify.register(require('@fastify/jwt'), {
 fastify.register(require('./routes/users'), { prefix: '/api/users' });
 fastify.register(require('./routes/mealplans'), { prefix: '/api/mealplans' });
 fastify.register(require('./routes/scores'), { prefix: '/api/scores' });
+fastify.register(require('./routes/chat'), { prefix: '/api/chat' });
+fastify.register(require('./routes/foods'), { prefix: '/api/foods' });
 
 // Route de santé
 fastify.get('/health', async (request, reply) => {
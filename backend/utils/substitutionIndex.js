@@ -0,0 +1,248 @@
+// backend/utils/substitutionIndex.js
+
+const fs = require('fs');
+const path = require('path');
+
+// Base nutritionnelle du RAG, ajoutée aux aliments de food_database
+const KB_PATH = process.env.NUTRIKAL_KB_CSV || path.join(__dirname, '../../ai/nutrition_kb.csv');
+// Durée de vie de l'index précalculé : food_database est relue au-delà
+const INDEX_TTL_MS = (Number(process.env.NUTRIKAL_SUBSTITUTES_TTL_S) || 600) * 1000;
+
+// Dimensions de l'espace nutritionnel (valeurs pour 100 g)
+const FEATURES = ['calories_per_100g', 'protein_per_100g', 'omega3_per_100g', 'magnesium_per_100g'];
+// Colonnes correspondantes de nutrition_kb.csv
+const KB_COLUMNS = {
+  food_name:          'aliment',
+  food_category:      'categorie',
+  calories_per_100g:  'calories_100g',
+  protein_per_100g:   'proteines_100g',
+  omega3_per_100g:    'omega3_100g',
+  magnesium_per_100g: 'magnesium_100g'
+};
+
+const DIMS = FEATURES.length;
+
+/**
+ * Nom d'aliment comparable ("Épinards " -> "epinards").
+ */
+function normalizeName(name) {
+  return String(name || '')
+    .normalize('NFD')
+    .replace(/[\u0300-\u036f]/g, '')
+    .toLowerCase()
+    .trim()
+    .replace(/\s+/g, ' ');
+}
+
+function toNumber(value) {
+  if (value === null || value === undefined || value === '') return null;
+  const n = Number(String(value).replace(',', '.'));
+  return Number.isFinite(n) ? n : null;
+}
+
+/**
+ * Index k-d des aliments dans l'espace nutritionnel normalisé.
+ * Chaque nutriment est centré-réduit pour que les calories ne dominent pas
+ * les oméga-3 ; une valeur absente prend la moyenne (0 une fois réduite).
+ */
+class SubstitutionIndex {
+  /**
+   * @param {Array} foods - Aliments au format food_database ; un nom déjà vu est ignoré.
+   */
+  constructor(foods) {
+    const seen = new Set();
+    this.foods = [];
+    for (const food of foods) {
+      const key = normalizeName(food.food_name);
+      if (!key || seen.has(key)) continue;
+      seen.add(key);
+      this.foods.push(food);
+    }
+
+    this.names = this.foods.map(food => normalizeName(food.food_name));
+    this.byName = new Map(this.names.map((name, i) => [name, i]));
+    this.mean = new Float64Array(DIMS);
+    this.scale = new Float64Array(DIMS);
+    FEATURES.forEach((feature, d) => {
+      const values = this.foods.map(f => toNumber(f[feature])).filter(v => v !== null);
+      const mean = values.reduce((s, v) => s + v, 0) / (values.length || 1);
+      const variance = values.reduce((s, v) => s + (v - mean) ** 2, 0) / (values.length || 1);
+      this.mean[d] = mean;
+      this.scale[d] = Math.sqrt(variance) || 1;
+    });
+
+    this.points = new Float64Array(this.foods.length * DIMS);
+    this.foods.forEach((food, i) => this.points.set(this.vector(food), i * DIMS));
+
+    // Arbre implicite : le nœud d'une plage [lo, hi) est son milieu
+    this.order = Int32Array.from(this.foods.keys());
+    this.axes = new Uint8Array(this.foods.length);
+    this.build(0, this.foods.length);
+  }
+
+  vector(food) {
+    return FEATURES.map((feature, d) => {
+      const value = toNumber(food[feature]);
+      return value === null ? 0 : (value - this.mean[d]) / this.scale[d];
+    });
+  }
+
+  build(lo, hi) {
+    if (hi - lo <= 1) return;
+    // Coupe selon le nutriment le plus dispersé de la plage
+    let axis = 0, spread = -1;
+    for (let d = 0; d < DIMS; d++) {
+      let min = Infinity, max = -Infinity;
+      for (let j = lo; j < hi; j++) {
+        const v = this.points[this.order[j] * DIMS + d];
+        if (v < min) min = v;
+        if (v > max) max = v;
+      }
+      if (max - min > spread) { spread = max - min; axis = d; }
+    }
+    const sorted = Array.from(this.order.subarray(lo, hi))
+      .sort((a, b) => this.points[a * DIMS + axis] - this.points[b * DIMS + axis]);
+    this.order.set(sorted, lo);
+    const mid = (lo + hi) >> 1;
+    this.axes[mid] = axis;
+    this.build(lo, mid);
+    this.build(mid + 1, hi);
+  }
+
+  /**
+   * Aliment indexé sous ce nom, ou undefined.
+   */
+  get(name) {
+    const i = this.byName.get(normalizeName(name));
+    return i === undefined ? undefined : this.foods[i];
+  }
+
+  /**
+   * Les k aliments les plus proches d'un aliment (nom ou objet avec nutriments).
+   * @param {Object} options - exclude : noms à écarter ; accept : filtre sur l'aliment candidat.
+   * @returns {Array|null} [{ food, distance }] triés, null si l'aliment est inconnu.
+   */
+  nearest(food, { k = 1, exclude = [], accept = null } = {}) {
+    const self = typeof food === 'string' ? this.byName.get(normalizeName(food)) : undefined;
+    if (typeof food === 'string' && self === undefined) return null;
+    const query = self === undefined ? this.vector(food) : this.points.subarray(self * DIMS, (self + 1) * DIMS);
+    const excluded = exclude instanceof Set ? exclude : new Set([...exclude].map(normalizeName));
+
+    const best = [];
+    const visit = (lo, hi) => {
+      if (lo >= hi) return;
+      const mid = (lo + hi) >> 1;
+      const i = this.order[mid];
+      const offset = i * DIMS;
+
+      let distance = 0;
+      for (let d = 0; d < DIMS; d++) distance += (query[d] - this.points[offset + d]) ** 2;
+      if ((best.length < k || distance < best[best.length - 1].distance) && i !== self &&
+          !excluded.has(this.names[i]) && (!accept || accept(this.foods[i]))) {
+        let at = best.length;
+        while (at > 0 && best[at - 1].distance > distance) at--;
+        best.splice(at, 0, { index: i, distance });
+        if (best.length > k) best.pop();
+      }
+
+      const diff = query[this.axes[mid]] - this.points[offset + this.axes[mid]];
+      const [near, far] = diff < 0 ? [[lo, mid], [mid + 1, hi]] : [[mid + 1, hi], [lo, mid]];
+      visit(...near);
+      // L'autre côté n'est exploré que si la boule des k meilleurs le traverse
+      if (best.length < k || diff * diff < best[best.length - 1].distance) visit(...far);
+    };
+    visit(0, this.foods.length);
+
+    return best.map(({ index, distance }) => ({ food: this.foods[index], distance: Math.sqrt(distance) }));
+  }
+
+  /**
+   * Substitut le plus proche d'un aliment hors des noms exclus, ou null.
+   */
+  substitute(name, exclude = [], accept = null) {
+    return this.nearest(name, { exclude, accept })?.[0]?.food || null;
+  }
+}
+
+/**
+ * Analyse un CSV simple (guillemets doublés, retours à la ligne entre guillemets).
+ */
+function parseCsv(text) {
+  const rows = [];
+  let row = [], field = '', quoted = false;
+  for (let i = 0; i < text.length; i++) {
+    const c = text[i];
+    if (quoted) {
+      if (c === '"' && text[i + 1] === '"') { field += '"'; i++; }
+      else if (c === '"') quoted = false;
+      else field += c;
+    } else if (c === '"') quoted = true;
+    else if (c === ',') { row.push(field); field = ''; }
+    else if (c === '\n' || c === '\r') {
+      if (c === '\r' && text[i + 1] === '\n') i++;
+      row.push(field); rows.push(row); row = []; field = '';
+    } else field += c;
+  }
+  if (field || row.length) { row.push(field); rows.push(row); }
+
+  const [header = [], ...lines] = rows;
+  return lines
+    .filter(line => line.some(Boolean))
+    .map(line => Object.fromEntries(header.map((name, i) => [name.trim(), line[i] ?? ''])));
+}
+
+/**
+ * Aliments de nutrition_kb.csv au format food_database ([] si le fichier est absent).
+ */
+async function readKnowledgeBase(file = KB_PATH) {
+  let text;
+  try {
+    text = await fs.promises.readFile(file, 'utf8');
+  } catch (err) {
+    if (err.code === 'ENOENT') return [];
+    throw err;
+  }
+  return parseCsv(text.replace(/^\uFEFF/, '')).map(row => {
+    const food = { source: 'nutrition_kb' };
+    for (const [field, column] of Object.entries(KB_COLUMNS)) {
+      food[field] = FEATURES.includes(field) ? toNumber(row[column]) : row[column];
+    }
+    return food;
+  });
+}
+
+let cached = null;
+
+/**
+ * Index précalculé sur food_database et nutrition_kb.csv, reconstruit après INDEX_TTL_MS.
+ * Les aliments de food_database l'emportent sur les homonymes de la base du RAG.
+ */
+function getSubstitutionIndex(supabase) {
+  if (cached && Date.now() - cached.builtAt < INDEX_TTL_MS) return cached.index;
+
+  const builtAt = Date.now();
+  const index = (async () => {
+    const { data: foods, error } = await supabase
+      .from('food_database')
+      .select(['id', 'food_name', 'food_category', ...FEATURES].join(','));
+    if (error) throw error;
+    const kb = await readKnowledgeBase();
+    return new SubstitutionIndex([
+      ...foods.map(food => ({ ...food, source: 'food_database' })),
+      ...kb
+    ]);
+  })();
+  cached = { index, builtAt };
+  // Une construction en échec n'est pas gardée : la requête suivante réessaie
+  index.catch(() => { if (cached?.index === index) cached = null; });
+  return index;
+}
+
+module.exports = {
+  FEATURES,
+  SubstitutionIndex,
+  getSubstitutionIndex,
+  normalizeName,
+  parseCsv,
+  readKnowledgeBase
+};
@@ -6,6 +6,7 @@ import {
   SimpleGrid, Spinner, Stat, StatHelpText, StatLabel, StatNumber, Text, VStack, useToast
 } from '@chakra-ui/react';
 import axios from 'axios';
+import AssistantChat from '../../components/AssistantChat';
 
 export default function DashboardPage() {
   const [profile, setProfile] = useState(null);
@@ -122,6 +123,13 @@ export default function DashboardPage() {
           </CardBody>
         </Card>
 
+        <Card>
+          <CardBody>
+            <Heading size="md" mb={3}>Assistant NUTRIKAL</Heading>
+            <AssistantChat />
+          </CardBody>
+        </Card>
+
         <Card>
           <CardBody>
             <Heading size="md" mb={3}>Historique des scores</Heading>
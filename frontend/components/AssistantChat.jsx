@@ -0,0 +1,199 @@
+import React, { useRef, useState } from 'react';
+import {
+  Box,
+  VStack,
+  HStack,
+  Text,
+  Input,
+  Button,
+  Select,
+  useToast
+} from '@chakra-ui/react';
+
+const PROMPTS = {
+  main_prompt: 'Conseils',
+  daily_tracking_prompt: 'Suivi du jour',
+  meal_analysis_prompt: 'Analyse de repas'
+};
+
+/**
+ * Identifiant d'un nouveau fil de discussion (historique propre côté assistant).
+ */
+function newConversationId() {
+  return typeof crypto !== 'undefined' && crypto.randomUUID
+    ? crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+/**
+ * Découpe un flux Server-Sent Events en événements { event, data }.
+ */
+function parseEvents(buffer) {
+  const events = [];
+  let boundary;
+  while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+    const frame = buffer.slice(0, boundary);
+    buffer = buffer.slice(boundary + 2);
+    let event = 'message';
+    let data = '';
+    for (const line of frame.split('\n')) {
+      if (line.startsWith('event:')) event = line.slice(6).trim();
+      else if (line.startsWith('data:')) data += line.slice(5).trim();
+    }
+    if (data) events.push({ event, data: JSON.parse(data) });
+  }
+  return { events, rest: buffer };
+}
+
+export default function AssistantChat() {
+  const [messages, setMessages] = useState([]);
+  const [input, setInput] = useState('');
+  const [prompt, setPrompt] = useState('main_prompt');
+  const [streaming, setStreaming] = useState(false);
+  const abortRef = useRef(null);
+  const conversationRef = useRef(null);
+  if (conversationRef.current === null) conversationRef.current = newConversationId();
+  const toast = useToast();
+
+  // Repart d'un historique vide : les premières questions profitent du cache de réponses
+  const reset = () => {
+    conversationRef.current = newConversationId();
+    setMessages([]);
+  };
+
+  // Met à jour le dernier message (celui de l'assistant en cours d'écriture)
+  const updateLast = (update) => {
+    setMessages((current) => {
+      const next = [...current];
+      next[next.length - 1] = update(next[next.length - 1]);
+      return next;
+    });
+  };
+
+  const send = async () => {
+    const message = input.trim();
+    if (!message || streaming) return;
+
+    setInput('');
+    setStreaming(true);
+    setMessages((current) => [
+      ...current,
+      { role: 'user', content: message },
+      { role: 'assistant', content: '', metrics: null }
+    ]);
+
+    const controller = new AbortController();
+    abortRef.current = controller;
+    const started = performance.now();
+    let firstToken = null;
+
+    try {
+      const token = localStorage.getItem('token');
+      // EventSource ne permet ni POST ni en-têtes : lecture directe du flux
+      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/chat/stream`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          Authorization: `Bearer ${token}`
+        },
+        body: JSON.stringify({ message, prompt, conversation_id: conversationRef.current }),
+        signal: controller.signal
+      });
+      if (!response.ok) {
+        const body = await response.json().catch(() => ({}));
+        throw new Error(body.error || `Erreur ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        const parsed = parseEvents(buffer + decoder.decode(value, { stream: true }));
+        buffer = parsed.rest;
+
+        for (const { event, data } of parsed.events) {
+          if (event === 'token') {
+            if (firstToken === null) firstToken = performance.now() - started;
+            updateLast((last) => ({ ...last, content: last.content + data.token }));
+          } else if (event === 'done') {
+            updateLast((last) => ({
+              ...last,
+              metrics: {
+                ttft: firstToken,
+                total: performance.now() - started,
+                cached: data.cached
+              }
+            }));
+          } else if (event === 'error') {
+            throw new Error(data.error);
+          }
+        }
+      }
+    } catch (error) {
+      if (error.name !== 'AbortError') {
+        toast({
+          title: 'Assistant indisponible',
+          description: error.message,
+          status: 'error',
+          duration: 5000,
+          isClosable: true,
+        });
+      }
+    } finally {
+      abortRef.current = null;
+      setStreaming(false);
+    }
+  };
+
+  return (
+    <VStack align="stretch" spacing={4}>
+      <VStack align="stretch" spacing={3} maxH="420px" overflowY="auto">
+        {messages.length === 0 && (
+          <Text color="gray.500">Posez une question à votre assistant nutritionnel.</Text>
+        )}
+        {messages.map((m, i) => (
+          <Box
+            key={i}
+            alignSelf={m.role === 'user' ? 'flex-end' : 'flex-start'}
+            bg={m.role === 'user' ? 'purple.50' : 'gray.50'}
+            p={3}
+            rounded="md"
+            maxW="80%"
+          >
+            <Text whiteSpace="pre-wrap">{m.content || (streaming && i === messages.length - 1 ? '…' : '')}</Text>
+            {m.metrics && (
+              <Text fontSize="xs" color="gray.500" mt={1}>
+                {m.metrics.cached ? 'Réponse en cache · ' : ''}
+                Premier mot {Math.round(m.metrics.ttft ?? m.metrics.total)} ms · total {Math.round(m.metrics.total)} ms
+              </Text>
+            )}
+          </Box>
+        ))}
+      </VStack>
+
+      <HStack>
+        <Select value={prompt} onChange={(e) => setPrompt(e.target.value)} maxW="200px">
+          {Object.entries(PROMPTS).map(([value, label]) => (
+            <option key={value} value={value}>{label}</option>
+          ))}
+        </Select>
+        <Input
+          value={input}
+          onChange={(e) => setInput(e.target.value)}
+          onKeyDown={(e) => e.key === 'Enter' && send()}
+          placeholder="Ex : qu'ai-je intérêt à manger avant une réunion ?"
+        />
+        {streaming ? (
+          <Button onClick={() => abortRef.current?.abort()}>Arrêter</Button>
+        ) : (
+          <Button colorScheme="purple" onClick={send}>Envoyer</Button>
+        )}
+        <Button variant="ghost" onClick={reset} isDisabled={streaming || messages.length === 0}>
+          Nouvelle conversation
+        </Button>
+      </HStack>
+    </VStack>
+  );
+}